@@ -1,11 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+import base64
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 import json
+import uuid
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from services.gemini_service import GeminiService
 from services.supabase_service import SupabaseService
+from services.resilience import get_all_stats
+from services.cache import cache_stats
+from services.request_profiler import get_profiler
+from services.llm_ledger import (
+    get_ledger, llm_context, GROUPINGS, set_context as set_llm_context, clear_context as clear_llm_context
+)
+from services.data_access import DataAccessLayer, UNOPENED, is_unopened, is_adaptive
+from services.singleflight import diagnostic_generation, SingleflightTimeout
+from services.item_analysis import get_item_analysis
+from services.grading import GradingRecord, get_grading_cache
+from services.diagnostic_prefetch import DiagnosticPrefetcher, ROUTE as PREFETCH_ROUTE
+from services.adaptive_diagnostic import (
+    get_item_bank, get_adaptive_store, new_session as new_adaptive_session, next_item, record_answer, session_item,
+    outcome as adaptive_outcome, public_item, placeholder_test, active_session_id, MAX_QUESTIONS
+)
+from services.roadmap_inputs import roadmap_fingerprint, changed_chapters, affected_weeks, merge_weeks
+from services.roadmap_planner import plan_roadmap
+from services.tutor_service import ai_tutor_controller
+from services.chapter_router import start_router_refresh
 from utils.validators import validate_diagnostic_request, validate_submission
 
 load_dotenv()
@@ -43,6 +65,16 @@ else:
 # Initialize services
 gemini_service = GeminiService()
 supabase_service = SupabaseService()
+data_access = DataAccessLayer(supabase_service)
+grading_cache = get_grading_cache()
+# The cross-chapter router is built in the background, never on a tutor request
+start_router_refresh()
+
+# "instant" serves the local planner's roadmap and refines it with the model in the background
+ROADMAP_PLANNER = os.getenv('ROADMAP_PLANNER', 'instant').lower()
+ROADMAP_REFINE = os.getenv('ROADMAP_LLM_REFINE', 'true').lower() == 'true'
+COHORT_MAX_USERS = int(os.getenv('COHORT_MAX_USERS', '500'))
+background_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BACKGROUND_WORKERS', '2')), thread_name_prefix='background')
 
 # Fetch available chapters from database
 def get_available_chapters():
@@ -62,6 +94,47 @@ def get_available_chapters():
 
 AVAILABLE_CHAPTERS = get_available_chapters()
 
+profiler = get_profiler()
+
+def _request_field(name):
+    """A field from the URL, query string or JSON body, for tagging profiles and model calls"""
+    body = request.get_json(silent=True) if request.is_json else None
+    return (request.view_args or {}).get(name) or request.args.get(name) \
+        or (body.get(name) if isinstance(body, dict) else None)
+
+@app.before_request
+def attribute_llm_calls():
+    # Every model call made while serving this request is billed to its route, chapter and user
+    route = request.url_rule.rule if request.url_rule else request.path
+    set_llm_context(route=route, chapter=_request_field('chapter'), user_id=_request_field('user_id'))
+
+@app.before_request
+def start_profile():
+    # Off unless PROFILE_SAMPLE_RATE or PROFILE_HEADER_TOKEN is set; unprofiled requests pay one random draw
+    forced = profiler.wants(request.headers.get('X-Profile'))
+    if forced is not None:
+        g.profile = profiler.start(forced)
+
+@app.after_request
+def finish_profile(response):
+    session = g.pop('profile', None)
+    if session is not None:
+        # Views that only learn the chapter from the database set g.chapter
+        chapter = g.get('chapter') or _request_field('chapter')
+        route = request.url_rule.rule if request.url_rule else request.path
+        saved = profiler.finish(session, f"{request.method} {route}", chapter, response.status_code)
+        if saved:
+            response.headers['X-Profile-Id'] = saved
+    return response
+
+@app.teardown_request
+def abandon_profile(error):
+    # after_request is skipped when a view raises; stop sampling the thread anyway
+    session = g.pop('profile', None)
+    if session is not None:
+        profiler.finish(session, f"{request.method} {request.path}", None, 500)
+    clear_llm_context()
+
 @app.route('/', methods=['GET'])
 def root():
     """Root health check endpoint"""
@@ -76,6 +149,21 @@ def health():
     """Health check endpoint"""
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/health/llm', methods=['GET'])
+def llm_health():
+    """Retry, hedging and circuit breaker stats for each LLM task and model"""
+    return jsonify(get_all_stats()), 200
+
+@app.route('/health/cache', methods=['GET'])
+def cache_health():
+    """Cache backend size, per-namespace hit rates and the grading record LRU for this worker"""
+    return jsonify({**cache_stats(), "grading": grading_cache.summary()}), 200
+
+@app.route('/health/profiles', methods=['GET'])
+def profiler_health():
+    """Request profiler settings, overhead and the newest saved profiles for this worker"""
+    return jsonify(profiler.summary()), 200
+
 @app.route('/reset-password', methods=['POST'])
 def reset_password():
     """
@@ -131,40 +219,63 @@ def generate_diagnostic():
             return jsonify({"error": f"Chapter '{chapter}' not available"}), 400
         
         # Check if user has already submitted diagnostic for this chapter
-        existing_result = supabase_service.get_diagnostic_result(user_id, chapter)
+        existing_result = data_access.get_diagnostic_result(user_id, chapter)
         if existing_result:
             return jsonify({
                 "error": "Diagnostic already completed"
             }), 400
         
-        # Check if diagnostic was already generated (even if not submitted)
-        # If exists, return it instead of generating new one (prevents Gemini call)
-        existing_diagnostic = supabase_service.get_existing_diagnostic(user_id, chapter)
-        if existing_diagnostic:
-            test_data = existing_diagnostic.get('test_data', {})
-            
-            return jsonify({
-                "diagnostic_id": existing_diagnostic.get('id'),
-                "chapter": chapter,
-                "diagnostic_test": test_data.get("diagnostic_test", []),
-                "total_questions": len(test_data.get("diagnostic_test", [])),
-                "time_limit": 30,
-                "created_at": existing_diagnostic.get('created_at'),
-                "is_existing": True  # Flag to indicate this is an existing diagnostic
-            }), 200
-        
-        # Generate diagnostic using Gemini (only if no existing diagnostic found)
-        diagnostic = gemini_service.generate_diagnostic(chapter)
-        
-        if diagnostic.get("error"):
-            return jsonify(diagnostic), 400
-        
-        # Store diagnostic in database
-        diagnostic_id = supabase_service.save_diagnostic(user_id, chapter, diagnostic)
-        
-        # Get the saved diagnostic to return created_at
-        saved_diagnostic = supabase_service.get_diagnostic(diagnostic_id)
-        created_at = saved_diagnostic.get('created_at') if saved_diagnostic else None
+        # Only one request per (user, chapter) generates at a time
+        try:
+            with diagnostic_generation(user_id, chapter):
+                # Check if diagnostic was already generated (even if not submitted)
+                # If exists, return it instead of generating new one (prevents Gemini call).
+                # Under the lock, a concurrent request finds the row the first one saved.
+                existing_diagnostic = supabase_service.get_existing_diagnostic(user_id, chapter)
+                # An adaptive attempt's placeholder row has no test to serve; it is given one below
+                adaptive_row = existing_diagnostic if is_adaptive(existing_diagnostic) else None
+                if adaptive_row:
+                    if active_session_id(adaptive_row):
+                        return jsonify({"error": "An adaptive diagnostic is in progress for this chapter"}), 409
+                    existing_diagnostic = None
+                # A provisioned test (cohort or prefetch) has not been opened yet: it starts now and is served as new
+                unopened = is_unopened(existing_diagnostic)
+                if unopened:
+                    existing_diagnostic = data_access.claim_unopened_diagnostic(existing_diagnostic)
+                if existing_diagnostic:
+                    test_data = existing_diagnostic.get('test_data', {})
+                    grading_cache.prime([existing_diagnostic.get('id')], chapter, test_data)
+                
+                    return jsonify({
+                        "diagnostic_id": existing_diagnostic.get('id'),
+                        "chapter": chapter,
+                        "diagnostic_test": test_data.get("diagnostic_test", []),
+                        "total_questions": len(test_data.get("diagnostic_test", [])),
+                        "time_limit": 30,
+                        "created_at": existing_diagnostic.get('created_at'),
+                        "is_existing": not unopened  # Flag to indicate this is an existing diagnostic
+                    }), 200
+                
+                # Generate diagnostic using Gemini (only if no existing diagnostic found)
+                diagnostic = gemini_service.generate_diagnostic(chapter, user_id=user_id)
+                
+                if diagnostic.get("error"):
+                    return jsonify(diagnostic), 400
+                
+                # Store diagnostic in database; the insert returns the stored row
+                if adaptive_row:
+                    # The unique (user_id, chapter) index leaves no room for a second row
+                    saved_diagnostic = data_access.replace_diagnostic_test(adaptive_row, diagnostic)
+                else:
+                    saved_diagnostic = data_access.create_diagnostic(user_id, chapter, diagnostic)
+                diagnostic_id = saved_diagnostic.get('id') if saved_diagnostic else None
+                created_at = saved_diagnostic.get('created_at') if saved_diagnostic else None
+                if saved_diagnostic and saved_diagnostic.get('test_data'):
+                    # Another host may have won the unique insert; serve its test
+                    diagnostic = saved_diagnostic['test_data']
+                grading_cache.prime([diagnostic_id], chapter, diagnostic)
+        except SingleflightTimeout:
+            return jsonify({"error": "Diagnostic generation already in progress"}), 409
         
         return jsonify({
             "diagnostic_id": diagnostic_id,
@@ -197,10 +308,12 @@ def get_diagnostic():
         if chapter not in AVAILABLE_CHAPTERS:
             return jsonify({"error": f"Chapter '{chapter}' not available"}), 400
         
-        # Check if diagnostic was already generated
+        # Check if diagnostic was already generated; one provisioned but not yet opened,
+        # or an adaptive attempt's placeholder, is not a fixed-form test to resume
         existing_diagnostic = supabase_service.get_existing_diagnostic(user_id, chapter)
-        if existing_diagnostic:
+        if existing_diagnostic and not is_unopened(existing_diagnostic) and not is_adaptive(existing_diagnostic):
             test_data = existing_diagnostic.get('test_data', {})
+            grading_cache.prime([existing_diagnostic.get('id')], chapter, test_data)
             
             return jsonify({
                 "diagnostic_id": existing_diagnostic.get('id'),
@@ -219,6 +332,64 @@ def get_diagnostic():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/cohort-diagnostic', methods=['POST'])
+def cohort_diagnostic():
+    """
+    Provision one shared diagnostic for a class: a single generation (or a
+    stored test given by diagnostic_id) and bulk-inserted per-student rows.
+    Students who already have a diagnostic for the chapter keep theirs.
+    """
+    try:
+        data = request.json or {}
+        chapter = data.get('chapter')
+        user_ids = data.get('user_ids')
+        
+        if not chapter or not isinstance(user_ids, list) or not user_ids:
+            return jsonify({"error": "Missing chapter or user_ids"}), 400
+        if chapter not in AVAILABLE_CHAPTERS:
+            return jsonify({"error": f"Chapter '{chapter}' not available"}), 400
+        if not all(isinstance(user_id, str) and user_id for user_id in user_ids):
+            return jsonify({"error": "user_ids must be non-empty strings"}), 400
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > COHORT_MAX_USERS:
+            return jsonify({"error": f"At most {COHORT_MAX_USERS} users per cohort"}), 400
+        
+        if data.get('diagnostic_id'):
+            source = supabase_service.get_diagnostic(data['diagnostic_id'])
+            if not source or source.get('chapter') != chapter or is_adaptive(source):
+                return jsonify({"error": "Diagnostic not found for this chapter"}), 404
+            diagnostic = source.get('test_data', {})
+        else:
+            # One generation for the whole class (or a draw from the chapter's bank)
+            diagnostic = gemini_service.generate_diagnostic(chapter)
+            if diagnostic.get("error"):
+                return jsonify(diagnostic), 400
+        
+        cohort_id = str(uuid.uuid4())
+        diagnostic = {**diagnostic, "cohort_id": cohort_id}
+        assigned = data_access.create_cohort_diagnostics(user_ids, chapter, diagnostic)
+        existing = sum(1 for entry in assigned.values() if entry["is_existing"])
+        # Every new row of the cohort serves the same test, so they share one grading record
+        grading_cache.prime(
+            [entry["diagnostic_id"] for entry in assigned.values() if not entry["is_existing"]], chapter, diagnostic
+        )
+        
+        return jsonify({
+            "cohort_id": cohort_id,
+            "chapter": chapter,
+            "diagnostic_test": diagnostic.get("diagnostic_test", []),
+            "total_questions": len(diagnostic.get("diagnostic_test", [])),
+            "time_limit": 30,
+            "created": len(assigned) - existing,
+            "existing": existing,
+            "diagnostics": [
+                {"user_id": user_id, **assigned[user_id]} for user_id in user_ids if user_id in assigned
+            ]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/submit-diagnostic', methods=['POST'])
 def submit_diagnostic():
     try:
@@ -230,44 +401,26 @@ def submit_diagnostic():
         if not user_id or not diagnostic_id:
             return jsonify({"error": "Missing user_id or diagnostic_id"}), 400
         
-        # Get diagnostic from database
-        diagnostic = supabase_service.get_diagnostic(diagnostic_id)
-        if not diagnostic:
-            return jsonify({"error": "Diagnostic not found"}), 404
-        
-        # Evaluate answers
-        test_data = diagnostic.get('test_data', {})
-        questions = test_data.get('diagnostic_test', [])
-        
-        results = []
-        bucket_scores = {"Basic": 0, "Conceptual": 0, "Application": 0}
-        bucket_totals = {"Basic": 0, "Conceptual": 0, "Application": 0}
-        
-        for idx, question in enumerate(questions):
-            question_id = str(idx)
-            user_answer = answers.get(question_id, "").strip().upper()
-            correct_answer = question.get('answer', '').strip().upper()
-            bucket = question.get('bucket', 'Basic')
-            
-            is_correct = user_answer == correct_answer
-            bucket_totals[bucket] = bucket_totals.get(bucket, 0) + 1
-            
-            if is_correct:
-                bucket_scores[bucket] = bucket_scores.get(bucket, 0) + 1
-            
-            results.append({
-                "question_id": question_id,
-                "question": question.get('question', ''),
-                "bucket": bucket,
-                "user_answer": user_answer,
-                "correct_answer": correct_answer,
-                "is_correct": is_correct,
-                "marks": question.get('marks', 1)
-            })
+        # Grade from the compact record primed when the diagnostic was served; read the row only on a miss
+        record = grading_cache.get(diagnostic_id)
+        questions = None
+        if record is None:
+            diagnostic = supabase_service.get_diagnostic(diagnostic_id)
+            if not diagnostic:
+                return jsonify({"error": "Diagnostic not found"}), 404
+            if is_adaptive(diagnostic):
+                return jsonify({"error": "Adaptive diagnostics are answered through /adaptive-diagnostic/answer"}), 400
+            questions = (diagnostic.get('test_data') or {}).get('diagnostic_test') or []
+            record = GradingRecord(diagnostic.get('chapter'), questions)
+            grading_cache.put([diagnostic_id], record)
+        g.chapter = record.chapter
+        
+        # Evaluate answers; results keep no question text, the detail views join it back
+        results, bucket_scores, bucket_totals = record.grade(answers)
         
         # Calculate overall score
         total_correct = sum(bucket_scores.values())
-        total_questions = len(questions)
+        total_questions = len(record)
         percentage = (total_correct / total_questions * 100) if total_questions > 0 else 0
         
         # Check if passed (all buckets must pass)
@@ -282,7 +435,7 @@ def submit_diagnostic():
         result_data = {
             "user_id": user_id,
             "diagnostic_id": diagnostic_id,
-            "chapter": diagnostic.get('chapter'),
+            "chapter": record.chapter,
             "answers": answers,
             "results": results,
             "bucket_scores": bucket_scores,
@@ -294,7 +447,29 @@ def submit_diagnostic():
             "submitted_at": datetime.utcnow().isoformat()
         }
         
-        result_id = supabase_service.save_diagnostic_result(result_data)
+        result_id = data_access.record_diagnostic_result(result_data)
+        
+        # Update item statistics; analytics must never fail a submission
+        try:
+            correctness = [r["is_correct"] for r in results]
+            get_item_analysis().record_submission(
+                diagnostic_id,
+                record.chapter,
+                record.keys,
+                correctness,
+                [r["bucket"] for r in results],
+                {
+                    bucket: bucket_scores.get(bucket, 0) > 0 and bucket_scores.get(bucket, 0) / bucket_totals[bucket] >= 0.5
+                    for bucket in ["Basic", "Conceptual", "Application"]
+                    if bucket_totals.get(bucket, 0) > 0
+                }
+            )
+            get_item_analysis().record_item_responses(
+                record.chapter, record.keys, [r["bucket"] for r in results], correctness,
+                lambda: questions if questions is not None else supabase_service.get_diagnostic_questions(diagnostic_id)
+            )
+        except Exception as e:
+            print(f"Error updating item analysis: {str(e)}")
         
         return jsonify({
             "result_id": result_id,
@@ -309,16 +484,188 @@ def submit_diagnostic():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def _adaptive_question(session, bank):
+    item = session_item(session, bank, session["current"])
+    return {
+        "session_id": session["session_id"],
+        "diagnostic_id": session["diagnostic_id"],
+        "chapter": session["chapter"],
+        "question_number": len(session["asked"]) + 1,
+        "max_questions": MAX_QUESTIONS,
+        "question": public_item(item)
+    }
+
+@app.route('/adaptive-diagnostic/start', methods=['POST'])
+def start_adaptive_diagnostic():
+    """
+    Start an adaptive diagnostic: questions come one at a time from the
+    chapter's calibrated item bank until each bucket's outcome is certain.
+    """
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id')
+        chapter = data.get('chapter')
+        
+        if not user_id or not chapter:
+            return jsonify({"error": "Missing user_id or chapter"}), 400
+        
+        if chapter not in AVAILABLE_CHAPTERS:
+            return jsonify({"error": f"Chapter '{chapter}' not available"}), 400
+        
+        if data_access.get_diagnostic_result(user_id, chapter):
+            return jsonify({"error": "Diagnostic already completed"}), 400
+        
+        bank = get_item_bank(chapter)
+        if not bank.ready():
+            # Seed the bank once per chapter version; students never wait on generation after that
+            gemini_service.generate_diagnostic(chapter)
+            bank = get_item_bank(chapter, refresh=True)
+            if not bank.ready():
+                return jsonify({"error": "Not enough questions for an adaptive diagnostic yet"}), 400
+        
+        # Results reference a diagnostics row, and (user_id, chapter) is unique: the session
+        # takes over an adaptive or never-opened row, but never a fixed-form test in progress
+        store = get_adaptive_store()
+        session = new_adaptive_session(chapter, user_id, None)
+        placeholder = placeholder_test(chapter, session["session_id"])
+        try:
+            with diagnostic_generation(user_id, chapter):
+                existing = supabase_service.get_existing_diagnostic(user_id, chapter)
+                if existing and not is_adaptive(existing) and not is_unopened(existing):
+                    return jsonify({"error": "A diagnostic for this chapter is already in progress"}), 409
+                if existing:
+                    # Starting again abandons the earlier adaptive attempt
+                    previous = active_session_id(existing)
+                    if previous:
+                        store.delete(previous)
+                    row = data_access.replace_diagnostic_test(existing, placeholder)
+                else:
+                    row = data_access.create_diagnostic(user_id, chapter, placeholder)
+        except SingleflightTimeout:
+            return jsonify({"error": "Diagnostic generation already in progress"}), 409
+        if not row:
+            return jsonify({"error": "Could not create diagnostic"}), 500
+        if (row.get('test_data') or {}).get('session_id') != session["session_id"]:
+            # Another host created the row first
+            return jsonify({"error": "A diagnostic for this chapter is already in progress"}), 409
+        
+        session["diagnostic_id"] = row.get('id')
+        session["current"] = next_item(session, bank)
+        store.save(session)
+        return jsonify(_adaptive_question(session, bank)), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/adaptive-diagnostic/answer', methods=['POST'])
+def answer_adaptive_diagnostic():
+    """Grade one answer; returns the next question, or the result once the test stops"""
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id')
+        session_id = data.get('session_id')
+        
+        if not user_id or not session_id:
+            return jsonify({"error": "Missing user_id or session_id"}), 400
+        
+        store = get_adaptive_store()
+        session = store.get(session_id, user_id)
+        if not session:
+            return jsonify({"error": "Adaptive diagnostic not found or expired"}), 404
+        g.chapter = session["chapter"]
+        
+        bank = get_item_bank(session["chapter"])
+        if session["current"]:
+            record_answer(session, bank, data.get('answer', ''))
+        session["current"] = next_item(session, bank)
+        if session["current"]:
+            store.save(session)
+            return jsonify(_adaptive_question(session, bank)), 200
+        
+        result = adaptive_outcome(session, bank)
+        result_id = data_access.record_diagnostic_result({
+            "user_id": user_id,
+            "diagnostic_id": session["diagnostic_id"],
+            "chapter": session["chapter"],
+            "answers": {str(idx): answer for idx, answer in enumerate(session["answers"])},
+            "results": result["results"],
+            "bucket_scores": result["bucket_scores"],
+            "bucket_totals": result["bucket_totals"],
+            "total_correct": result["total_correct"],
+            "total_questions": result["total_questions"],
+            "percentage": result["percentage"],
+            "passed": result["passed"],
+            "submitted_at": datetime.utcnow().isoformat()
+        })
+        store.delete(session_id)
+        
+        return jsonify({
+            "result_id": result_id,
+            "completed": True,
+            **result
+        }), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analytics/adaptive/<chapter>', methods=['GET'])
+def adaptive_item_bank(chapter):
+    """Size, calibration model and bucket cut scores of a chapter's adaptive item bank"""
+    return jsonify(get_item_bank(chapter).summary()), 200
+
+DASHBOARD_PAGE_SIZE = 20
+DASHBOARD_MAX_PAGE_SIZE = 100
+
+def _encode_cursor(row: dict) -> str:
+    """Opaque cursor for the rows after this one; the id breaks ties between equal submitted_at values"""
+    position = json.dumps([row.get('submitted_at') or '', row.get('id') or ''])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor: str) -> tuple:
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    if not (isinstance(position, list) and len(position) == 2 and all(isinstance(part, str) for part in position)):
+        raise ValueError("Malformed cursor")
+    return tuple(position)
+
+def _conditional_json(payload: dict):
+    """JSON response with an ETag; returns 304 when If-None-Match matches"""
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
 @app.route('/dashboard', methods=['GET'])
 def get_dashboard():
+    """
+    Dashboard with compact result summaries, newest first.
+    Query params: cursor (from next_cursor) and limit for history pages;
+    view=full returns full result rows as before.
+    """
     try:
         user_id = request.args.get('user_id')
         
         if not user_id:
             return jsonify({"error": "Missing user_id"}), 400
         
-        # Get all diagnostic results for user
-        results = supabase_service.get_user_diagnostic_results(user_id)
+        try:
+            limit = min(int(request.args.get('limit', DASHBOARD_PAGE_SIZE)), DASHBOARD_MAX_PAGE_SIZE)
+            before = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except (ValueError, TypeError):
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+        limit = max(limit, 1)
+        
+        if request.args.get('view') == 'full':
+            results = data_access.with_question_text(data_access.get_user_diagnostic_results(user_id))
+            outcomes = results
+            next_cursor = None
+        else:
+            # Fetch one extra row to know whether another page exists
+            results = data_access.get_result_summaries(user_id, limit + 1, before)
+            next_cursor = None
+            if len(results) > limit:
+                results = results[:limit]
+                next_cursor = _encode_cursor(results[-1])
+            outcomes = data_access.get_chapter_outcomes(user_id)
         
         # Get student profile
         profile = supabase_service.get_student_profile(user_id)
@@ -327,7 +674,7 @@ def get_dashboard():
         attempted_chapters = []
         passed_chapters = []
         
-        for result in results:
+        for result in outcomes:
             chapter = result.get('chapter')
             if chapter:
                 attempted_chapters.append(chapter)
@@ -337,20 +684,111 @@ def get_dashboard():
         # Get roadmap if exists
         roadmap = supabase_service.get_roadmap(user_id)
         
-        return jsonify({
+        response = _conditional_json({
             "user_id": user_id,
-            "attempted_chapters": list(set(attempted_chapters)),
-            "passed_chapters": list(set(passed_chapters)),
+            "attempted_chapters": sorted(set(attempted_chapters)),
+            "passed_chapters": sorted(set(passed_chapters)),
             "total_attempted": len(set(attempted_chapters)),
             "total_passed": len(set(passed_chapters)),
             "results": results,
+            "next_cursor": next_cursor,
             "profile": profile,
             "roadmap": roadmap
-        }), 200
+        })
+        
+        # The chapters the student is likely to open next are generated in the background,
+        # only when the dashboard is actually sent rather than revalidated with a 304
+        if response.status_code == 200 and not request.args.get('cursor'):
+            prefetcher.schedule(user_id, AVAILABLE_CHAPTERS, attempted_chapters, passed_chapters)
+        
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/diagnostic-result', methods=['GET'])
+def get_diagnostic_result_detail():
+    """Full result row (per-question results and answers) for one submission"""
+    try:
+        user_id = request.args.get('user_id')
+        result_id = request.args.get('result_id')
+        
+        if not user_id or not result_id:
+            return jsonify({"error": "Missing user_id or result_id"}), 400
+        
+        result = data_access.get_result_detail(user_id, result_id)
+        if not result:
+            return jsonify({"error": "Result not found"}), 404
+        
+        return _conditional_json(result)
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/analytics/diagnostic/<diagnostic_id>', methods=['GET'])
+def diagnostic_item_analysis(diagnostic_id):
+    """Per-question difficulty and discrimination for one diagnostic"""
+    stats = get_item_analysis().item_statistics(diagnostic_id)
+    if not stats:
+        return jsonify({"error": "No submissions recorded for this diagnostic"}), 404
+    return jsonify(stats), 200
+
+@app.route('/analytics/chapter/<chapter>', methods=['GET'])
+def chapter_item_analysis(chapter):
+    """Chapter-level difficulty and per-bucket pass rates"""
+    return jsonify(get_item_analysis().chapter_statistics(chapter)), 200
+
+@app.route('/analytics/weak-items', methods=['GET'])
+def weak_items():
+    """Items that are too hard or discriminate poorly"""
+    try:
+        items = get_item_analysis().weak_items(
+            chapter=request.args.get('chapter'),
+            max_p=float(request.args.get('max_p', 0.3)),
+            min_discrimination=float(request.args.get('min_discrimination', 0.1)),
+            min_responses=int(request.args.get('min_responses', 5)),
+            limit=int(request.args.get('limit', 50))
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    return jsonify({"items": items}), 200
+
+@app.route('/analytics/llm-usage', methods=['GET'])
+def llm_usage():
+    """Model calls, tokens, cost and latency grouped by day, route, chapter, user, task or model"""
+    group_by = request.args.get('group_by', 'day')
+    if group_by not in GROUPINGS:
+        return jsonify({"error": f"group_by must be one of {', '.join(GROUPINGS)}"}), 400
+    ledger = get_ledger()
+    try:
+        rows = ledger.rollup(
+            group_by,
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            limit=min(int(request.args.get('limit', 100)), 1000),
+            **{name: request.args.get(name) for name in GROUPINGS if name != group_by}
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid query parameters"}), 400
+    return jsonify({
+        "group_by": group_by,
+        "rows": rows,
+        "budget": ledger.budget_status(request.args.get('user')),
+        "prefetch": prefetcher.summary()
+    }), 200
+
+@app.route('/tutor', methods=['POST'])
+def tutor():
+    """
+    AI tutor: teach, question or mcq mode. Pass session_id (or "session": true
+    to start one) in question mode for follow-ups that keep the conversation.
+    """
+    try:
+        result = ai_tutor_controller(request.json or {})
+        return jsonify(result), 200 if result.get("status") == "success" else 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/generate-roadmap', methods=['POST'])
 def generate_roadmap():
     try:
@@ -362,28 +800,114 @@ def generate_roadmap():
         
         # Get student profile and diagnostic results
         profile = supabase_service.get_student_profile(user_id)
-        results = supabase_service.get_user_diagnostic_results(user_id)
+        results = data_access.get_result_summaries(user_id)
         
         if not profile:
             return jsonify({"error": "Student profile not found"}), 404
         
-        # Generate roadmap using Gemini
-        roadmap = gemini_service.generate_roadmap(profile, results)
+        # Skip the model entirely when nothing the roadmap depends on has changed
+        fingerprint = roadmap_fingerprint(profile, results)
+        previous = supabase_service.get_roadmap_record(user_id)
+        previous_roadmap = previous.get('roadmap_data') if previous else None
+        previous_fingerprint = previous_roadmap.get('input_fingerprint') if previous_roadmap else None
+        
+        if previous_fingerprint and previous_fingerprint.get('hash') == fingerprint['hash']:
+            return jsonify({
+                "roadmap_id": previous.get('id'),
+                "roadmap": previous_roadmap,
+                "update": "unchanged"
+            }), 200
+        
+        roadmap = None
+        update = "full"
+        
+        # Only some chapters changed: revise just the weeks that cover them
+        changed = changed_chapters(previous_fingerprint, fingerprint)
+        if previous_roadmap and changed:
+            changed_results = [r for r in results if r.get('chapter') in changed]
+            weeks = affected_weeks(previous_roadmap, changed)
+            revision = gemini_service.revise_roadmap(previous_roadmap, profile, changed_results, weeks)
+            if not revision.get("error"):
+                roadmap = merge_weeks(previous_roadmap, revision)
+                update = "incremental"
+        
+        refine = False
+        if roadmap is None and ROADMAP_PLANNER == 'instant':
+            # Rule-based plan in milliseconds; the model refines it afterwards
+            roadmap = plan_roadmap(profile, results, AVAILABLE_CHAPTERS)
+            refine = ROADMAP_REFINE
+        elif roadmap is None:
+            # Generate roadmap using Gemini
+            roadmap = gemini_service.generate_roadmap(profile, results)
+            if roadmap.get("budget_exceeded"):
+                roadmap = plan_roadmap(profile, results, AVAILABLE_CHAPTERS)
+                roadmap["degraded"] = "budget"
         
         if roadmap.get("error"):
             return jsonify(roadmap), 400
         
+        roadmap["input_fingerprint"] = fingerprint
+        
         # Save roadmap
-        roadmap_id = supabase_service.save_roadmap(user_id, roadmap)
+        saved_roadmap = data_access.create_roadmap(user_id, roadmap)
+        roadmap_id = saved_roadmap.get('id') if saved_roadmap else None
+        
+        if refine:
+            background_executor.submit(refine_roadmap, user_id, profile, results, roadmap)
         
         return jsonify({
             "roadmap_id": roadmap_id,
-            "roadmap": roadmap
+            "roadmap": roadmap,
+            "update": update,
+            "refining": refine
         }), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def refine_roadmap(user_id, profile, results, draft):
+    """Replace the planner's roadmap with a model-refined one if inputs are unchanged"""
+    try:
+        with llm_context(route='background:refine-roadmap', user_id=user_id):
+            refined = gemini_service.generate_roadmap(profile, results, draft=draft)
+        if refined.get("error"):
+            print(f"Roadmap refinement failed: {refined['error']}")
+            return
+        
+        # A newer roadmap was generated meanwhile; do not overwrite it
+        latest = supabase_service.get_roadmap_record(user_id)
+        latest_fingerprint = (latest or {}).get('roadmap_data', {}).get('input_fingerprint') or {}
+        if latest_fingerprint.get('hash') != draft["input_fingerprint"]["hash"]:
+            return
+        
+        refined["input_fingerprint"] = draft["input_fingerprint"]
+        refined["plan_source"] = "refined"
+        data_access.create_roadmap(user_id, refined)
+    except Exception as e:
+        print(f"Roadmap refinement error: {e}")
+
+def prefetch_diagnostic(user_id, chapter):
+    """Generate and store a diagnostic the student has not opened yet, marked as unopened"""
+    try:
+        # A request generating this chapter right now wins; do not wait for it
+        with diagnostic_generation(user_id, chapter, timeout=0.5):
+            existing = supabase_service.get_existing_diagnostic(user_id, chapter)
+            if existing:
+                return "existing"
+            with llm_context(route=PREFETCH_ROUTE, user_id=user_id, chapter=chapter):
+                diagnostic = gemini_service.generate_diagnostic(chapter, user_id=user_id)
+            # A budget-degraded test would stick to the student; leave it to a real request
+            if diagnostic.get("error") or diagnostic.get("degraded"):
+                return "skipped"
+            saved = data_access.create_diagnostic(user_id, chapter, {**diagnostic, UNOPENED: True})
+            if saved:
+                grading_cache.prime([saved.get('id')], chapter, saved.get('test_data'))
+            return "created"
+    except SingleflightTimeout:
+        return "skipped"
+
+prefetcher = DiagnosticPrefetcher(prefetch_diagnostic)
+
 # Production deployment: Use Gunicorn
 # Development: Only run Flask dev server if executed directly
 if __name__ == '__main__':
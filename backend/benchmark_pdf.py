@@ -0,0 +1,214 @@
+"""
+Compare the PDF text-extraction backends on speed, memory and output.
+
+    python benchmark_pdf.py                          # synthetic exam papers
+    python benchmark_pdf.py papers/*.pdf --repeat 3  # real past papers and answer keys
+    python benchmark_pdf.py --backends pdfium,pdfminer --pages 40
+
+Each backend runs in a fresh process, so its peak memory is measured on its
+own. Similarity is the per-page character match ratio, ignoring whitespace,
+against the reference: the known text of the synthetic papers, or the
+--reference backend's output (pdfplumber by default) for real PDFs. Pick the
+fastest backend whose similarity stays close to 1.0, then set PDF_EXTRACTOR.
+"""
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from difflib import SequenceMatcher
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from services.pdf_extract import EXTRACTORS, get_extractor
+
+ELEMENTS = [
+    ("sodium", "Na"), ("magnesium", "Mg"), ("calcium", "Ca"), ("copper", "Cu"),
+    ("zinc", "Zn"), ("iron", "Fe"), ("chlorine", "Cl"), ("oxygen", "O")
+]
+STEMS = [
+    "Which statement about the {0} atom is correct?",
+    "What is the relative formula mass of the compound formed by {0}?",
+    "Which gas is produced when {0} reacts with dilute hydrochloric acid?",
+    "How many moles of {0} are present in 12 g of the sample?",
+    "Which property of {0} shows that it is a metal?"
+]
+OPTIONS = [
+    "it forms a positive ion", "it conducts electricity", "it has a giant structure", "it is reduced",
+    "0.25 mol", "0.50 mol", "1.0 mol", "2.0 mol", "hydrogen", "carbon dioxide", "oxygen", "chlorine"
+]
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _exam_pages(pages: int, seed: int) -> List[List[List[Tuple[float, str]]]]:
+    """Pages of lines; a line is a list of (x, text) runs on one baseline, like two-column MCQ options"""
+    rng = random.Random(seed)
+    result, number = [], 1
+    for page_number in range(1, pages + 1):
+        lines = [[(50, f"Paper 1 Multiple Choice Page {page_number}")], [(480, "[Turn over")]]
+        while len(lines) < 44:
+            name, symbol = rng.choice(ELEMENTS)
+            lines.append([(50, f"{number} " + rng.choice(STEMS).format(f"{name} ({symbol})"))])
+            options = rng.sample(OPTIONS, 4)
+            lines.append([(70, f"A {options[0]}"), (300, f"B {options[1]}")])
+            lines.append([(70, f"C {options[2]}"), (300, f"D {options[3]}")])
+            number += 1
+        result.append(lines)
+    return result
+
+
+def write_exam_pdf(path: str, pages: int, seed: int) -> str:
+    """Synthetic MCQ paper; returns the text it contains"""
+    return write_pdf(path, _exam_pages(pages, seed))
+
+
+def write_pdf(path: str, pages: List[List[List[Tuple[float, str]]]]) -> str:
+    """Minimal single-font PDF from pages of (x, text) runs; returns its text, pages separated by form feeds"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids, truth = [], []
+    for lines in pages:
+        ops, page_text = ["BT /F1 10 Tf"], []
+        for row, runs in enumerate(lines):
+            y = 800 - row * 17
+            for x, text in runs:
+                ops.append(f"1 0 0 1 {x} {y} Tm ({_escape(text)}) Tj")
+            page_text.append(' '.join(text for _, text in runs))
+        ops.append("ET")
+        stream = "\n".join(ops)
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+        truth.append("\n".join(page_text))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(out)
+    return "\f".join(truth)
+
+
+def _rss_kb() -> int:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def run_backend(name: str, paths: List[str], repeat: int) -> Dict:
+    """Runs in a fresh process: time every file, then read this process's peak RSS"""
+    extractor = get_extractor(name)
+    with open(paths[0], 'rb') as f:
+        extractor.extract_pages(f.read())  # imports and one-time setup stay out of the timings
+    baseline = _rss_kb()
+
+    outputs, pages, seconds = {}, 0, 0.0
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        for _ in range(repeat):
+            started = time.perf_counter()
+            extracted = extractor.extract_pages(data)
+            seconds += time.perf_counter() - started
+        pages += len(extracted) * repeat
+        outputs[path] = extracted
+
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_kb = peak // 1024 if sys.platform == 'darwin' else peak
+    except ImportError:
+        peak_kb = _rss_kb()
+    return {"pages": pages, "seconds": seconds, "peak_mb": max(0, peak_kb - baseline) / 1024, "outputs": outputs}
+
+
+def similarity(pages: List[str], reference: List[str]) -> float:
+    """
+    Mean per-page match ratio over the non-whitespace characters, so word
+    spacing (which backends disagree on) is ignored but reading order is
+    not. Missing or extra pages count as 0.
+    """
+    count = max(len(pages), len(reference))
+    if not count:
+        return 1.0
+    total = 0.0
+    for page, expected in zip(pages, reference):
+        a, b = ''.join(page.split()), ''.join(expected.split())
+        total += SequenceMatcher(None, a, b, autojunk=False).ratio() if a or b else 1.0
+    return total / count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='*', help='PDF files or directories (default: generated exam papers)')
+    parser.add_argument('--backends', default=','.join(EXTRACTORS), help='comma-separated backends to compare')
+    parser.add_argument('--reference', default='pdfplumber', help='backend whose output real PDFs are compared to')
+    parser.add_argument('--repeat', type=int, default=1, help='extract every file this many times')
+    parser.add_argument('--papers', type=int, default=3, help='synthetic papers to generate')
+    parser.add_argument('--pages', type=int, default=20, help='pages per synthetic paper')
+    args = parser.parse_args(argv)
+
+    backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+    for name in backends + [args.reference]:
+        get_extractor(name)
+
+    truth: Dict[str, List[str]] = {}
+    workdir = None
+    paths: List[str] = []
+    for entry in args.pdfs:
+        paths.extend(sorted(glob.glob(os.path.join(entry, '*.pdf'))) if os.path.isdir(entry) else [entry])
+    if not paths:
+        workdir = tempfile.TemporaryDirectory(prefix='pdf_bench_')
+        for seed in range(args.papers):
+            path = os.path.join(workdir.name, f"paper_{seed + 1}.pdf")
+            truth[path] = write_exam_pdf(path, args.pages, seed).split("\f")
+            paths.append(path)
+        print(f"Generated {args.papers} synthetic papers of {args.pages} pages")
+    elif args.reference not in backends:
+        backends.append(args.reference)
+
+    # spawn: every backend starts from a clean interpreter, so peak memory is its own
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[name] = pool.submit(run_backend, name, paths, args.repeat).result()
+        print(f"  {name:<12} {results[name]['seconds']:.2f}s", flush=True)
+
+    reference_label = 'known text' if truth else args.reference
+    print(f"\nBackend      pages  pages/sec  peak MB  similarity (vs {reference_label})")
+    for name in backends:
+        result = results[name]
+        expected = truth or results[args.reference]["outputs"]
+        scores = [similarity(result["outputs"][path], expected[path]) for path in paths]
+        rate = result["pages"] / result["seconds"] if result["seconds"] else 0.0
+        print(f"{name:<12} {result['pages']:>5}  {rate:>9.1f}  {result['peak_mb']:>7.1f}  "
+              f"{sum(scores) / len(scores):.4f} (worst {min(scores):.4f})")
+
+    if workdir:
+        workdir.cleanup()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+# Picked up automatically by `gunicorn app:app` when run from this directory
+import os
+
+# A diagnostic request can wait out another worker's generation
+# (SINGLEFLIGHT_WAIT_SECONDS, 55) and then make its own model call
+# (LLM_CALL_DEADLINE_SECONDS, 50); keep the worker timeout above their sum.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+
+def worker_exit(server, worker):
+    # Write out buffered rows before the worker process goes away
+    try:
+        from app import data_access
+        data_access.close()
+    except Exception as e:
+        server.log.warning(f"Write-behind flush on worker exit failed: {e}")
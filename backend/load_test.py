@@ -0,0 +1,280 @@
+"""
+Replay student journeys against the backend with every external service
+replaced by a local stand-in, and report throughput and latency per route.
+
+    python load_test.py                                  # 8 users, 40 journeys, app under gunicorn
+    python load_test.py --users 32 --journeys 200 --app-workers 4
+    python load_test.py --llm-latency 1.5 --llm-sigma 0.6 --llm-error-rate 0.05
+    python load_test.py --stand-ins-only                 # print the env to run the app yourself
+    python load_test.py --target http://127.0.0.1:5000   # app already pointed at the stand-ins
+
+Stand-ins: an in-memory PostgREST fake for Supabase (seeded with chapters and
+student profiles), a static server for the chapter PDFs, and the stub model
+backend with configurable latency and error distributions (LLM_STUB_*).
+
+A journey is one student working through one chapter:
+generate diagnostic -> submit -> dashboard -> roadmap -> tutor.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from typing import Dict, List, Optional
+
+import requests
+
+CHAPTERS = ["Stoichiometry", "Atomic Structure", "Chemical Bonding", "Acids, Bases and Salts",
+            "Electrochemistry", "Chemical Energetics", "Rates of Reaction", "Organic Chemistry"]
+JOURNEY = ["generate-diagnostic", "submit-diagnostic", "dashboard", "generate-roadmap", "tutor"]
+TUTOR_MODES = ["teach", "question", "mcq"]
+
+
+def seed_tables(chapters: List[str], students: List[str], pdf_base: str, pdfs: Dict[str, Dict[str, str]]) -> Dict[str, List[Dict]]:
+    rng = random.Random(7)
+    rows = {
+        "chemistry_chapters": [{
+            "id": idx + 1,
+            "chapter_name": chapter,
+            "syllabus_text": f"{chapter}: candidates should be able to define, describe and calculate "
+                             f"the key quantities of {chapter.lower()} and apply them to unfamiliar reactions.",
+            "past_paper_pdf_url": f"{pdf_base}/{pdfs[chapter]['past_paper']}",
+            "answer_key_pdf_url": f"{pdf_base}/{pdfs[chapter]['answer_key']}"
+        } for idx, chapter in enumerate(chapters)],
+        "student_profile": [],
+        "user_profile": []
+    }
+    for user_id in students:
+        rows["student_profile"].append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "student_type": rng.choice(["O Level", "IGCSE"]),
+            "confidence_level": rng.choice(["Low", "Medium", "High"]),
+            "difficult_areas": rng.sample(["Calculations", "Definitions", "Practical", "Equations"], 2),
+            "target_grade": rng.choice(["A*", "A", "B", "C"]),
+            "study_hours": rng.choice(["1-2 hours", "3-5 hours", "6-8 hours"]),
+            "exam_session": "May / June 2027",
+            "chapters": {chapter: rng.choice(["weak", "okay", "strong"]) for chapter in chapters}
+        })
+        rows["user_profile"].append({"id": user_id, "username": f"student-{user_id[:8]}"})
+    return rows
+
+
+def run_stand_ins(chapters: List[str], students: List[str], pdf_dir: str, db_latency: float, ready):
+    """Child process: serve the PostgREST fake and the PDFs until killed"""
+    from loadtest import fake_postgrest, pdf_server
+    pdfs = {chapter: pdf_server.write_chapter_pdfs(pdf_dir, chapter, seed) for seed, chapter in enumerate(chapters)}
+    files = pdf_server.serve(pdf_dir)
+    pdf_base = f"http://127.0.0.1:{files.server_address[1]}"
+    db = fake_postgrest.FakeDatabase(seed_tables(chapters, students, pdf_base, pdfs))
+    rest = fake_postgrest.serve(db, latency=db_latency)
+    ready.put({"supabase_url": f"http://127.0.0.1:{rest.server_address[1]}", "pdf_url": pdf_base})
+    while True:
+        time.sleep(3600)
+
+
+def app_env(args, supabase_url: str, cache_dir: str) -> Dict[str, str]:
+    from loadtest.fake_postgrest import FAKE_SERVICE_KEY
+    return {
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_SERVICE_ROLE_KEY": FAKE_SERVICE_KEY,
+        "LLM_BACKEND": "stub",
+        "LLM_STUB_LATENCY": str(args.llm_latency),
+        "LLM_STUB_LATENCY_SIGMA": str(args.llm_sigma),
+        "LLM_STUB_ERROR_RATE": str(args.llm_error_rate),
+        "LLM_STUB_HANG_RATE": str(args.llm_hang_rate),
+        "LLM_STUB_SEED": str(args.seed),
+        "CACHE_DIR": cache_dir,
+        "CHAPTER_CORPUS": "off",
+        "FLASK_ENV": "production"
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {route: [] for route in JOURNEY}
+        self.errors: Dict[str, Dict[str, int]] = {route: {} for route in JOURNEY}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, seconds: float, status):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if status != 200:
+                self.errors[route][str(status)] = self.errors[route].get(str(status), 0) + 1
+
+    def print_report(self, wall_seconds: float):
+        print(f"\n{'Route':<20} {'requests':>8} {'errors':>7} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        total = 0
+        for route in JOURNEY:
+            samples = sorted(self.latencies[route])
+            if not samples:
+                continue
+            total += len(samples)
+            errors = sum(self.errors[route].values())
+            print(f"{route:<20} {len(samples):>8} {errors:>7} {len(samples) / wall_seconds:>7.1f} "
+                  f"{percentile(samples, 50) * 1000:>8.0f} {percentile(samples, 95) * 1000:>8.0f} "
+                  f"{percentile(samples, 99) * 1000:>8.0f} {samples[-1] * 1000:>8.0f}"
+                  + (f"   {self.errors[route]}" if errors else ""))
+        print(f"\n{total} requests in {wall_seconds:.2f}s ({total / wall_seconds:.1f} req/s)")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of sorted samples"""
+    rank = max(1, -(-len(samples) * pct // 100))
+    return samples[int(rank) - 1]
+
+
+def timed(stats: Stats, session: requests.Session, route: str, method: str, url: str, **kwargs) -> Optional[Dict]:
+    started = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=120, **kwargs)
+        status = response.status_code
+        body = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else None
+    except (requests.RequestException, ValueError) as e:
+        status, body = type(e).__name__, None
+    stats.record(route, time.perf_counter() - started, status)
+    return body if status == 200 else None
+
+
+def journey(base: str, user_id: str, chapter: str, rng: random.Random, stats: Stats, session: requests.Session):
+    """One student through one chapter; later steps still run when an earlier one fails, as a student would retry"""
+    test = timed(stats, session, "generate-diagnostic", "POST", f"{base}/generate-diagnostic",
+                 json={"user_id": user_id, "chapter": chapter})
+    if test and test.get("diagnostic_id"):
+        # Students of mixed ability: each answers right with their own probability
+        ability = rng.uniform(0.3, 0.9)
+        answers = {
+            str(idx): question.get("answer") if rng.random() < ability else rng.choice("ABCD")
+            for idx, question in enumerate(test.get("diagnostic_test", []))
+        }
+        timed(stats, session, "submit-diagnostic", "POST", f"{base}/submit-diagnostic",
+              json={"user_id": user_id, "diagnostic_id": test["diagnostic_id"], "answers": answers})
+    timed(stats, session, "dashboard", "GET", f"{base}/dashboard", params={"user_id": user_id})
+    timed(stats, session, "generate-roadmap", "POST", f"{base}/generate-roadmap", json={"user_id": user_id})
+    mode = rng.choice(TUTOR_MODES)
+    payload = {"chapter": chapter, "mode": mode}
+    if mode == "question":
+        payload["question"] = f"Can you explain the hardest idea in {chapter.lower()} with an example?"
+    elif mode == "mcq":
+        payload["difficulty"] = rng.choice(["easy", "medium", "hard"])
+    timed(stats, session, "tutor", "POST", f"{base}/tutor", json=payload)
+
+
+def run_load(base: str, plan: List[tuple], users: int, think_time: float, seed: int, stats: Stats) -> float:
+    """Virtual users take journeys from a shared plan until it is empty; returns wall seconds"""
+    queue = list(reversed(plan))
+    lock = threading.Lock()
+
+    def virtual_user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        with requests.Session() as session:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    user_id, chapter = queue.pop()
+                journey(base, user_id, chapter, rng, stats, session)
+                if think_time:
+                    time.sleep(rng.expovariate(1 / think_time))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(idx,), daemon=True) for idx in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def wait_for(url: str, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the backend against local stand-ins")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--journeys", type=int, default=40, help="Journeys to run in total")
+    parser.add_argument("--chapters", type=int, default=4, help=f"Chapters to seed (up to {len(CHAPTERS)})")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds a user waits between journeys")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Median stub model latency in seconds")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="Lognormal spread of stub model latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of model calls that fail")
+    parser.add_argument("--llm-hang-rate", type=float, default=0.0, help="Share of model calls that hang until timeout")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds added to every database request")
+    parser.add_argument("--app-workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--app-threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=5055, help="Port for the app under test")
+    parser.add_argument("--target", help="Base URL of an app already configured against the stand-ins")
+    parser.add_argument("--stand-ins-only", action="store_true", help="Start the stand-ins, print the app env and wait")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    chapters = CHAPTERS[:max(1, min(args.chapters, len(CHAPTERS)))]
+    # Each journey is a fresh (student, chapter) pair; students take several chapters, like real ones
+    students = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(max(1, -(-args.journeys // len(chapters))))]
+    plan = [(student, chapter) for student in students for chapter in chapters][:args.journeys]
+    rng.shuffle(plan)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    stand_ins = context.Process(target=run_stand_ins, daemon=True,
+                                args=(chapters, students, os.path.join(workdir, "pdfs"), args.db_latency, ready))
+    stand_ins.start()
+    app = None
+    try:
+        urls = ready.get(timeout=60)
+        env = app_env(args, urls["supabase_url"], os.path.join(workdir, "cache"))
+        print(f"Stand-ins: PostgREST fake at {urls['supabase_url']}, PDFs at {urls['pdf_url']}")
+
+        if args.stand_ins_only:
+            for name, value in env.items():
+                print(f"export {name}={json.dumps(value)}")
+            print("Ctrl-C to stop")
+            stand_ins.join()
+            return 0
+
+        base = args.target
+        if not base:
+            base = f"http://127.0.0.1:{args.port}"
+            app = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{args.port}",
+                 "--workers", str(args.app_workers), "--threads", str(args.app_threads), "--timeout", "120"],
+                cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, **env}
+            )
+            if not wait_for(f"{base}/health", 60):
+                print("App did not become healthy")
+                return 1
+
+        print(f"Running {len(plan)} journeys with {args.users} users against {base}")
+        stats = Stats()
+        wall = run_load(base, plan, args.users, args.think_time, args.seed, stats)
+        stats.print_report(wall)
+        print(f"App cache and any request profiles (PROFILE_SAMPLE_RATE) are in {env['CACHE_DIR']}")
+        return 1 if any(stats.errors[route] for route in JOURNEY) else 0
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        if app:
+            app.terminate()
+            app.wait(timeout=30)
+        stand_ins.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""Static file server for generated past papers and answer keys"""
+import os
+import random
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from benchmark_pdf import ELEMENTS, STEMS, OPTIONS, write_pdf
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def write_chapter_pdfs(directory: str, chapter: str, seed: int, questions: int = 40) -> Dict[str, str]:
+    """A synthetic MCQ paper (one option per line, as the item store parses) and its answer key"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    slug = ''.join(c if c.isalnum() else '_' for c in chapter.lower())
+    lines: List[List[tuple]] = []
+    key: List[List[tuple]] = []
+    for number in range(1, questions + 1):
+        name, symbol = rng.choice(ELEMENTS)
+        lines.append([(50, f"{number} " + rng.choice(STEMS).format(f"{name} ({symbol})"))])
+        lines.extend([(70, f"{letter} {option}")] for letter, option in zip("ABCD", rng.sample(OPTIONS, 4)))
+        key.append([(50, f"{number} {rng.choice('ABCD')}")])
+    files = {"past_paper": f"{slug}_paper.pdf", "answer_key": f"{slug}_key.pdf"}
+    write_pdf(os.path.join(directory, files["past_paper"]), [lines[start:start + 45] for start in range(0, len(lines), 45)])
+    write_pdf(os.path.join(directory, files["answer_key"]), [key[start:start + 45] for start in range(0, len(key), 45)])
+    return files
+
+
+def serve(directory: str, port: int = 0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), partial(QuietHandler, directory=directory))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
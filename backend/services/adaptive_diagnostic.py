@@ -0,0 +1,365 @@
+import os
+import json
+import time
+import uuid
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy.stats import norm
+from services.item_analysis import BUCKETS, BUCKET_CODES, ITEM_FIELDS, get_item_analysis
+from utils.item_keys import item_key
+from services.item_store import draw_mcq_items, items_to_diagnostic
+from services.local_store import DEFAULT_CACHE_DIR
+from services.tutor_sessions import SessionStore
+
+IRT_MODEL = os.getenv('ADAPTIVE_IRT_MODEL', '2pl').lower()
+SE_TARGET = float(os.getenv('ADAPTIVE_SE_TARGET', '0.6'))
+CONFIDENCE_Z = float(os.getenv('ADAPTIVE_CONFIDENCE_Z', '1.0'))
+MIN_PER_BUCKET = int(os.getenv('ADAPTIVE_MIN_PER_BUCKET', '1'))
+MAX_PER_BUCKET = int(os.getenv('ADAPTIVE_MAX_PER_BUCKET', '3'))
+# Never longer than the shortest fixed-form test
+MAX_QUESTIONS = int(os.getenv('ADAPTIVE_MAX_QUESTIONS', '6'))
+MIN_RESPONSES = int(os.getenv('ADAPTIVE_MIN_RESPONSES', '20'))
+BANK_REFRESH_SECONDS = float(os.getenv('ADAPTIVE_BANK_REFRESH_SECONDS', '600'))
+
+# Where items sit before any student has answered them
+PRIOR_DIFFICULTY = {"Basic": -1.0, "Conceptual": 0.0, "Application": 1.0}
+PRIOR_WEIGHT = 5.0
+D = 1.702  # logistic approximation of the normal ogive
+GRID = np.linspace(-4, 4, 81)
+LOG_PRIOR = norm.logpdf(GRID)
+
+
+def calibrate(rows: List[Dict], model: str = IRT_MODEL) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Item discrimination (a) and difficulty (b) from the calibration
+    aggregates, vectorized over the bank. 2PL uses Lord's conversion of the
+    classical statistics: the biserial correlation with the rest score gives
+    a, and b = z(1 - p) / r. Items with fewer than MIN_RESPONSES answers, and
+    every item under Rasch, keep a = 1 and take b from their p-value shrunk
+    toward their bucket's prior difficulty.
+    """
+    n = np.array([row['n'] for row in rows], dtype=np.float64)
+    correct = np.array([row['correct'] for row in rows], dtype=np.float64)
+    prior_b = np.array([PRIOR_DIFFICULTY.get(row['bucket'], 0.0) for row in rows])
+    prior_p = 1 / (1 + np.exp(D * prior_b))
+
+    p = (correct + PRIOR_WEIGHT * prior_p) / (n + PRIOR_WEIGHT)
+    a = np.ones(len(rows))
+    b = -np.log(p / (1 - p)) / D
+
+    if model == '2pl' and len(rows):
+        sum_rest = np.array([row['sum_rest'] for row in rows])
+        sum_rest_sq = np.array([row['sum_rest_sq'] for row in rows])
+        sum_rest_correct = np.array([row['sum_rest_correct'] for row in rows])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            raw_p = correct / n
+            mean = sum_rest / n
+            sd = np.sqrt(np.maximum(sum_rest_sq / n - mean ** 2, 0))
+            point_biserial = (sum_rest_correct / correct - mean) / sd * np.sqrt(raw_p / (1 - raw_p))
+            biserial = point_biserial * np.sqrt(raw_p * (1 - raw_p)) / norm.pdf(norm.ppf(raw_p))
+        usable = (n >= MIN_RESPONSES) & (correct > 0) & (correct < n) & np.isfinite(biserial)
+        r = np.clip(np.nan_to_num(biserial), 0.15, 0.9)
+        a = np.where(usable, r / np.sqrt(1 - r ** 2), a)
+        b = np.where(usable, norm.ppf(1 - np.clip(raw_p, 0.02, 0.98)) / r, b)
+    return a, np.clip(b, -3.5, 3.5)
+
+
+class ItemBank:
+    """Calibrated MCQs for one chapter, held as parallel arrays so every step is vectorized"""
+
+    def __init__(self, chapter: str, items: List[Dict], a: np.ndarray, b: np.ndarray):
+        self.chapter = chapter
+        self.items = items
+        self.keys = [item_key(item) for item in items]
+        self.index = {key: idx for idx, key in enumerate(self.keys)}
+        self.a = a
+        self.b = b
+        self.buckets = np.array([BUCKET_CODES[item['bucket']] for item in items], dtype=np.int8)
+        self.cuts = self._cut_scores()
+
+    def probability(self, theta, idx=None) -> np.ndarray:
+        a = self.a if idx is None else self.a[idx]
+        b = self.b if idx is None else self.b[idx]
+        return 1 / (1 + np.exp(-D * a * (np.asarray(theta) - b)))
+
+    def _cut_scores(self) -> np.ndarray:
+        """Per bucket, the ability at which the expected score on the bucket's items is 50%"""
+        expected = self.probability(GRID[:, None])  # grid x items
+        cuts = np.zeros(len(BUCKETS))
+        for code in range(len(BUCKETS)):
+            mask = self.buckets == code
+            if mask.any():
+                curve = expected[:, mask].mean(axis=1)
+                cuts[code] = np.interp(0.5, curve, GRID)
+        return cuts
+
+    def ready(self) -> bool:
+        return all(np.count_nonzero(self.buckets == code) >= MIN_PER_BUCKET for code in range(len(BUCKETS)))
+
+    def summary(self) -> Dict:
+        return {
+            "chapter": self.chapter,
+            "items": len(self.items),
+            "model": IRT_MODEL,
+            "buckets": {bucket: int(np.count_nonzero(self.buckets == code)) for code, bucket in enumerate(BUCKETS)},
+            "cut_scores": {bucket: round(float(self.cuts[code]), 3) for code, bucket in enumerate(BUCKETS)}
+        }
+
+
+def _candidate_items(chapter: str) -> List[Dict]:
+    """Uncalibrated items: the chapter's banked generated tests and answered past-paper MCQs"""
+    from services.cache import get_cache
+    from services.chapter_loader import build_ai_context
+    candidates = []
+    context = build_ai_context(chapter)
+    if "error" not in context:
+        for diagnostic in get_cache('diagnostic_bank').get(context['content_hash']) or []:
+            candidates.extend(diagnostic.get("diagnostic_test") or [])
+    past = draw_mcq_items(chapter, 200)
+    if past:
+        candidates.extend(items_to_diagnostic(chapter, past)["diagnostic_test"])
+    return candidates
+
+
+def build_item_bank(chapter: str) -> ItemBank:
+    rows = get_item_analysis().item_calibration(chapter)
+    seen = {row['item_key'] for row in rows}
+    items = [json.loads(row['payload']) for row in rows]
+    for item in _candidate_items(chapter):
+        key = item_key(item)
+        if key not in seen and item.get('bucket') in BUCKET_CODES and item.get('answer'):
+            seen.add(key)
+            items.append({field: item.get(field) for field in ITEM_FIELDS})
+            rows.append({"bucket": item['bucket'], "n": 0, "correct": 0,
+                         "sum_rest": 0.0, "sum_rest_sq": 0.0, "sum_rest_correct": 0.0})
+    a, b = calibrate(rows)
+    return ItemBank(chapter, items, a, b)
+
+
+_banks: Dict[str, Tuple[float, ItemBank]] = {}
+_banks_lock = threading.Lock()
+
+
+def get_item_bank(chapter: str, refresh: bool = False) -> ItemBank:
+    """Per-process bank for a chapter, recalibrated after BANK_REFRESH_SECONDS"""
+    with _banks_lock:
+        cached = _banks.get(chapter)
+    if cached and not refresh and time.monotonic() - cached[0] < BANK_REFRESH_SECONDS:
+        return cached[1]
+    bank = build_item_bank(chapter)
+    with _banks_lock:
+        _banks[chapter] = (time.monotonic(), bank)
+    return bank
+
+
+def public_item(item: Dict) -> Dict:
+    return {field: item.get(field) for field in ITEM_FIELDS if field != 'answer'}
+
+
+def placeholder_test(chapter: str, session_id: str) -> Dict:
+    """test_data of the diagnostics row an adaptive session reports into"""
+    return {"chapter": chapter, "mode": "adaptive", "diagnostic_test": [], "session_id": session_id}
+
+
+def active_session_id(diagnostic: Optional[Dict]) -> Optional[str]:
+    """The live adaptive session writing to this diagnostics row, if any"""
+    session_id = ((diagnostic or {}).get('test_data') or {}).get('session_id')
+    if session_id and get_adaptive_store().get(session_id, diagnostic.get('user_id')):
+        return session_id
+    return None
+
+
+def new_session(chapter: str, user_id: str, diagnostic_id: Optional[str]) -> Dict:
+    return {
+        "session_id": uuid.uuid4().hex,
+        "chapter": chapter,
+        "user_id": user_id,
+        "diagnostic_id": diagnostic_id,
+        "asked": [],
+        "answers": [],
+        "correct": [],
+        "current": None
+    }
+
+
+def _pin(session: Dict, bank: ItemBank, key: str):
+    """
+    Keep an item's content and calibration in the session once it is asked.
+    Banks are rebuilt per process, so the worker grading an answer may not
+    hold the item; the session then scores with what it was asked under.
+    """
+    idx = bank.index[key]
+    item = bank.items[idx]
+    session.setdefault("items", {})[key] = {
+        **{field: item.get(field) for field in ITEM_FIELDS},
+        "a": float(bank.a[idx]),
+        "b": float(bank.b[idx])
+    }
+
+
+def session_item(session: Dict, bank: ItemBank, key: str) -> Optional[Dict]:
+    """The pinned item, else this bank's copy (sessions started before pinning); None if neither has it"""
+    pinned = (session.get("items") or {}).get(key)
+    if pinned:
+        return pinned
+    if key in bank.index:
+        idx = bank.index[key]
+        return {**bank.items[idx], "a": float(bank.a[idx]), "b": float(bank.b[idx])}
+    return None
+
+
+def _responses(session: Dict, bank: ItemBank) -> Tuple[List[Dict], List[bool]]:
+    pairs = [(session_item(session, bank, key), correct) for key, correct in zip(session["asked"], session["correct"])]
+    pairs = [(item, correct) for item, correct in pairs if item and item.get('bucket') in BUCKET_CODES]
+    return [item for item, _ in pairs], [correct for _, correct in pairs]
+
+
+def posterior(session: Dict, bank: ItemBank) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    EAP ability and standard error per bucket over a quadrature grid. The
+    likelihood is rebuilt from the responses (grid x answered items), using
+    the calibration each item was asked under.
+    """
+    log_likelihood = np.zeros((len(BUCKETS), len(GRID)))
+    items, correct = _responses(session, bank)
+    if items:
+        x = np.array(correct, dtype=np.float64)
+        a = np.array([item['a'] for item in items])
+        b = np.array([item['b'] for item in items])
+        p = 1 / (1 + np.exp(-D * a * (GRID[:, None] - b)))
+        per_response = x * np.log(p) + (1 - x) * np.log(1 - p)
+        one_hot = np.eye(len(BUCKETS))[[BUCKET_CODES[item['bucket']] for item in items]]
+        log_likelihood = (per_response @ one_hot).T
+    log_post = log_likelihood + LOG_PRIOR
+    weights = np.exp(log_post - log_post.max(axis=1, keepdims=True))
+    weights /= weights.sum(axis=1, keepdims=True)
+    theta = weights @ GRID
+    se = np.sqrt(np.maximum(weights @ GRID ** 2 - theta ** 2, 0))
+    return theta, se
+
+
+def _asked_per_bucket(session: Dict, bank: ItemBank) -> np.ndarray:
+    counts = np.zeros(len(BUCKETS), dtype=np.int64)
+    for item in _responses(session, bank)[0]:
+        counts[BUCKET_CODES[item['bucket']]] += 1
+    return counts
+
+
+def finished_buckets(session: Dict, bank: ItemBank) -> np.ndarray:
+    """
+    A bucket is done once it has MIN_PER_BUCKET answers and either its
+    standard error reaches SE_TARGET or the pass/fail call is confident
+    (ability further than CONFIDENCE_Z standard errors from the cut), or
+    when it reaches MAX_PER_BUCKET or runs out of items. Once the test has
+    only the slots left that unstarted buckets need, every other bucket is
+    done; at MAX_QUESTIONS all are.
+    """
+    theta, se = posterior(session, bank)
+    asked = _asked_per_bucket(session, bank)
+    available = np.bincount(bank.buckets, minlength=len(BUCKETS)) - asked
+    confident = (se <= SE_TARGET) | (np.abs(theta - bank.cuts) >= CONFIDENCE_Z * se)
+    done = ((asked >= MIN_PER_BUCKET) & confident) | (asked >= MAX_PER_BUCKET) | (available <= 0)
+    short = np.where(done, 0, np.maximum(MIN_PER_BUCKET - asked, 0))
+    remaining = MAX_QUESTIONS - len(session["asked"])
+    if remaining <= 0:
+        return np.ones(len(BUCKETS), dtype=bool)
+    if remaining <= short.sum():
+        done |= short == 0
+    return done
+
+
+def next_item(session: Dict, bank: ItemBank, rng: Optional[random.Random] = None) -> Optional[str]:
+    """
+    Most informative unanswered item at the current ability estimate of its
+    bucket, among unfinished buckets. Picks at random among the top three
+    to spread exposure; None ends the test.
+    """
+    done = finished_buckets(session, bank)
+    if done.all():
+        return None
+    theta, _ = posterior(session, bank)
+    p = bank.probability(theta[bank.buckets])
+    information = (D * bank.a) ** 2 * p * (1 - p)
+    information[done[bank.buckets]] = -1
+    for key in session["asked"]:
+        if key in bank.index:
+            information[bank.index[key]] = -1
+    top = [idx for idx in np.argsort(-information)[:3] if information[idx] >= 0]
+    if not top:
+        return None
+    key = bank.keys[(rng or random).choice(top)]
+    _pin(session, bank, key)
+    return key
+
+
+def record_answer(session: Dict, bank: ItemBank, answer: str) -> Optional[bool]:
+    """Grade the current item and add it to the session's responses; None when the item is unknown"""
+    item = session_item(session, bank, session["current"])
+    if item is None:
+        return None
+    correct = str(answer or '').strip().upper() == str(item['answer']).strip().upper()
+    session["asked"].append(session["current"])
+    session["answers"].append(str(answer or '').strip().upper())
+    session["correct"].append(correct)
+    session["current"] = None
+    return correct
+
+
+def outcome(session: Dict, bank: ItemBank) -> Dict:
+    """
+    Result row shaped like a fixed-form submission. A bucket passes when the
+    ability estimate is at or above its cut, i.e. the student is expected to
+    score at least 50% on the bucket's items, which is the fixed form's rule.
+    The percentage is that expected score over the whole bank.
+    """
+    theta, se = posterior(session, bank)
+    results, bucket_scores, bucket_totals = [], {b: 0 for b in BUCKETS}, {b: 0 for b in BUCKETS}
+    for position, key in enumerate(session["asked"]):
+        item = session_item(session, bank, key) or {}
+        bucket = item.get('bucket', 'Basic')
+        bucket_totals[bucket] += 1
+        bucket_scores[bucket] += 1 if session["correct"][position] else 0
+        results.append({
+            "question_id": str(position),
+            "question": item.get('question', ''),
+            "bucket": bucket,
+            "user_answer": session["answers"][position],
+            "correct_answer": item.get('answer', ''),
+            "is_correct": session["correct"][position],
+            "marks": item.get('marks', 1)
+        })
+    bucket_passed = {bucket: bool(theta[code] >= bank.cuts[code]) for code, bucket in enumerate(BUCKETS)}
+    expected = float(bank.probability(theta[bank.buckets]).mean()) if len(bank.items) else 0.0
+    return {
+        "results": results,
+        "bucket_scores": bucket_scores,
+        "bucket_totals": bucket_totals,
+        "bucket_passed": bucket_passed,
+        "ability": {
+            bucket: {"theta": round(float(theta[code]), 3), "se": round(float(se[code]), 3),
+                     "cut": round(float(bank.cuts[code]), 3)}
+            for code, bucket in enumerate(BUCKETS)
+        },
+        "total_correct": sum(bucket_scores.values()),
+        "total_questions": len(results),
+        "percentage": round(expected * 100, 2),
+        "passed": all(bucket_passed.values())
+    }
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_adaptive_store() -> SessionStore:
+    """In-progress adaptive tests, shared by all workers on a host"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(
+                path=os.getenv('ADAPTIVE_SESSION_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'adaptive_sessions.sqlite3'),
+                ttl=float(os.getenv('ADAPTIVE_SESSION_TTL_SECONDS', '3600'))
+            )
+        return _store
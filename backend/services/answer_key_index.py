@@ -0,0 +1,90 @@
+import re
+from typing import Dict, Optional, Tuple
+
+# "7", "7(a)", "7 (b)(ii)", "7a" -> question number plus optional sub-parts
+_QUESTION_ID = r'(\d{1,3})((?:[a-z](?![a-z]))?(?:\s*\(\s*[a-z]{1,4}\s*\))*)'
+_ENTRY_LINE = re.compile(r'^\s*(?:(?i:q(?:uestion)?)\.?\s*)?' + _QUESTION_ID + r'[\s.:)\-]+(.+?)\s*$')
+_MCQ_PAIR = re.compile(r'(\d{1,3})\s*[.:)\-]?\s+([A-D])(?=\s|$)')
+_MCQ_ROW = re.compile(r'^(?:\s*\d{1,3}\s*[.:)\-]?\s+[A-D](?=\s|$))+\s*$')
+_TRAILING_MARKS = re.compile(r'\s*(?:\[\s*\d+\s*\]|\(\s*\d+\s*marks?\s*\)|(?<=\S)\s+\d)\s*$', re.IGNORECASE)
+_SKIP_LINE = re.compile(r'^\s*(question|answer|marks|page \d+|©|ucles|mark scheme)', re.IGNORECASE)
+# Only an explicit question prefix counts: "atomic number 6" or "group no. 1" is chemistry, not a reference
+_QUESTION_REFERENCE = re.compile(
+    r'(?:\b(?:q|qn|ques|question)|\bpast[\s-]*paper\s+(?:no\.?|number|#))\s*\.?\s*' + _QUESTION_ID + r'(?!\w)',
+    re.IGNORECASE
+)
+
+
+def normalize_question_id(number: str, parts: str = '') -> str:
+    """Canonical key: '7', '7(a)', '7(a)(ii)'"""
+    parts = (parts or '').lower().replace(' ', '')
+    if parts and not parts.startswith('('):
+        parts = f"({parts[0]}){parts[1:]}"
+    return f"{int(number)}{parts}"
+
+
+def parse_answer_key(answer_key_text: str) -> Dict[str, str]:
+    """Parse answer key text into a question id -> answer mapping"""
+    index: Dict[str, str] = {}
+    if not answer_key_text:
+        return index
+
+    last_key = None
+    for raw_line in answer_key_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        # Multiple-choice keys are often laid out as columns: "1 B  11 C  21 A"
+        if _MCQ_ROW.match(line):
+            for number, letter in _MCQ_PAIR.findall(line):
+                index[normalize_question_id(number)] = letter.upper()
+            last_key = None
+            continue
+
+        match = _ENTRY_LINE.match(line)
+        if match and not _SKIP_LINE.match(line):
+            key = normalize_question_id(match.group(1), match.group(2))
+            answer = _TRAILING_MARKS.sub('', match.group(3)).strip()
+            if answer:
+                index[key] = f"{index[key]} {answer}" if key in index else answer
+                last_key = key
+                continue
+
+        if last_key and not _SKIP_LINE.match(line):
+            # Continuation of a multi-line mark scheme entry
+            index[last_key] = f"{index[last_key]} {_TRAILING_MARKS.sub('', line).strip()}".strip()
+
+    # Make whole-question lookups O(1) when only sub-parts are keyed
+    parents: Dict[str, list] = {}
+    for key in index:
+        if '(' in key:
+            parents.setdefault(key.split('(', 1)[0], []).append(key)
+    for parent, children in parents.items():
+        if parent not in index:
+            index[parent] = '; '.join(f"{child}: {index[child]}" for child in children)
+
+    return index
+
+
+def find_question_reference(question: str) -> Optional[str]:
+    """Return the canonical question id a student refers to ("Q7", "question 7(a)")"""
+    if not question:
+        return None
+    match = _QUESTION_REFERENCE.search(question)
+    if not match:
+        return None
+    return normalize_question_id(match.group(1), match.group(2))
+
+
+def lookup_answer(index: Dict[str, str], question: str) -> Optional[Tuple[str, str]]:
+    """Return (question_id, answer) if the question references a keyed past-paper question"""
+    if not index:
+        return None
+    question_id = find_question_reference(question)
+    if not question_id:
+        return None
+    answer = index.get(question_id)
+    if answer is None:
+        return None
+    return question_id, answer
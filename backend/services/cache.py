@@ -0,0 +1,452 @@
+import os
+import time
+import pickle
+import random
+import socket
+import hashlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+from services.local_store import DEFAULT_CACHE_DIR, SQLiteFile
+from services.singleflight import get_keyed_lock
+
+_DEFAULT = object()
+
+
+def content_key(*parts: str) -> str:
+    """Stable key for derived artifacts; changes whenever any source part changes"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or '').encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()[:32]
+
+
+class CacheBackend(ABC):
+    """Byte-oriented key/value store with optional per-key expiry"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: Optional[float] = None) -> bytes:
+        """
+        Atomic read-modify-write of one key; returns the stored value. The
+        default serializes on a per-key file lock, which covers every worker
+        on this host; stores shared across hosts override it.
+        """
+        with get_keyed_lock().hold(f"cache:{key}", timeout=30):
+            value = fn(self.get(key))
+            self.set(key, value, ttl)
+        return value
+
+    def info(self) -> Dict:
+        return {"backend": self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU bounded by the total size of stored values"""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(key) + len(entry[0])
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions
+            }
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires_at REAL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at)',
+]
+
+
+class SQLiteBackend(CacheBackend):
+    """Disk store shared by every worker process on the host"""
+
+    name = "sqlite"
+    PURGE_EVERY = 500
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('CACHE_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'cache.sqlite3')
+        self._db = SQLiteFile(self.path, _SCHEMA)
+        self._writes = 0
+
+    def _connect(self):
+        return self._db.connect()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (key, time.time())
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                (key, sqlite3.Binary(value), time.time() + ttl if ttl else None)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute('DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def info(self) -> Dict:
+        with self._connect() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {"backend": self.name, "path": self.path, "entries": entries, "file_bytes": size}
+
+
+class RedisBackend(CacheBackend):
+    """
+    Minimal RESP client (GET/SET PX/DEL, WATCH/MULTI/EXEC) so any Redis-protocol server works,
+    including a local stand-in, without an extra dependency. One connection
+    per thread.
+    """
+
+    name = "redis"
+    UPDATE_ATTEMPTS = 20
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 2.0):
+        parsed = urlparse(url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or '/0').lstrip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._command('AUTH', self.password)
+            if self.db:
+                self._command('SELECT', str(self.db))
+        return conn
+
+    def _command(self, *args) -> Any:
+        sock, reader = self._connection()
+        payload = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            payload.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        try:
+            sock.sendall(b"".join(payload))
+            return self._read(reader)
+        except (OSError, ConnectionError):
+            self._reset()
+            raise
+
+    def _read(self, reader) -> Any:
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b'+':
+            return rest.decode()
+        if prefix == b'-':
+            raise RuntimeError(rest.decode())
+        if prefix == b':':
+            return int(rest)
+        if prefix == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            count = int(rest)
+            return None if count < 0 else [self._read(reader) for _ in range(count)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn:
+            try:
+                conn[0].close()
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command('GET', key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if ttl:
+            self._command('SET', key, value, 'PX', str(int(ttl * 1000)))
+        else:
+            self._command('SET', key, value)
+
+    def delete(self, key: str):
+        self._command('DEL', key)
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: Optional[float] = None) -> bytes:
+        """Optimistic WATCH/MULTI/EXEC, retried when another client wrote the key first"""
+        for attempt in range(self.UPDATE_ATTEMPTS):
+            if attempt:
+                time.sleep(random.uniform(0, 0.005 * attempt))
+            try:
+                self._command('WATCH', key)
+                value = fn(self._command('GET', key))
+                self._command('MULTI')
+                if ttl:
+                    self._command('SET', key, value, 'PX', str(int(ttl * 1000)))
+                else:
+                    self._command('SET', key, value)
+                if self._command('EXEC') is not None:
+                    return value
+            except Exception:
+                # Drop the connection rather than leave it inside a WATCH or MULTI
+                self._reset()
+                raise
+        raise RuntimeError(f"Redis update of {key} kept conflicting")
+
+    def info(self) -> Dict:
+        return {"backend": self.name, "host": self.host, "port": self.port, "db": self.db}
+
+
+class TieredBackend(CacheBackend):
+    """Small in-process LRU in front of a shared backend; L1 entries live at most l1_ttl seconds"""
+
+    def __init__(self, l1: MemoryBackend, l2: CacheBackend, l1_ttl: float):
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+        self.name = f"{l2.name}+memory"
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l2.get(key)
+            if value is not None:
+                self.l1.set(key, value, self.l1_ttl)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.l2.set(key, value, ttl)
+        self.l1.set(key, value, min(ttl, self.l1_ttl) if ttl else self.l1_ttl)
+
+    def delete(self, key: str):
+        self.l2.delete(key)
+        self.l1.delete(key)
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ttl: Optional[float] = None) -> bytes:
+        # Read from the shared tier so no other worker's write is lost
+        value = self.l2.update(key, fn, ttl)
+        self.l1.set(key, value, min(ttl, self.l1_ttl) if ttl else self.l1_ttl)
+        return value
+
+    def info(self) -> Dict:
+        return {"backend": self.name, "l1": self.l1.info(), "l2": self.l2.info()}
+
+
+class Cache:
+    """
+    Namespaced view over a backend. Values are pickled, so callers always get
+    their own copy. Backend failures count as misses and are never raised.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str, default_ttl: Optional[float] = None):
+        self.backend = backend
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.stats = _namespace_stats(namespace)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _count(self, field: str):
+        with _stats_lock:
+            self.stats[field] += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            raw = self.backend.get(self._key(key))
+        except Exception as e:
+            print(f"Cache get failed ({self.namespace}): {e}")
+            self._count("errors")
+            return default
+        if raw is None:
+            self._count("misses")
+            return default
+        self._count("hits")
+        return pickle.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Any = _DEFAULT):
+        ttl = self.default_ttl if ttl is _DEFAULT else ttl
+        try:
+            self.backend.set(self._key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+            self._count("sets")
+        except Exception as e:
+            print(f"Cache set failed ({self.namespace}): {e}")
+            self._count("errors")
+
+    def delete(self, key: str):
+        try:
+            self.backend.delete(self._key(key))
+            self._count("deletes")
+        except Exception as e:
+            print(f"Cache delete failed ({self.namespace}): {e}")
+            self._count("errors")
+
+    def get_or_set(self, key: str, factory: Callable[[], Any], ttl: Any = _DEFAULT) -> Any:
+        value = self.get(key, _DEFAULT)
+        if value is _DEFAULT:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def extend(self, key: str, values: List[Any], max_length: Optional[int] = None) -> int:
+        """
+        Append to a list value; returns the new length. Atomic per key through
+        the backend's update, so concurrent appends from any worker are kept.
+        """
+        length = 0
+
+        def append(raw: Optional[bytes]) -> bytes:
+            nonlocal length
+            current = pickle.loads(raw) if raw is not None else []
+            current.extend(values)
+            if max_length is not None:
+                current = current[:max_length]
+            length = len(current)
+            return pickle.dumps(current, protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            self.backend.update(self._key(key), append, self.default_ttl)
+        except Exception as e:
+            print(f"Cache extend failed ({self.namespace}): {e}")
+            self._count("errors")
+            return 0
+        self._count("sets")
+        return length
+
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _namespace_stats(namespace: str) -> Dict[str, int]:
+    with _stats_lock:
+        return _stats.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "deletes": 0, "errors": 0})
+
+
+def create_backend() -> CacheBackend:
+    """CACHE_BACKEND=sqlite (default) | redis | memory, with an optional in-process L1"""
+    kind = os.getenv('CACHE_BACKEND', 'sqlite').lower()
+    if kind == 'memory':
+        return MemoryBackend(int(os.getenv('CACHE_MEMORY_BYTES', str(64 * 1024 * 1024))))
+    shared = RedisBackend() if kind == 'redis' else SQLiteBackend()
+    l1_bytes = int(os.getenv('CACHE_L1_BYTES', str(16 * 1024 * 1024)))
+    if l1_bytes <= 0:
+        return shared
+    return TieredBackend(MemoryBackend(l1_bytes), shared, float(os.getenv('CACHE_L1_TTL', '30')))
+
+
+_backend: Optional[CacheBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> CacheBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def set_backend(backend: CacheBackend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def get_cache(namespace: str, ttl: Optional[float] = None) -> Cache:
+    return Cache(get_backend(), namespace, ttl)
+
+
+def cache_stats() -> Dict:
+    with _stats_lock:
+        namespaces = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in namespaces.values():
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = round(counts["hits"] / lookups, 4) if lookups else None
+    try:
+        info = get_backend().info()
+    except Exception as e:
+        info = {"error": str(e)}
+    return {"backend": info, "namespaces": namespaces}
@@ -0,0 +1,186 @@
+import os
+import mmap
+import json
+import time
+import struct
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Optional
+from services.local_store import DEFAULT_CACHE_DIR
+
+MAGIC = b'CHCORPUS1\n'
+TEXT_FIELDS = ('syllabus', 'past_paper_text', 'answer_key_text')
+CHECK_SECONDS = float(os.getenv('CHAPTER_CORPUS_CHECK_SECONDS', '5'))
+
+
+def corpus_path() -> str:
+    return os.getenv('CHAPTER_CORPUS_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'chapter_corpus.bin')
+
+
+def render_ai_prompt(chapter_name: str, syllabus: str, past_paper_text: str, answer_key_text: str) -> str:
+    return f"""Chapter: {chapter_name}
+
+SYLLABUS CONTENT:
+{syllabus}
+
+PAST PAPER QUESTIONS:
+{past_paper_text}
+
+ANSWER KEY:
+{answer_key_text}
+
+---
+Use the above information to generate educational content, questions, and explanations for the {chapter_name} chapter."""
+
+
+def write_corpus(contexts: Iterable[Dict], path: Optional[str] = None) -> Dict:
+    """
+    Write chapter texts as one file: magic, 8-byte table length, JSON offset
+    table, then the UTF-8 texts back to back. Replaced atomically, so readers
+    holding the old mapping keep working until they remap.
+    """
+    path = path or corpus_path()
+    table: Dict[str, Dict] = {}
+    blobs = []
+    offset = 0
+    for context in contexts:
+        entry = {
+            "content_hash": context.get("content_hash"),
+            "source_version": context.get("source_version"),
+            "answer_key_index": context.get("answer_key_index") or {},
+            "fields": {}
+        }
+        for field in TEXT_FIELDS:
+            data = (context.get(field) or '').encode('utf-8')
+            entry["fields"][field] = [offset, len(data)]
+            blobs.append(data)
+            offset += len(data)
+        table[context["chapter"]] = entry
+
+    header = json.dumps(table).encode('utf-8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp, path)
+    return {"path": path, "chapters": len(table), "bytes": len(MAGIC) + 8 + len(header) + offset}
+
+
+class ChapterCorpus:
+    """Read-only memory map of the corpus file; text is decoded only when asked for"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a chapter corpus file")
+        (table_length,) = struct.unpack_from('<Q', self._map, len(MAGIC))
+        table_start = len(MAGIC) + 8
+        self.table = json.loads(self._map[table_start:table_start + table_length])
+        self._data_start = table_start + table_length
+
+    def chapters(self):
+        return list(self.table)
+
+    def slice(self, chapter: str, field: str) -> memoryview:
+        """Zero-copy view of a chapter field's UTF-8 bytes"""
+        offset, length = self.table[chapter]["fields"][field]
+        start = self._data_start + offset
+        return memoryview(self._map)[start:start + length]
+
+    def text(self, chapter: str, field: str) -> str:
+        return str(self.slice(chapter, field), 'utf-8')
+
+    def context(self, chapter: str) -> Optional['CorpusContext']:
+        entry = self.table.get(chapter)
+        return CorpusContext(self, chapter, entry) if entry else None
+
+
+class CorpusContext(Mapping):
+    """
+    Chapter context backed by the shared corpus, read like the dict
+    build_ai_context returns. Source texts are decoded from the mapping the
+    first time they are read through this context and kept until it is
+    dropped, so one request decodes each field once and workers hold no
+    long-lived copies.
+    """
+
+    def __init__(self, corpus: ChapterCorpus, chapter: str, entry: Dict):
+        self._corpus = corpus
+        self._fields = {
+            "chapter": chapter,
+            "content_hash": entry["content_hash"],
+            "source_version": entry.get("source_version"),
+            "answer_key_index": entry["answer_key_index"]
+        }
+        self._texts: Dict[str, str] = {}
+
+    def __getitem__(self, key):
+        if key in TEXT_FIELDS:
+            text = self._texts.get(key)
+            if text is None:
+                text = self._texts[key] = self._corpus.text(self._fields["chapter"], key)
+            return text
+        if key == 'ai_prompt_ready':
+            if key not in self._texts:
+                self._texts[key] = render_ai_prompt(self._fields["chapter"], *(self[field] for field in TEXT_FIELDS))
+            return self._texts[key]
+        return self._fields[key]
+
+    def __iter__(self):
+        yield from self._fields
+        yield from TEXT_FIELDS
+        yield 'ai_prompt_ready'
+
+    def __len__(self) -> int:
+        return len(self._fields) + len(TEXT_FIELDS) + 1
+
+    def copy(self) -> Dict:
+        """Plain dict with every field decoded, e.g. for json.dumps or the context cache"""
+        return dict(self)
+
+
+_corpus: Optional[ChapterCorpus] = None
+_checked_at = 0.0
+_corpus_lock = threading.Lock()
+
+
+def get_corpus() -> Optional[ChapterCorpus]:
+    """
+    Shared mapping for this process. Safe to open before gunicorn forks
+    (--preload): children inherit the read-only mapping. The file is
+    re-checked every few seconds and remapped after a rebuild.
+    """
+    global _corpus, _checked_at
+    if os.getenv('CHAPTER_CORPUS', 'auto').lower() == 'off':
+        return None
+    now = time.monotonic()
+    if _checked_at and now - _checked_at < CHECK_SECONDS:
+        return _corpus
+    with _corpus_lock:
+        _checked_at = now
+        path = corpus_path()
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            _corpus = None
+            return None
+        if _corpus is None or _corpus.identity != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                _corpus = ChapterCorpus(path)
+            except Exception as e:
+                print(f"Error mapping chapter corpus {path}: {e}")
+                _corpus = None
+        return _corpus
+
+
+def corpus_context(chapter: str) -> Optional[CorpusContext]:
+    corpus = get_corpus()
+    return corpus.context(chapter) if corpus else None
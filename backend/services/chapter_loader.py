@@ -1,9 +1,22 @@
 import os
 import requests
-import pdfplumber
-from typing import Dict, Optional
-from io import BytesIO
+from typing import Dict, List, Optional
 from supabase import create_client, Client
+from services.answer_key_index import parse_answer_key
+from services.item_store import ingest_past_paper
+from services.cache import get_cache, content_key
+from services.chapter_corpus import corpus_context, render_ai_prompt
+from services.pdf_extract import EXTRACTORS, get_extractor
+
+PDF_TEXT_TTL = float(os.getenv('PDF_TEXT_TTL', str(7 * 24 * 3600)))
+CHAPTER_CONTEXT_TTL = float(os.getenv('CHAPTER_CONTEXT_TTL', '300'))
+
+
+def source_version(chapter_name: str, chapter_data: Dict) -> str:
+    """Version of a chapter's database row: its syllabus text and PDF locations"""
+    return content_key(chapter_name, chapter_data.get('syllabus') or '',
+                       chapter_data.get('past_paper_pdf_url') or '', chapter_data.get('answer_key_pdf_url') or '')
+
 
 class ChapterLoader:
     def __init__(self):
@@ -15,6 +28,14 @@ class ChapterLoader:
         
         self.supabase: Client = create_client(url, key)
     
+    def list_chapters(self) -> List[str]:
+        try:
+            response = self.supabase.table('chemistry_chapters').select('chapter_name').execute()
+            return [row['chapter_name'] for row in response.data or [] if row.get('chapter_name')]
+        except Exception as e:
+            print(f"Error listing chapters: {e}")
+            return []
+    
     def get_chapter_data(self, chapter_name: str) -> Optional[Dict]:
         try:
             response = self.supabase.table('chemistry_chapters')\
@@ -40,20 +61,21 @@ class ChapterLoader:
         if not pdf_url:
             return ""
         
+        extractor = get_extractor()
+        # Backends lay text out differently, so each keeps its own cache entry
+        cache_key = f"{extractor.name}:{pdf_url}"
+        cache = get_cache('pdf_text', PDF_TEXT_TTL)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             response = requests.get(pdf_url, timeout=30)
             response.raise_for_status()
             
-            pdf_bytes = BytesIO(response.content)
-            
-            text_content = []
-            with pdfplumber.open(pdf_bytes) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_content.append(page_text)
-            
-            return "\n\n".join(text_content).strip()
+            text = extractor.extract_text(response.content)
+            cache.set(cache_key, text)
+            return text
         except requests.RequestException as e:
             print(f"Error downloading PDF: {e}")
             return ""
@@ -75,38 +97,76 @@ class ChapterLoader:
         
         past_paper_text = self.extract_pdf_text(past_paper_url)
         answer_key_text = self.extract_pdf_text(answer_key_url)
+        answer_key_index = parse_answer_key(answer_key_text)
+        ingest_past_paper(chapter_name, past_paper_text, answer_key_index)
         
-        ai_prompt_ready = f"""Chapter: {chapter_name}
-
-SYLLABUS CONTENT:
-{syllabus}
-
-PAST PAPER QUESTIONS:
-{past_paper_text}
-
-ANSWER KEY:
-{answer_key_text}
-
----
-Use the above information to generate educational content, questions, and explanations for the {chapter_name} chapter."""
+        ai_prompt_ready = render_ai_prompt(chapter_name, syllabus, past_paper_text, answer_key_text)
         
-        return {
+        context = {
             "chapter": chapter_name,
             "syllabus": syllabus,
             "past_paper_text": past_paper_text,
             "answer_key_text": answer_key_text,
+            "answer_key_index": answer_key_index,
+            "content_hash": content_key(chapter_name, syllabus, past_paper_text, answer_key_text),
+            "source_version": source_version(chapter_name, chapter_data),
             "ai_prompt_ready": ai_prompt_ready
         }
+        get_cache('chapter_context', CHAPTER_CONTEXT_TTL).set(chapter_name, context)
+        return context
 
 def get_chapter_data(chapter_name: str) -> Optional[Dict]:
     loader = ChapterLoader()
     return loader.get_chapter_data(chapter_name)
 
+def forget_pdf_text(chapter_name: str):
+    """Drop cached PDF text for a chapter so the next load re-extracts it"""
+    chapter_data = get_chapter_data(chapter_name) or {}
+    cache = get_cache('pdf_text')
+    for field in ('past_paper_pdf_url', 'answer_key_pdf_url'):
+        if chapter_data.get(field):
+            for name in EXTRACTORS:
+                cache.delete(f"{name}:{chapter_data[field]}")
+    get_cache('chapter_context').delete(chapter_name)
+    # The PDFs may have changed under the same URLs; stop serving the corpus copy until it is rewritten
+    mapped = corpus_context(chapter_name)
+    if mapped is not None:
+        get_cache('corpus_checks').set(f"{chapter_name}:{mapped['content_hash']}", False, ttl=None)
+
+
+def _corpus_current(chapter_name: str, mapped: Dict) -> bool:
+    """
+    Whether the corpus copy still matches the database row. Checked once per
+    CHAPTER_CONTEXT_TTL for the host, or marked stale by forget_pdf_text.
+    """
+    checks = get_cache('corpus_checks', CHAPTER_CONTEXT_TTL)
+    key = f"{chapter_name}:{mapped['content_hash']}"
+    current = checks.get(key)
+    if current is None:
+        chapter_data = get_chapter_data(chapter_name)
+        if chapter_data is None:
+            return True  # database unreachable: the corpus is the best copy there is
+        current = mapped.get('source_version') == source_version(chapter_name, chapter_data)
+        checks.set(key, current)
+    return current
+
+
+def clear_corpus_checks(chapter_name: str, content_hash: str):
+    """Called once the corpus is rewritten with this chapter's current content"""
+    get_cache('corpus_checks').delete(f"{chapter_name}:{content_hash}")
+
 def extract_pdf_text(pdf_url: str) -> str:
     loader = ChapterLoader()
     return loader.extract_pdf_text(pdf_url)
 
 def build_ai_context(chapter_name: str) -> Dict:
+    # The memory-mapped corpus is shared by all workers; fall back to the cache, then the database
+    mapped = corpus_context(chapter_name)
+    if mapped is not None and _corpus_current(chapter_name, mapped):
+        return mapped
+    cached = get_cache('chapter_context', CHAPTER_CONTEXT_TTL).get(chapter_name)
+    if cached is not None:
+        return cached
     loader = ChapterLoader()
     return loader.build_ai_context(chapter_name)
 
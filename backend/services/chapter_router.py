@@ -0,0 +1,223 @@
+import os
+import re
+import math
+import time
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.vector_index import STOP_WORDS
+
+ROUTE_MIN_SCORE = float(os.getenv('ROUTE_MIN_SCORE', '1.0'))
+ROUTE_RELATIVE_CUTOFF = float(os.getenv('ROUTE_RELATIVE_CUTOFF', '0.75'))
+ROUTER_REFRESH_SECONDS = float(os.getenv('ROUTER_REFRESH_SECONDS', '3600'))
+ROUTER_WAIT_SECONDS = float(os.getenv('ROUTER_WAIT_SECONDS', '10'))  # how long a request waits for the first build
+ROUTER_RETRY_SECONDS = 60.0
+
+# Core O Level Chemistry vocabulary; syllabus phrases are added per chapter
+CHEMISTRY_TERMS = [
+    "atom", "proton", "neutron", "electron", "isotope", "ion", "cation", "anion", "ionic bond", "covalent bond",
+    "metallic bond", "giant structure", "simple molecular", "electronic configuration", "relative atomic mass",
+    "relative molecular mass", "mole", "avogadro constant", "molar mass", "molar gas volume", "limiting reactant",
+    "limiting reagent", "excess reagent", "percentage yield", "percentage purity", "percentage composition",
+    "empirical formula", "molecular formula", "concentration", "titration", "stoichiometry", "balanced equation",
+    "ionic equation", "state symbol", "electrolysis", "electrolyte", "electrode", "anode", "cathode", "brine",
+    "electroplating", "fuel cell", "exothermic", "endothermic", "enthalpy change", "activation energy",
+    "bond energy", "rate of reaction", "catalyst", "enzyme", "collision theory", "reversible reaction",
+    "equilibrium", "haber process", "contact process", "oxidation", "reduction", "redox", "oxidising agent",
+    "reducing agent", "oxidation number", "acid", "base", "alkali", "neutralisation", "indicator", "ph",
+    "salt", "precipitate", "titre", "amphoteric oxide", "acidic oxide", "basic oxide", "periodic table",
+    "group", "period", "alkali metal", "halogen", "noble gas", "transition element", "reactivity series",
+    "displacement", "corrosion", "rusting", "galvanising", "alloy", "blast furnace", "extraction of metals",
+    "air", "pollution", "carbon dioxide", "global warming", "greenhouse gas", "acid rain", "water treatment",
+    "fertiliser", "ammonia", "nitrogen", "sulfur dioxide", "organic chemistry", "homologous series",
+    "functional group", "alkane", "alkene", "alcohol", "carboxylic acid", "ester", "polymer", "addition polymerisation",
+    "condensation polymerisation", "cracking", "fractional distillation", "crude oil", "fuel", "combustion",
+    "isomer", "chromatography", "rf value", "filtration", "crystallisation", "distillation", "diffusion",
+    "kinetic particle theory", "states of matter", "melting point", "boiling point", "qualitative analysis",
+    "flame test", "gas test", "chemical test"
+]
+
+
+def normalize(text: str) -> str:
+    """Lowercase, keep word characters, fold simple plurals, pad with spaces for word-boundary matching"""
+    words = []
+    for word in re.findall(r'[a-z0-9]+', (text or '').lower()):
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return f" {' '.join(words)} "
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every dictionary term it contains"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        self.patterns: List[str] = []
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find(self, text: str) -> List[int]:
+        """Pattern ids of every occurrence, in order of their end position"""
+        state, found = 0, []
+        goto, fail, output = self.goto, self.fail, self.output
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.extend(output[state])
+        return found
+
+
+def _syllabus_terms(syllabus: str) -> List[str]:
+    """Content words and two-word phrases from a syllabus"""
+    words = [w for w in normalize(syllabus).split() if w not in STOP_WORDS and len(w) > 3 and not w.isdigit()]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class ChapterRouter:
+    """
+    Cross-chapter term index. Every dictionary term carries a TF-IDF weight
+    per chapter, computed by running the same automaton over each chapter's
+    syllabus and past paper; a question is scored against all chapters in a
+    single pass over its text.
+    """
+
+    def __init__(self, contexts: List[Dict]):
+        terms = {normalize(term).strip() for term in CHEMISTRY_TERMS}
+        for context in contexts:
+            terms.update(_syllabus_terms(context.get('syllabus', '')))
+        terms.discard('')
+        self.matcher = AhoCorasick(f" {term} " for term in sorted(terms))
+        self.chapters = [context['chapter'] for context in contexts]
+
+        counts: List[Dict[int, int]] = []
+        for context in contexts:
+            text = normalize(f"{context.get('syllabus', '')} {context.get('past_paper_text', '')}")
+            chapter_counts: Dict[int, int] = {}
+            for term_id in self.matcher.find(text):
+                chapter_counts[term_id] = chapter_counts.get(term_id, 0) + 1
+            counts.append(chapter_counts)
+
+        n = len(contexts)
+        df: Dict[int, int] = {}
+        for chapter_counts in counts:
+            for term_id in chapter_counts:
+                df[term_id] = df.get(term_id, 0) + 1
+        # term id -> [(chapter index, weight)]; terms found in every chapter carry little signal
+        self.postings: Dict[int, List[Tuple[int, float]]] = {}
+        for chapter_idx, chapter_counts in enumerate(counts):
+            for term_id, tf in chapter_counts.items():
+                weight = (1 + math.log(tf)) * math.log(1 + n / df[term_id])
+                self.postings.setdefault(term_id, []).append((chapter_idx, weight))
+
+    def route(self, question: str, limit: int = 3) -> List[Dict]:
+        """Best chapters for a question, with their scores and the terms that matched"""
+        scores = [0.0] * len(self.chapters)
+        matched: Dict[int, List[str]] = {}
+        for term_id in set(self.matcher.find(normalize(question))):
+            for chapter_idx, weight in self.postings.get(term_id, ()):
+                scores[chapter_idx] += weight
+                matched.setdefault(chapter_idx, []).append(self.matcher.patterns[term_id].strip())
+
+        ranked = sorted((idx for idx, score in enumerate(scores) if score >= ROUTE_MIN_SCORE), key=lambda i: -scores[i])
+        if not ranked:
+            return []
+        best = scores[ranked[0]]
+        return [
+            {"chapter": self.chapters[idx], "score": round(scores[idx], 4), "terms": sorted(matched[idx])}
+            for idx in ranked[:limit]
+            if scores[idx] >= best * ROUTE_RELATIVE_CUTOFF
+        ]
+
+
+def build_chapter_router() -> ChapterRouter:
+    """Router over every chapter that currently has content"""
+    from services.chapter_loader import ChapterLoader
+    loader = ChapterLoader()
+    contexts = []
+    for chapter in loader.list_chapters():
+        context = loader.build_ai_context(chapter)
+        if "error" not in context:
+            contexts.append(context)
+    return ChapterRouter(contexts)
+
+
+_router: Optional[ChapterRouter] = None
+_router_ready = threading.Event()
+_builder: Optional[threading.Thread] = None
+_builder_pid = None
+_builder_lock = threading.Lock()
+
+
+def _refresh_router():
+    global _router
+    while True:
+        try:
+            router = build_chapter_router()
+            # One reference assignment: requests see the old router or the new one, never a partial build
+            _router = router
+            _router_ready.set()
+            delay = ROUTER_REFRESH_SECONDS
+        except Exception as e:
+            print(f"Error building chapter router: {e}")
+            delay = ROUTER_RETRY_SECONDS
+        time.sleep(delay)
+
+
+def start_router_refresh():
+    """Build the router on a background thread of this process, and rebuild it every ROUTER_REFRESH_SECONDS"""
+    global _builder, _builder_pid
+    with _builder_lock:
+        # Per process, so a router started before a gunicorn --preload fork keeps refreshing in the workers
+        if _builder_pid == os.getpid() and _builder and _builder.is_alive():
+            return
+        _builder_pid = os.getpid()
+        _builder = threading.Thread(target=_refresh_router, name='chapter-router', daemon=True)
+        _builder.start()
+
+
+def get_chapter_router(wait: float = ROUTER_WAIT_SECONDS) -> Optional[ChapterRouter]:
+    """
+    Current process-wide router. Requests never build it; before the first
+    build finishes they wait up to `wait` seconds and may get None.
+    """
+    start_router_refresh()
+    if _router is None:
+        _router_ready.wait(wait)
+    return _router
+
+
+def route_question(question: str, limit: int = 3) -> List[Dict]:
+    router = get_chapter_router()
+    return router.route(question, limit) if router else []
@@ -0,0 +1,353 @@
+import os
+import json
+import uuid
+import atexit
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from services.supabase_service import SupabaseService
+from services.local_store import DEFAULT_CACHE_DIR
+
+
+COHORT_INSERT_CHUNK = int(os.getenv('COHORT_INSERT_CHUNK', '100'))
+
+
+# test_data marker for rows provisioned before the student opens them (cohorts, prefetch).
+# The client's timer counts from created_at, so it restarts when the row is first opened.
+UNOPENED = 'unopened'
+
+
+def is_unopened(diagnostic: Optional[Dict]) -> bool:
+    return bool(diagnostic and (diagnostic.get('test_data') or {}).get(UNOPENED))
+
+
+def is_adaptive(diagnostic: Optional[Dict]) -> bool:
+    """The placeholder row an adaptive attempt's result points at; it holds no fixed-form test"""
+    return bool(diagnostic and (diagnostic.get('test_data') or {}).get('mode') == 'adaptive')
+
+
+def _is_unique_violation(error: Exception) -> bool:
+    return getattr(error, 'code', None) == '23505' or 'duplicate key' in str(error)
+
+
+def _is_row_error(error: Exception) -> bool:
+    """Postgres rejected the data itself (data exception, constraint, undefined column), not the connection"""
+    return str(getattr(error, 'code', None) or '')[:2] in ('22', '23', '42')
+
+
+class WriteBehindBuffer:
+    """
+    Buffers loss-tolerant inserts and writes them in batches once a table reaches
+    max_batch rows or flush_interval seconds pass. Rows carry client-generated
+    ids and are upserted, so a batch retried after a lost response stays
+    idempotent. Rows that still cannot be written at shutdown are spilled
+    to a local file and replayed on the next start.
+
+    When the database rejects a batch's data, its rows are retried one at a
+    time so one bad row does not hold back the rest; a row rejected
+    max_attempts times goes to a dead-letter file instead of the queue.
+    Connection failures are not counted against rows.
+    """
+
+    def __init__(self, client, max_batch: int = 50, flush_interval: float = 1.0,
+                 spill_path: Optional[str] = None, max_attempts: int = 3,
+                 dead_letter_path: Optional[str] = None):
+        self.client = client
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.spill_path = spill_path or os.path.join(DEFAULT_CACHE_DIR, 'write_behind_spill.jsonl')
+        self.dead_letter_path = dead_letter_path or os.path.join(DEFAULT_CACHE_DIR, 'write_behind_dead_letter.jsonl')
+        self._attempts: Dict[str, int] = {}
+        self._rows: Dict[str, List[Dict]] = {}
+        self._inflight: Dict[str, List[Dict]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._owner_pid = None
+        self.stats = {"enqueued": 0, "flushed": 0, "batches": 0, "errors": 0, "spilled": 0, "dead_lettered": 0}
+        self._replay_spill()
+
+    def _ensure_thread(self):
+        # Started lazily and per process so the buffer survives gunicorn --preload forks
+        if self._owner_pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._owner_pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def enqueue(self, table: str, row: Dict) -> str:
+        row.setdefault('id', str(uuid.uuid4()))
+        with self._lock:
+            self._rows.setdefault(table, []).append(row)
+            self.stats["enqueued"] += 1
+            full = len(self._rows[table]) >= self.max_batch
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+        return row['id']
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batches, self._rows = self._rows, {}
+                self._inflight = batches
+
+            written = 0
+            for table, rows in batches.items():
+                retry: List[Dict] = []
+                for start in range(0, len(rows), self.max_batch):
+                    chunk = rows[start:start + self.max_batch]
+                    try:
+                        self.client.table(table).upsert(chunk).execute()
+                        written += len(chunk)
+                        self.stats["batches"] += 1
+                    except Exception as e:
+                        print(f"Write-behind flush to {table} failed: {str(e)}")
+                        self.stats["errors"] += 1
+                        if _is_row_error(e):
+                            single, retry_rows = self._write_singly(table, chunk)
+                            written += single
+                            retry += retry_rows
+                        else:
+                            retry += chunk
+                kept = {id(row) for row in retry}
+                for row in rows:
+                    if id(row) not in kept:
+                        self._attempts.pop(row['id'], None)
+                if retry:
+                    with self._lock:
+                        self._rows[table] = retry + self._rows.get(table, [])
+            with self._lock:
+                self._inflight = {}
+            self.stats["flushed"] += written
+            return written
+
+    def _write_singly(self, table: str, chunk: List[Dict]):
+        """(rows written, rows to retry) after the database rejected a batch"""
+        written, retry = 0, []
+        for position, row in enumerate(chunk):
+            try:
+                self.client.table(table).upsert(row).execute()
+                written += 1
+            except Exception as e:
+                if not _is_row_error(e):
+                    # The connection went away; keep this and the untried rows for the next flush
+                    return written, retry + chunk[position:]
+                attempts = self._attempts.get(row['id'], 0) + 1
+                if attempts >= self.max_attempts:
+                    self._dead_letter(table, row, e, attempts)
+                else:
+                    self._attempts[row['id']] = attempts
+                    retry.append(row)
+        return written, retry
+
+    def _dead_letter(self, table: str, row: Dict, error: Exception, attempts: int):
+        self._attempts.pop(row['id'], None)
+        self.stats["dead_lettered"] += 1
+        print(f"Write-behind gave up on {table} row {row['id']} after {attempts} attempts: {error}")
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as dead_letter:
+                dead_letter.write(json.dumps({"table": table, "row": row, "error": str(error), "attempts": attempts}) + "\n")
+        except OSError as e:
+            print(f"Error writing write-behind dead letter: {e}")
+
+    def close(self):
+        """Final flush; anything still unwritten is spilled to disk"""
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+        with self._lock:
+            leftovers, self._rows = self._rows, {}
+        if any(leftovers.values()):
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as spill:
+                for table, rows in leftovers.items():
+                    for row in rows:
+                        spill.write(json.dumps({"table": table, "row": row}) + "\n")
+                        self.stats["spilled"] += 1
+            print(f"Write-behind spilled {self.stats['spilled']} rows to {self.spill_path}")
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+        try:
+            # Rename first so concurrent workers do not replay the same rows twice
+            os.replace(self.spill_path, replay_path)
+        except OSError:
+            return
+        with open(replay_path, encoding='utf-8') as spill:
+            for line in spill:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._rows.setdefault(entry["table"], []).append(entry["row"])
+        os.remove(replay_path)
+        self._ensure_thread()
+
+
+class DataAccessLayer:
+    """Round-trip-aware writes and reads layered over SupabaseService"""
+
+    def __init__(self, service: SupabaseService, buffer: Optional[WriteBehindBuffer] = None):
+        self.service = service
+        self.client = service.supabase
+        if buffer is None and os.getenv('WRITE_BEHIND_ENABLED', 'true').lower() == 'true':
+            buffer = WriteBehindBuffer(
+                self.client,
+                max_batch=int(os.getenv('WRITE_BEHIND_MAX_BATCH', '50')),
+                flush_interval=float(os.getenv('WRITE_BEHIND_FLUSH_SECONDS', '1.0')),
+                max_attempts=int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '3'))
+            )
+        self.buffer = buffer
+        if buffer is not None:
+            atexit.register(buffer.close)
+
+    def _insert_returning(self, table: str, data: Dict) -> Optional[Dict]:
+        response = self.client.table(table).insert(data, returning='representation').execute()
+        return response.data[0] if response.data else None
+
+    def create_diagnostic(self, user_id: str, chapter: str, diagnostic: Dict) -> Optional[Dict]:
+        """
+        Insert a diagnostic and return the stored row (id, created_at) in one round trip.
+        If another host already saved one for this (user_id, chapter), the unique
+        index rejects the insert and that row is returned instead.
+        """
+        try:
+            return self._insert_returning('diagnostics', {
+                'user_id': user_id,
+                'chapter': chapter,
+                'test_data': diagnostic,
+                'created_at': datetime.utcnow().isoformat()
+            })
+        except Exception as e:
+            if not _is_unique_violation(e):
+                raise
+            return self.service.get_existing_diagnostic(user_id, chapter)
+
+    def claim_unopened_diagnostic(self, diagnostic: Dict) -> Dict:
+        """
+        Hand a provisioned diagnostic to its student on first open: drop the
+        unopened marker and restart created_at, which the client's timer
+        counts from. Returns the row as now stored.
+        """
+        test_data = {key: value for key, value in (diagnostic.get('test_data') or {}).items() if key != UNOPENED}
+        return self.replace_diagnostic_test(diagnostic, test_data)
+    
+    def replace_diagnostic_test(self, diagnostic: Dict, test_data: Dict) -> Dict:
+        """Store a new test in an existing row (same id) and restart its created_at"""
+        created_at = datetime.utcnow().isoformat()
+        self.client.table('diagnostics').update({'test_data': test_data, 'created_at': created_at})\
+            .eq('id', diagnostic['id']).execute()
+        return {**diagnostic, 'test_data': test_data, 'created_at': created_at}
+    
+    def create_cohort_diagnostics(self, user_ids: List[str], chapter: str, diagnostic: Dict,
+                                  chunk_size: int = COHORT_INSERT_CHUNK) -> Dict[str, Dict]:
+        """
+        Give every user the same diagnostic in bulk inserts of chunk_size rows.
+        The unique (user_id, chapter) index skips users who already have one,
+        including any created concurrently by /generate-diagnostic, instead of
+        failing the chunk. One read afterwards maps every user to the row they
+        will be served. New rows are unopened until each student starts the
+        test. Returns user_id -> {"diagnostic_id", "is_existing"}.
+        """
+        created_at = datetime.utcnow().isoformat()
+        test_data = {**diagnostic, UNOPENED: True}
+        rows = [{
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'chapter': chapter,
+            'test_data': test_data,
+            'created_at': created_at
+        } for user_id in user_ids]
+        for start in range(0, len(rows), chunk_size):
+            self.client.table('diagnostics')\
+                .upsert(rows[start:start + chunk_size], on_conflict='user_id,chapter', ignore_duplicates=True, returning='minimal')\
+                .execute()
+        
+        new_ids = {row['user_id']: row['id'] for row in rows}
+        stored = self.service.get_chapter_diagnostic_ids(chapter, user_ids)
+        return {
+            user_id: {"diagnostic_id": diagnostic_id, "is_existing": diagnostic_id != new_ids.get(user_id)}
+            for user_id, diagnostic_id in stored.items()
+        }
+    
+    def create_roadmap(self, user_id: str, roadmap: Dict) -> Optional[Dict]:
+        return self._insert_returning('roadmaps', {
+            'user_id': user_id,
+            'roadmap_data': roadmap,
+            'created_at': datetime.utcnow().isoformat()
+        })
+
+    def record_diagnostic_result(self, result_data: Dict) -> Optional[str]:
+        """
+        Written before the submission is acknowledged: any worker may be asked
+        next whether this chapter is already completed, and a buffered row is
+        only visible to the worker holding it.
+        """
+        row = self._insert_returning('diagnostic_results', result_data)
+        return row['id'] if row else None
+
+    def defer_insert(self, table: str, row: Dict) -> str:
+        """
+        Queue a loss-tolerant row (analytics, logs) for a batched write. Nothing
+        reads it back before the flush, and a worker killed before then loses it.
+        """
+        if self.buffer is None:
+            row.setdefault('id', str(uuid.uuid4()))
+            self.client.table(table).upsert(row).execute()
+            return row['id']
+        return self.buffer.enqueue(table, row)
+
+    def get_diagnostic_result(self, user_id: str, chapter: str) -> Optional[Dict]:
+        return self.service.get_diagnostic_result(user_id, chapter)
+
+    def get_user_diagnostic_results(self, user_id: str) -> List[Dict]:
+        return self.service.get_user_diagnostic_results(user_id)
+
+    def get_result_summaries(self, user_id: str, limit: Optional[int] = None,
+                             before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """Projected results page, newest first, after a (submitted_at, id) cursor"""
+        return self.service.get_user_result_summaries(user_id, limit, before)
+
+    def get_chapter_outcomes(self, user_id: str) -> List[Dict]:
+        return self.service.get_user_chapter_outcomes(user_id)
+
+    def get_result_detail(self, user_id: str, result_id: str) -> Optional[Dict]:
+        result = self.service.get_user_diagnostic_result_by_id(user_id, result_id)
+        return self.with_question_text([result])[0] if result else None
+
+    def with_question_text(self, rows: List[Dict]) -> List[Dict]:
+        """Copies of result rows with each graded question's text joined back from its diagnostic"""
+        ids = [row.get('diagnostic_id') for row in rows
+               if any('question' not in entry for entry in row.get('results') or [])]
+        if not ids:
+            return rows
+        tests = self.service.get_diagnostic_tests(ids)
+        joined = []
+        for row in rows:
+            questions = tests.get(row.get('diagnostic_id'))
+            if questions is not None and len(questions) == len(row.get('results') or []):
+                row = {**row, "results": [
+                    entry if 'question' in entry else {**entry, "question": question.get('question', '')}
+                    for entry, question in zip(row['results'], questions)
+                ]}
+            joined.append(row)
+        return joined
+
+    def flush(self):
+        if self.buffer is not None:
+            self.buffer.flush()
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
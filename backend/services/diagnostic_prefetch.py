@@ -0,0 +1,127 @@
+"""
+Speculative generation of the diagnostics a student is likely to open next.
+
+A dashboard load names the chapters already attempted and passed; the
+next unattempted chapters in syllabus order are queued on one low-priority
+thread per worker, so a later /generate-diagnostic finds the stored row
+instead of waiting on the model. Speculative model spend is capped per day
+for the whole host through the LLM ledger, and stops early once real
+traffic has used most of the global or the student's budget.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from services.llm_ledger import get_ledger
+
+PREFETCH_CHAPTERS = int(os.getenv('PREFETCH_CHAPTERS', '2'))  # chapters ahead per dashboard load; 0 disables
+DAILY_TOKENS = int(os.getenv('PREFETCH_DAILY_TOKENS', '500000'))  # speculative tokens per day for the host
+BUDGET_SHARE = float(os.getenv('PREFETCH_BUDGET_SHARE', '0.8'))  # stop once real spend reaches this share of a budget
+MAX_PENDING = int(os.getenv('PREFETCH_MAX_PENDING', '32'))  # queued jobs per worker; extra loads are dropped
+RECHECK_SECONDS = float(os.getenv('PREFETCH_RECHECK_SECONDS', '600'))  # skip a (user, chapter) checked this recently
+ROUTE = 'background:prefetch-diagnostic'
+CHECKED_LIMIT = 4096
+
+
+def next_chapters(available: List[str], attempted: List[str], passed: List[str], count: int) -> List[str]:
+    """
+    Unattempted chapters in syllabus order, starting after the furthest
+    chapter the student has passed and wrapping round to earlier gaps.
+    """
+    done, passed = set(attempted), set(passed)
+    positions = [idx for idx, chapter in enumerate(available) if chapter in passed]
+    start = positions[-1] + 1 if positions else 0
+    ordered = available[start:] + available[:start]
+    return [chapter for chapter in ordered if chapter not in done][:max(count, 0)]
+
+
+class DiagnosticPrefetcher:
+    """
+    Per-worker queue of speculative generations. generate(user_id, chapter)
+    does the work and returns "created", "existing" or "skipped".
+    """
+
+    def __init__(self, generate: Callable[[str, str], str], chapters: int = PREFETCH_CHAPTERS,
+                 daily_tokens: int = DAILY_TOKENS, budget_share: float = BUDGET_SHARE,
+                 max_pending: int = MAX_PENDING, recheck_seconds: float = RECHECK_SECONDS):
+        self.generate = generate
+        self.chapters = chapters
+        self.daily_tokens = daily_tokens
+        self.budget_share = budget_share
+        self.max_pending = max_pending
+        self.recheck_seconds = recheck_seconds
+        # One thread: speculative work never competes with itself for the model
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self._pending = set()
+        self._checked: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {"queued": 0, "created": 0, "existing": 0, "skipped": 0, "dropped": 0,
+                      "over_budget": 0, "errors": 0}
+
+    def schedule(self, user_id: str, available: List[str], attempted: List[str], passed: List[str]) -> List[str]:
+        """Queue the student's next chapters; returns the chapters queued by this call"""
+        if self.chapters <= 0 or not user_id:
+            return []
+        now = time.monotonic()
+        queued = []
+        with self._lock:
+            for chapter in next_chapters(available, attempted, passed, self.chapters):
+                key = (user_id, chapter)
+                if key in self._pending or now - self._checked.get(key, float('-inf')) < self.recheck_seconds:
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self.stats["dropped"] += 1
+                    continue
+                self._pending.add(key)
+                self._checked[key] = now
+                queued.append(chapter)
+            self.stats["queued"] += len(queued)
+            if len(self._checked) > CHECKED_LIMIT:
+                cutoff = now - self.recheck_seconds
+                self._checked = {key: at for key, at in self._checked.items() if at >= cutoff}
+        for chapter in queued:
+            self._executor.submit(self._run, user_id, chapter)
+        return queued
+
+    def _within_budget(self, user_id: str) -> bool:
+        ledger = get_ledger()
+        if self.daily_tokens and ledger.route_spent_today(ROUTE) >= self.daily_tokens:
+            return False
+        if ledger.global_daily_tokens and ledger.spent_today() >= ledger.global_daily_tokens * self.budget_share:
+            return False
+        if ledger.user_daily_tokens and ledger.spent_today(user_id) >= ledger.user_daily_tokens * self.budget_share:
+            return False
+        return True
+
+    def _run(self, user_id: str, chapter: str):
+        outcome = "errors"
+        try:
+            if not self._within_budget(user_id):
+                outcome = "over_budget"
+                return
+            outcome = self.generate(user_id, chapter)
+        except Exception as e:
+            print(f"Diagnostic prefetch error for {chapter}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard((user_id, chapter))
+                self.stats[outcome] = self.stats.get(outcome, 0) + 1
+
+    def summary(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            pending = len(self._pending)
+        try:
+            spent = get_ledger().route_spent_today(ROUTE)
+        except Exception:
+            spent = None
+        return {
+            "chapters_ahead": self.chapters,
+            "pending": pending,
+            "max_pending": self.max_pending,
+            "tokens_today": spent,
+            "daily_tokens": self.daily_tokens or None,
+            **stats
+        }
+
@@ -0,0 +1,242 @@
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from services.item_analysis import BUCKETS
+from services.vector_index import tokenize
+
+MIN_ITEMS = int(os.getenv('DIAGNOSTIC_MIN_ITEMS', '6'))
+REPAIR_ROUNDS = int(os.getenv('DIAGNOSTIC_REPAIR_ROUNDS', '2'))
+DUPLICATE_SIMILARITY = float(os.getenv('DIAGNOSTIC_DUPLICATE_SIMILARITY', '0.8'))
+FULL_RETRY_CAP = 10
+CHECKS = 6  # question, options, answer, bucket, marks, duplicate
+
+LETTERS = "ABCD"
+_LETTER_SET = frozenset(LETTERS)  # membership, not substring: "" and "BC" are not answers
+_ANSWER_LETTER = re.compile(r'^(?:option\s+)?\(?([A-Da-d])\)?[.):]?$')
+
+
+def normalize_item(item: Dict) -> List[str]:
+    """
+    Cheap local repairs that need no model call. Returns what was changed:
+    options given as a dict, an answer given as option text or '(b)',
+    bucket casing, and missing type or marks.
+    """
+    repairs = []
+    options = item.get("options")
+    if isinstance(options, dict) and set(options) == set(LETTERS):
+        item["options"] = [options[letter] for letter in LETTERS]
+        repairs.append("options")
+    answer = str(item.get("answer") or '').strip()
+    match = _ANSWER_LETTER.match(answer)
+    if match and match.group(1).upper() != answer:
+        item["answer"] = match.group(1).upper()
+        repairs.append("answer")
+    elif not match and isinstance(item.get("options"), list):
+        for idx, option in enumerate(item["options"][:4]):
+            if isinstance(option, str) and option.strip().lower() == answer.lower() and answer:
+                item["answer"] = LETTERS[idx]
+                repairs.append("answer")
+                break
+    bucket = str(item.get("bucket") or '').strip().capitalize()
+    if bucket in BUCKETS and bucket != item.get("bucket"):
+        item["bucket"] = bucket
+        repairs.append("bucket")
+    if "type" not in item:
+        item["type"] = "MCQ"
+    if not isinstance(item.get("marks"), int) or item["marks"] < 1:
+        item["marks"] = 1
+        repairs.append("marks")
+    return repairs
+
+
+def check_item(item: Dict, seen: List[Set[str]]) -> List[str]:
+    """Problems with one item; seen holds the token sets of the accepted items before it"""
+    issues = []
+    question = item.get("question")
+    if not isinstance(question, str) or len(question.strip()) < 10:
+        issues.append("question missing or too short")
+    options = item.get("options")
+    if not isinstance(options, list) or len(options) != 4 \
+            or not all(isinstance(option, str) and option.strip() for option in options):
+        issues.append("needs four non-empty options")
+    elif len({option.strip().lower() for option in options}) < 4:
+        issues.append("options repeat")
+    elif all(option.strip().upper() in _LETTER_SET for option in options):
+        issues.append("options are placeholders")
+    answer = item.get("answer")
+    if not isinstance(answer, str) or answer not in _LETTER_SET:
+        issues.append("answer is not one of A-D")
+    if item.get("bucket") not in BUCKETS:
+        issues.append("unknown bucket")
+    if not isinstance(item.get("marks"), int) or item["marks"] < 1:
+        issues.append("invalid marks")
+    tokens = set(tokenize(question)) if isinstance(question, str) else set()
+    for other in seen:
+        if tokens and other and len(tokens & other) / len(tokens | other) >= DUPLICATE_SIMILARITY:
+            issues.append("duplicates an earlier question")
+            break
+    return issues
+
+
+def validate_diagnostic(items: List[Dict]) -> Dict:
+    """Score every item (share of checks passed) and list failing items and uncovered buckets"""
+    scored, failing, seen = [], [], []
+    covered = set()
+    for idx, item in enumerate(items):
+        issues = check_item(item, seen)
+        scored.append({"index": idx, "score": round(1 - len(issues) / CHECKS, 2), "issues": issues})
+        if issues:
+            failing.append(idx)
+        else:
+            seen.append(set(tokenize(item["question"])))
+            covered.add(item["bucket"])
+    return {
+        "items": scored,
+        "failing": failing,
+        "missing_buckets": [bucket for bucket in BUCKETS if bucket not in covered],
+        "shortfall": max(0, MIN_ITEMS - (len(items) - len(failing)))
+    }
+
+
+def plan_replacements(items: List[Dict], report: Dict) -> List[Tuple[Optional[int], str]]:
+    """
+    (slot, bucket) pairs to ask the model for: failing items keep their
+    bucket where it is valid, uncovered buckets come next, then extra items
+    for the least represented buckets until the test reaches MIN_ITEMS.
+    """
+    missing = list(report["missing_buckets"])
+    wanted: List[Tuple[Optional[int], str]] = []
+    for idx in report["failing"]:
+        bucket = items[idx].get("bucket")
+        if bucket in missing:
+            missing.remove(bucket)
+        elif bucket not in BUCKETS:
+            bucket = missing.pop(0) if missing else None
+        wanted.append((idx, bucket))
+    wanted.extend((None, bucket) for bucket in missing)
+
+    counts = {bucket: 0 for bucket in BUCKETS}
+    for idx, item in enumerate(items):
+        if idx not in report["failing"]:
+            counts[item["bucket"]] += 1
+    for _, bucket in wanted:
+        if bucket:
+            counts[bucket] += 1
+    while len(items) - len(report["failing"]) + len(wanted) < MIN_ITEMS:
+        bucket = min(BUCKETS, key=lambda b: counts[b])
+        counts[bucket] += 1
+        wanted.append((None, bucket))
+    return [(slot, bucket or min(BUCKETS, key=lambda b: counts[b])) for slot, bucket in wanted]
+
+
+def merge_replacements(items: List[Dict], wanted: List[Tuple[Optional[int], str]], replacements: List[Dict]) -> int:
+    """
+    Put valid replacements into the failing slots (same bucket first) and
+    append the rest. Slots nobody could fill keep their failing item for the
+    next round. Returns the number of items merged.
+    """
+    failing_slots = {slot for slot, _ in wanted if slot is not None}
+    seen = [set(tokenize(item["question"])) for idx, item in enumerate(items) if idx not in failing_slots]
+    pool = []
+    for replacement in replacements:
+        if isinstance(replacement, dict):
+            normalize_item(replacement)
+            pool.append(replacement)
+
+    merged = 0
+    for slot, bucket in sorted(wanted, key=lambda pair: pair[0] is None):
+        usable = [r for r in pool if not check_item(r, seen)]
+        if not usable:
+            break
+        pick = next((r for r in usable if r["bucket"] == bucket), usable[0])
+        pool.remove(pick)
+        seen.append(set(tokenize(pick["question"])))
+        if slot is None:
+            items.append(pick)
+        else:
+            items[slot] = pick
+        merged += 1
+    return merged
+
+
+def expected_full_retry_calls(failure_rate: float, count: int) -> float:
+    """Expected whole-test regenerations until every item passes, if items fail independently"""
+    if failure_rate <= 0:
+        return 0.0
+    clean = (1 - failure_rate) ** count
+    return min(float(FULL_RETRY_CAP), 1 / clean) if clean > 0 else float(FULL_RETRY_CAP)
+
+
+_totals = {"diagnostics": 0, "repaired": 0, "llm_calls": 0, "full_retry_calls_estimate": 0.0, "llm_calls_saved": 0.0}
+_totals_lock = threading.Lock()
+
+
+def repair_diagnostic(items: List[Dict],
+                      regenerate: Callable[[List[str], List[str]], List[Dict]],
+                      rounds: int = REPAIR_ROUNDS) -> Tuple[List[Dict], Dict]:
+    """
+    Validate a generated test, fix what can be fixed locally, and ask the
+    model (regenerate(buckets, existing_questions)) only for the failing
+    items and missing buckets. Items still failing after the last round are
+    dropped. The report compares the calls made with the expected cost of
+    regenerating the whole test until it passes.
+    """
+    items = [item for item in items if isinstance(item, dict)]
+    checked = len(items)
+    locally = sum(1 for item in items if normalize_item(item))
+    report = validate_diagnostic(items)
+    initial_failures = len(report["failing"])
+    needs_model = bool(report["failing"] or report["missing_buckets"] or report["shortfall"])
+
+    calls = requested = merged = 0
+    for _ in range(rounds if needs_model else 0):
+        wanted = plan_replacements(items, report)
+        if not wanted:
+            break
+        keep = [items[idx]["question"] for idx in range(len(items)) if idx not in report["failing"]]
+        calls += 1
+        requested += len(wanted)
+        try:
+            replacements = regenerate([bucket for _, bucket in wanted], keep)
+        except Exception as e:
+            print(f"Error regenerating diagnostic items: {e}")
+            break
+        merged += merge_replacements(items, wanted, replacements)
+        report = validate_diagnostic(items)
+        if not (report["failing"] or report["missing_buckets"] or report["shortfall"]):
+            break
+
+    dropped = [items[idx] for idx in report["failing"]]
+    items = [item for idx, item in enumerate(items) if idx not in report["failing"]]
+    failure_rate = initial_failures / checked if checked else 0.0
+    if not needs_model:
+        full_retry = 0.0
+    else:
+        # Missing buckets or too few items cannot be fixed without a call either way
+        full_retry = max(1.0, expected_full_retry_calls(failure_rate, max(checked, MIN_ITEMS)))
+    summary = {
+        "items_checked": checked,
+        "repaired_locally": locally,
+        "failed_checks": initial_failures,
+        "items_requested": requested,
+        "items_regenerated": merged,
+        "items_dropped": len(dropped),
+        "llm_calls": calls,
+        "full_retry_calls_estimate": round(full_retry, 2),
+        "llm_calls_saved": round(max(0.0, full_retry - calls), 2),
+        "valid": not (report["missing_buckets"] or report["shortfall"])
+    }
+    with _totals_lock:
+        _totals["diagnostics"] += 1
+        _totals["repaired"] += 1 if (locally or needs_model) else 0
+        _totals["llm_calls"] += calls
+        _totals["full_retry_calls_estimate"] += summary["full_retry_calls_estimate"]
+        _totals["llm_calls_saved"] += summary["llm_calls_saved"]
+    return items, summary
+
+
+def validation_stats() -> Dict:
+    """Totals for this process since start"""
+    with _totals_lock:
+        return {key: round(value, 2) if isinstance(value, float) else value for key, value in _totals.items()}
@@ -1,19 +1,41 @@
 import os
+import copy
 import json
-import google.generativeai as genai
-from typing import Dict, List, Any
+import random
+from typing import Dict, List, Any, Optional
 from services.chapter_loader import build_ai_context
+from services.llm_gateway import get_gateway
+from services.llm_ledger import BudgetExceeded
+from services.item_store import draw_mcq_items, items_to_diagnostic
+from services.roadmap_inputs import onboarding_inputs, diagnostic_summary
+from services.cache import get_cache
+from services.diagnostic_validation import repair_diagnostic
+from utils.item_keys import item_key, form_key
+
+DIAGNOSTIC_ITEM_COUNT = 8
+DIAGNOSTIC_BANK_SIZE = int(os.getenv('DIAGNOSTIC_BANK_SIZE', '5'))
+
+
+def _diagnostic_form(diagnostic: Dict[str, Any]) -> str:
+    return form_key([item_key(item) for item in diagnostic.get('diagnostic_test') or []])
+
+
+def _seen_forms(user_id: Optional[str], bank_key: str) -> set:
+    """Forms of this chapter version already served to the student"""
+    if not user_id:
+        return set()
+    return set(get_cache('diagnostic_forms_seen').get(f"{user_id}:{bank_key}") or [])
+
+
+def _mark_seen(user_id: Optional[str], bank_key: str, diagnostic: Dict[str, Any]):
+    if user_id:
+        get_cache('diagnostic_forms_seen').extend(f"{user_id}:{bank_key}", [_diagnostic_form(diagnostic)])
 
 class GeminiService:
     def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('models/gemini-2.5-flash-lite')
+        self.gateway = get_gateway()
     
-    def _safe_generate_content(self, prompt: str, fallback_prompt: str = None) -> str:
+    def _safe_generate_content(self, prompt: str, fallback_prompt: str = None, task: str = 'default') -> str:
         """
         Safely generate content with fallback if prompt is empty or null.
         Ensures Gemini is NEVER called with an empty prompt.
@@ -31,14 +53,17 @@ class GeminiService:
             raise ValueError("Cannot call Gemini with empty prompt. Fallback prompt is also empty.")
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip() if response.text else ""
+            return self.gateway.generate(prompt, task)
+        except BudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error generating content: {str(e)}")
     
-    def generate_diagnostic(self, chapter: str) -> Dict[str, Any]:
+    def generate_diagnostic(self, chapter: str, use_bank: bool = True, user_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        Generate diagnostic test for a chapter using Gemini API
+        Generate diagnostic test for a chapter using Gemini API.
+        Once the chapter's bank holds DIAGNOSTIC_BANK_SIZE generated tests, one is drawn from it instead,
+        skipping forms already served to user_id; a student who has seen them all gets a new test.
         """
         # Load chapter data from database
         chapter_data = build_ai_context(chapter)
@@ -54,6 +79,23 @@ class GeminiService:
         if not syllabus and not past_paper_text and not answer_key_text:
             return {"error": "NO_DATA_AVAILABLE"}
         
+        # Serve real exam items at zero LLM cost when the item store has enough
+        if os.getenv('DIAGNOSTIC_ITEM_SOURCE', 'generated') == 'past_paper':
+            items = draw_mcq_items(chapter, DIAGNOSTIC_ITEM_COUNT)
+            if items:
+                return items_to_diagnostic(chapter, items)
+        
+        cache = get_cache('diagnostic_bank')
+        bank_key = chapter_data['content_hash']
+        seen = _seen_forms(user_id, bank_key)
+        if use_bank and DIAGNOSTIC_BANK_SIZE:
+            bank = cache.get(bank_key) or []
+            unseen = [form for form in bank if _diagnostic_form(form) not in seen]
+            if len(bank) >= DIAGNOSTIC_BANK_SIZE and unseen:
+                diagnostic = copy.deepcopy(random.choice(unseen))
+                _mark_seen(user_id, bank_key, diagnostic)
+                return diagnostic
+        
         prompt = f"""You are an expert Cambridge O Level Chemistry examiner.
 
 Chapter: {chapter}
@@ -87,7 +129,7 @@ Expected Output format:
       "bucket": "Basic",
       "question": "Question text here?",
       "type": "MCQ",
-      "options": ["A", "B", "C", "D"],
+      "options": ["First option text", "Second option text", "Third option text", "Fourth option text"],
       "answer": "B",
       "marks": 1
     }}
@@ -100,7 +142,7 @@ Generate diagnostic test for {chapter} chapter. Return JSON only, no explanation
         fallback_prompt = f"Run a basic diagnostic explanation for {chapter}."
 
         try:
-            response_text = self._safe_generate_content(prompt, fallback_prompt)
+            response_text = self._safe_generate_content(prompt, fallback_prompt, task='diagnostic')
             
             # Clean response text (remove markdown code blocks if present)
             if response_text.startswith("```json"):
@@ -121,50 +163,111 @@ Generate diagnostic test for {chapter} chapter. Return JSON only, no explanation
             if "diagnostic_test" not in diagnostic:
                 return {"error": "Invalid response format from AI"}
             
-            # Ensure all questions have required fields
-            for question in diagnostic.get("diagnostic_test", []):
-                if "options" not in question:
-                    question["options"] = ["A", "B", "C", "D"]
-                if "type" not in question:
-                    question["type"] = "MCQ"
-                if "marks" not in question:
-                    question["marks"] = 1
+            # Fix what can be fixed locally; ask the model again only for failing items or missing buckets
+            sources = (syllabus, past_paper_text, answer_key_text)
+            items, validation = repair_diagnostic(
+                diagnostic.get("diagnostic_test") or [],
+                lambda buckets, keep: self._regenerate_items(chapter, sources, buckets, keep)
+            )
+            if not items:
+                return {"error": "Generated diagnostic failed validation"}
+            diagnostic["diagnostic_test"] = items
+            diagnostic["validation"] = validation
+            
+            if validation["valid"] and DIAGNOSTIC_BANK_SIZE:
+                cache.extend(bank_key, [diagnostic], max_length=DIAGNOSTIC_BANK_SIZE)
+            _mark_seen(user_id, bank_key, diagnostic)
             
             return diagnostic
             
         except json.JSONDecodeError as e:
             return {"error": f"Failed to parse AI response: {str(e)}"}
+        except BudgetExceeded as e:
+            return self._budget_diagnostic(chapter, bank_key, str(e), seen)
         except Exception as e:
             return {"error": f"AI generation failed: {str(e)}"}
     
-    def generate_roadmap(self, profile: Dict, results: List[Dict]) -> Dict[str, Any]:
+    def _budget_diagnostic(self, chapter: str, bank_key: str, reason: str, seen: set) -> Dict[str, Any]:
+        """Over the token budget: a banked test for the chapter (unseen ones first), else real past-paper items"""
+        bank = get_cache('diagnostic_bank').get(bank_key) or []
+        if bank:
+            unseen = [form for form in bank if _diagnostic_form(form) not in seen]
+            diagnostic = copy.deepcopy(random.choice(unseen or bank))
+        else:
+            items = draw_mcq_items(chapter, DIAGNOSTIC_ITEM_COUNT)
+            if not items:
+                return {"error": "LLM_BUDGET_EXCEEDED", "details": reason}
+            diagnostic = items_to_diagnostic(chapter, items)
+        diagnostic["degraded"] = "budget"
+        return diagnostic
+    
+    def _regenerate_items(self, chapter: str, sources: tuple, buckets: List[str], keep: List[str]) -> List[Dict]:
+        """Replacement MCQs for the given buckets, one per entry, different from the questions kept"""
+        syllabus, past_paper_text, answer_key_text = sources
+        existing = "\n".join(f"- {question}" for question in keep) or "- (none)"
+        prompt = f"""You are an expert Cambridge O Level Chemistry examiner.
+
+Chapter: {chapter}
+
+SYLLABUS CONTENT:
+{syllabus}
+
+PAST PAPER QUESTIONS:
+{past_paper_text}
+
+ANSWER KEY:
+{answer_key_text}
+
+Some questions of a diagnostic test for "{chapter}" were rejected. Write replacements only:
+- Exactly {len(buckets)} MCQs, with these buckets in this order: {", ".join(buckets)}
+- Four distinct option texts each; "answer" is the letter (A-D) of the correct option
+- Use ONLY the content provided above
+- Do NOT repeat or rephrase these questions already in the test:
+{existing}
+
+Expected Output format:
+{{
+  "chapter": "{chapter}",
+  "diagnostic_test": [
+    {{
+      "bucket": "Basic",
+      "question": "Question text here?",
+      "type": "MCQ",
+      "options": ["First option text", "Second option text", "Third option text", "Fourth option text"],
+      "answer": "B",
+      "marks": 1
+    }}
+  ]
+}}
+
+Return JSON only, no explanations."""
+        response_text = self._safe_generate_content(prompt, task='diagnostic').strip()
+        if response_text.startswith("```json"):
+            response_text = response_text[7:]
+        if response_text.startswith("```"):
+            response_text = response_text[3:]
+        if response_text.endswith("```"):
+            response_text = response_text[:-3]
+        return json.loads(response_text.strip()).get("diagnostic_test") or []
+    
+    def generate_roadmap(self, profile: Dict, results: List[Dict], draft: Optional[Dict] = None) -> Dict[str, Any]:
         """
-        Generate AI roadmap based on student profile and diagnostic results
+        Generate AI roadmap based on student profile and diagnostic results.
+        When a draft plan is given the model refines it instead of starting over.
         """
         # Prepare input data
-        onboarding_data = {
-            "student_type": profile.get("student_type"),
-            "confidence_level": profile.get("confidence_level"),
-            "difficult_areas": profile.get("difficult_areas", []),
-            "target_grade": profile.get("target_grade"),
-            "study_hours": profile.get("study_hours"),
-            "exam_session": profile.get("exam_session")
-        }
-        
-        diagnostic_summary = []
-        for result in results:
-            diagnostic_summary.append({
-                "chapter": result.get("chapter"),
-                "passed": result.get("passed"),
-                "percentage": result.get("percentage"),
-                "bucket_scores": result.get("bucket_scores", {})
-            })
+        onboarding_data = onboarding_inputs(profile)
+        results_summary = diagnostic_summary(results)
+        draft_input = ""
+        if draft:
+            draft_plan = {key: draft.get(key) for key in ("weekly_roadmap", "estimated_completion", "focus_areas")}
+            draft_input = f"\n- Draft roadmap to refine (keep its pacing, improve topics and reasoning): {json.dumps(draft_plan)}"
         
         prompt = f"""You are an academic planner for Cambridge O Level Chemistry.
 
 Input:
 - Student onboarding: {json.dumps(onboarding_data)}
-- Diagnostic results: {json.dumps(diagnostic_summary)}
+- Diagnostic results: {json.dumps(results_summary)}{draft_input}
 
 Output:
 - Weekly roadmap
@@ -198,7 +301,7 @@ Generate roadmap. Return JSON only."""
         fallback_prompt = """Create a 4-week study plan for O-Level Chemistry. Return JSON with weekly topics and priorities."""
 
         try:
-            response_text = self._safe_generate_content(prompt, fallback_prompt)
+            response_text = self._safe_generate_content(prompt, fallback_prompt, task='roadmap')
             
             # Clean response text
             if response_text.startswith("```json"):
@@ -219,6 +322,71 @@ Generate roadmap. Return JSON only."""
             
         except json.JSONDecodeError as e:
             return {"error": f"Failed to parse roadmap: {str(e)}"}
+        except BudgetExceeded as e:
+            # The caller falls back to the rule-based planner
+            return {"error": str(e), "budget_exceeded": True}
         except Exception as e:
             return {"error": f"Roadmap generation failed: {str(e)}"}
+    
+    def revise_roadmap(self, roadmap: Dict, profile: Dict, changed_results: List[Dict], weeks: List[Dict]) -> Dict[str, Any]:
+        """
+        Ask the model to revise only the weeks affected by changed diagnostic results.
+        Returns {"updated_weeks": [...], ...} to be merged into the existing roadmap.
+        """
+        prompt = f"""You are an academic planner for Cambridge O Level Chemistry.
+
+A student's existing weekly roadmap needs a partial update because some diagnostic results changed.
+
+Input:
+- Student onboarding: {json.dumps(onboarding_inputs(profile))}
+- Changed diagnostic results: {json.dumps(diagnostic_summary(changed_results))}
+- Weeks to revise: {json.dumps(weeks)}
+- Number of weeks in the full roadmap: {len(roadmap.get("weekly_roadmap", []))}
+
+Rules:
+- JSON only
+- No teaching
+- No explanations
+- Revise ONLY the weeks given above, keeping their week numbers
+- If a changed chapter is not covered by any week, add new weeks numbered after the last week
+- Focus on weak areas from the changed diagnostics
 
+Expected format:
+{{
+  "updated_weeks": [
+    {{
+      "week": 1,
+      "topics": ["topic1", "topic2"],
+      "priority": "high",
+      "reasoning": "brief reason"
+    }}
+  ],
+  "estimated_completion": "X weeks",
+  "focus_areas": ["area1", "area2"]
+}}
+
+Return JSON only."""
+
+        try:
+            response_text = self._safe_generate_content(prompt, task='roadmap')
+            
+            # Clean response text
+            if response_text.startswith("```json"):
+                response_text = response_text[7:]
+            if response_text.startswith("```"):
+                response_text = response_text[3:]
+            if response_text.endswith("```"):
+                response_text = response_text[:-3]
+            response_text = response_text.strip()
+            
+            revision = json.loads(response_text)
+            
+            if not isinstance(revision.get("updated_weeks"), list):
+                return {"error": "Invalid roadmap revision format from AI"}
+            
+            return revision
+            
+        except json.JSONDecodeError as e:
+            return {"error": f"Failed to parse roadmap revision: {str(e)}"}
+        except Exception as e:
+            return {"error": f"Roadmap revision failed: {str(e)}"}
@@ -0,0 +1,158 @@
+"""
+Compact grading records for fixed-form diagnostics.
+
+A diagnostic's test_data never changes once stored, so what grading needs
+is packed once per form: the answer letters as one string, bucket codes
+and marks as arrays, and each question's item key for calibration.
+Records are primed when a diagnostic is served or provisioned and kept in
+a per-worker LRU by diagnostic_id, so a submission that lands on the same
+worker is graded without reading the diagnostics row.
+"""
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from services.item_analysis import BUCKETS
+from utils.item_keys import item_key
+
+GRADING_CACHE_SIZE = int(os.getenv('GRADING_CACHE_SIZE', '4096'))  # diagnostic ids per worker
+
+
+def _pack(values: List, typecode: str):
+    """array when every value fits the typecode, otherwise a tuple"""
+    try:
+        return array(typecode, values)
+    except (TypeError, OverflowError):
+        return tuple(values)
+
+
+class GradingRecord:
+    """Answer key of one fixed-form diagnostic, indexed by question position"""
+
+    __slots__ = ('chapter', 'answers', 'bucket_names', 'buckets', 'marks', 'keys', 'bucket_totals')
+
+    def __init__(self, chapter: str, questions: List[Dict]):
+        answers = [str(question.get('answer') or '').strip().upper() for question in questions]
+        names = list(BUCKETS)
+        for question in questions:
+            if question.get('bucket', 'Basic') not in names:
+                names.append(question.get('bucket', 'Basic'))
+        codes = {name: code for code, name in enumerate(names)}
+
+        self.chapter = chapter
+        # Single letters pack into one str; indexing it returns interned one-character strings
+        self.answers = ''.join(answers) if all(len(answer) == 1 for answer in answers) else tuple(answers)
+        self.bucket_names = tuple(names)
+        self.buckets = array('B', [codes[question.get('bucket', 'Basic')] for question in questions])
+        self.marks = _pack([question.get('marks', 1) for question in questions], 'H')
+        self.keys = tuple(item_key(question) for question in questions)
+        totals = [0] * len(names)
+        for code in self.buckets:
+            totals[code] += 1
+        self.bucket_totals = tuple(totals)
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def grade(self, answers: Dict[str, str]) -> Tuple[List[Dict], Dict[str, int], Dict[str, int]]:
+        """(results, bucket_scores, bucket_totals) for one answer sheet"""
+        names = self.bucket_names
+        scores = [0] * len(names)
+        results = []
+        for idx in range(len(self.buckets)):
+            question_id = str(idx)
+            user_answer = str(answers.get(question_id) or "").strip().upper()
+            correct_answer = self.answers[idx]
+            code = self.buckets[idx]
+            is_correct = user_answer == correct_answer
+            if is_correct:
+                scores[code] += 1
+            results.append({
+                "question_id": question_id,
+                "bucket": names[code],
+                "user_answer": user_answer,
+                "correct_answer": correct_answer,
+                "is_correct": is_correct,
+                "marks": self.marks[idx]
+            })
+        bucket_scores = {name: scores[code] for code, name in enumerate(names)}
+        bucket_totals = {name: self.bucket_totals[code] for code, name in enumerate(names)}
+        return results, bucket_scores, bucket_totals
+
+
+class GradingCache:
+    """LRU of diagnostic_id -> GradingRecord; forms provisioned together share one record"""
+
+    def __init__(self, max_entries: int = GRADING_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._records: 'OrderedDict[str, GradingRecord]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, diagnostic_id: str) -> Optional[GradingRecord]:
+        with self._lock:
+            record = self._records.get(diagnostic_id)
+            if record is None:
+                self.stats["misses"] += 1
+                return None
+            self._records.move_to_end(diagnostic_id)
+            self.stats["hits"] += 1
+            return record
+
+    def put(self, diagnostic_ids: Iterable[str], record: GradingRecord):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for diagnostic_id in diagnostic_ids:
+                self._records[diagnostic_id] = record
+                self._records.move_to_end(diagnostic_id)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def prime(self, diagnostic_ids: Iterable[str], chapter: str, test_data: Dict) -> Optional[GradingRecord]:
+        """Build the record for a stored test and cache it under every id that serves it"""
+        diagnostic_ids = [diagnostic_id for diagnostic_id in diagnostic_ids if diagnostic_id]
+        if self.max_entries <= 0 or not diagnostic_ids:
+            return None
+        with self._lock:
+            if all(diagnostic_id in self._records for diagnostic_id in diagnostic_ids):
+                return self._records[diagnostic_ids[0]]
+        questions = (test_data or {}).get('diagnostic_test') or []
+        try:
+            record = GradingRecord(chapter, questions)
+        except Exception as e:
+            # Priming is an optimisation; submission falls back to reading the row
+            print(f"Error building grading record: {e}")
+            return None
+        self.put(diagnostic_ids, record)
+        return record
+
+    def summary(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            distinct = {id(record): record for record in self._records.values()}
+            entries = len(self._records)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "entries": entries,
+            "records": len(distinct),
+            "max_entries": self.max_entries,
+            "questions": sum(len(record) for record in distinct.values()),
+            **stats,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None
+        }
+
+
+_cache: Optional[GradingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_grading_cache() -> GradingCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GradingCache()
+    return _cache
@@ -0,0 +1,342 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from services.local_store import DEFAULT_CACHE_DIR, SQLiteFile
+from utils.item_keys import form_key
+
+BUCKETS = ["Basic", "Conceptual", "Application"]
+BUCKET_CODES = {bucket: code for code, bucket in enumerate(BUCKETS)}
+ITEM_FIELDS = ('bucket', 'question', 'type', 'options', 'answer', 'marks')
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS form_stats (
+        form_key TEXT PRIMARY KEY,
+        chapter TEXT NOT NULL,
+        n_items INTEGER NOT NULL,
+        n_responses INTEGER NOT NULL,
+        sum_total REAL NOT NULL,
+        sum_total_sq REAL NOT NULL,
+        buckets BLOB NOT NULL,
+        correct BLOB NOT NULL,
+        sum_total_correct BLOB NOT NULL,
+        min_p REAL,
+        min_discrimination REAL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_form_stats_chapter ON form_stats(chapter)',
+    'CREATE INDEX IF NOT EXISTS idx_form_stats_min_p ON form_stats(min_p)',
+    """CREATE TABLE IF NOT EXISTS form_diagnostics (
+        diagnostic_id TEXT PRIMARY KEY,
+        form_key TEXT NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_form_diagnostics_form ON form_diagnostics(form_key)',
+    """CREATE TABLE IF NOT EXISTS bucket_outcomes (
+        chapter TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        passes INTEGER NOT NULL,
+        PRIMARY KEY (chapter, bucket)
+    )""",
+    # Per-item aggregates across every form that used the same question,
+    # with the rest score as a proportion so forms of any length pool
+    """CREATE TABLE IF NOT EXISTS item_calibration (
+        chapter TEXT NOT NULL,
+        item_key TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        correct INTEGER NOT NULL,
+        sum_rest REAL NOT NULL,
+        sum_rest_sq REAL NOT NULL,
+        sum_rest_correct REAL NOT NULL,
+        PRIMARY KEY (chapter, item_key)
+    )""",
+]
+
+
+class ItemAnalysis:
+    """
+    Incrementally maintained psychometrics per form.
+
+    A form is identified by its ordered item keys, not by diagnostics row:
+    each row belongs to one student, while cohort copies and bank draws of
+    the same test share a form. Each form keeps fixed-size arrays indexed by question position:
+    correct counts and the sum of total scores of students who got the item
+    right, plus running N, sum and sum of squares of total scores. These are
+    sufficient statistics for difficulty (p-value) and the corrected
+    item-rest point-biserial, so no diagnostic_results rows are rescanned.
+    Aggregates live in SQLite so every gunicorn worker on the host updates
+    the same numbers.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('ITEM_ANALYSIS_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'item_analysis.sqlite3')
+        self._db = SQLiteFile(self.path, _SCHEMA, row_factory=sqlite3.Row)
+
+    def _connect(self):
+        return self._db.connect()
+
+    def record_submission(self, diagnostic_id: str, chapter: str, keys: List[str], correctness: List[bool],
+                          buckets: List[str], bucket_passed: Dict[str, bool]):
+        """Fold one graded sheet into its form's and the chapter's aggregates"""
+        x = np.asarray(correctness, dtype=np.int32)
+        if len(keys) != len(x) or len(buckets) != len(x):
+            raise ValueError(f"Sheet has {len(x)} answers for {len(keys)} items and {len(buckets)} buckets")
+        key = form_key(keys)
+        total = float(x.sum())
+        bucket_codes = np.asarray([BUCKET_CODES.get(b, 0) for b in buckets], dtype=np.int8)
+
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT * FROM form_stats WHERE form_key = ?', (key,)).fetchone()
+                if row is not None and row['n_items'] != len(x):
+                    raise ValueError(f"Form {key} has {row['n_items']} items, sheet has {len(x)}")
+                if row is None:
+                    correct = np.zeros(len(x), dtype=np.int32)
+                    sum_total_correct = np.zeros(len(x), dtype=np.float64)
+                    n, s, ss = 0, 0.0, 0.0
+                else:
+                    correct = np.frombuffer(row['correct'], dtype=np.int32).copy()
+                    sum_total_correct = np.frombuffer(row['sum_total_correct'], dtype=np.float64).copy()
+                    n, s, ss = row['n_responses'], row['sum_total'], row['sum_total_sq']
+
+                correct += x
+                sum_total_correct += x * total
+                n, s, ss = n + 1, s + total, ss + total * total
+
+                p, discrimination = _statistics(correct, sum_total_correct, n, s, ss)
+                min_p = float(p.min()) if len(p) else None
+                valid = discrimination[~np.isnan(discrimination)]
+                min_discrimination = float(valid.min()) if len(valid) else None
+
+                conn.execute(
+                    'INSERT OR REPLACE INTO form_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, chapter, len(x), n, s, ss, bucket_codes.tobytes(),
+                     correct.tobytes(), sum_total_correct.tobytes(), min_p, min_discrimination)
+                )
+                if diagnostic_id:
+                    conn.execute('INSERT OR IGNORE INTO form_diagnostics VALUES (?, ?)', (diagnostic_id, key))
+                for bucket, passed in bucket_passed.items():
+                    conn.execute("""
+                        INSERT INTO bucket_outcomes VALUES (?, ?, 1, ?)
+                        ON CONFLICT(chapter, bucket) DO UPDATE SET
+                            attempts = attempts + 1,
+                            passes = passes + excluded.passes
+                    """, (chapter, bucket, 1 if passed else 0))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def record_item_responses(self, chapter: str, keys: List[str], buckets: List[str], correctness: List[bool],
+                              load_items: Callable[[], List[Dict]]):
+        """
+        Fold one fixed-form sheet into the per-question calibration aggregates.
+        load_items() returns the questions; it is only called for the payload
+        of items that have no calibration row yet.
+        """
+        x = np.asarray(correctness, dtype=np.float64)
+        if len(x) < 2 or len(keys) != len(x):
+            return
+        rest = (x.sum() - x) / (len(x) - 1)
+        payloads = {}
+        if len(self._calibrated_keys(chapter, keys)) < len(set(keys)):
+            items = load_items() or []
+            if len(items) != len(keys):
+                return
+            payloads = {key: json.dumps({field: item.get(field) for field in ITEM_FIELDS}) for key, item in zip(keys, items)}
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Known items only take the conflict branch, so their payload is never read
+                known = self._calibrated_keys(chapter, keys, conn)
+                rows = [
+                    (chapter, key, buckets[idx], payloads.get(key, ''),
+                     int(x[idx]), float(rest[idx]), float(rest[idx] ** 2), float(rest[idx] * x[idx]))
+                    for idx, key in enumerate(keys) if key in known or key in payloads
+                ]
+                conn.executemany("""
+                    INSERT INTO item_calibration VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                    ON CONFLICT(chapter, item_key) DO UPDATE SET
+                        n = n + 1,
+                        correct = correct + excluded.correct,
+                        sum_rest = sum_rest + excluded.sum_rest,
+                        sum_rest_sq = sum_rest_sq + excluded.sum_rest_sq,
+                        sum_rest_correct = sum_rest_correct + excluded.sum_rest_correct
+                """, rows)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _calibrated_keys(self, chapter: str, keys: List[str], conn=None) -> set:
+        if conn is None:
+            with self._connect() as conn:
+                return self._calibrated_keys(chapter, keys, conn)
+        placeholders = ','.join('?' * len(keys))
+        rows = conn.execute(
+            f'SELECT item_key FROM item_calibration WHERE chapter = ? AND item_key IN ({placeholders})', (chapter, *keys)
+        ).fetchall()
+        return {row['item_key'] for row in rows}
+
+    def reset_item_calibration(self, chapter: str):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM item_calibration WHERE chapter = ?', (chapter,))
+
+    def item_calibration(self, chapter: str) -> List[Dict]:
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM item_calibration WHERE chapter = ?', (chapter,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def item_statistics(self, diagnostic_id: str) -> Optional[Dict]:
+        """Statistics of the form a diagnostic serves, pooled over every row that serves it"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT f.* FROM form_diagnostics d JOIN form_stats f ON f.form_key = d.form_key '
+                'WHERE d.diagnostic_id = ?', (diagnostic_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        correct, sum_total_correct, buckets = _arrays(row)
+        p, discrimination = _statistics(correct, sum_total_correct, row['n_responses'],
+                                        row['sum_total'], row['sum_total_sq'])
+        return {
+            "diagnostic_id": diagnostic_id,
+            "form_key": row['form_key'],
+            "chapter": row['chapter'],
+            "responses": row['n_responses'],
+            "items": [
+                {
+                    "question_id": str(idx),
+                    "bucket": BUCKETS[buckets[idx]],
+                    "p_value": round(float(p[idx]), 4),
+                    "discrimination": None if np.isnan(discrimination[idx]) else round(float(discrimination[idx]), 4)
+                }
+                for idx in range(len(p))
+            ]
+        }
+
+    def chapter_statistics(self, chapter: str) -> Dict:
+        with self._connect() as conn:
+            rows = conn.execute('SELECT * FROM form_stats WHERE chapter = ?', (chapter,)).fetchall()
+            outcomes = conn.execute('SELECT * FROM bucket_outcomes WHERE chapter = ?', (chapter,)).fetchall()
+
+        bucket_pass_rates = {
+            row['bucket']: round(row['passes'] / row['attempts'], 4) if row['attempts'] else None
+            for row in outcomes
+        }
+        if not rows:
+            return {"chapter": chapter, "forms": 0, "responses": 0, "bucket_pass_rates": bucket_pass_rates}
+
+        correct = np.concatenate([np.frombuffer(row['correct'], dtype=np.int32) for row in rows])
+        responses = np.concatenate([np.full(row['n_items'], row['n_responses']) for row in rows])
+        buckets = np.concatenate([np.frombuffer(row['buckets'], dtype=np.int8) for row in rows])
+
+        # Response-weighted difficulty per bucket across every form in the chapter
+        bucket_p_values = {}
+        for code, bucket in enumerate(BUCKETS):
+            mask = buckets == code
+            if mask.any():
+                bucket_p_values[bucket] = round(float(correct[mask].sum() / responses[mask].sum()), 4)
+
+        return {
+            "chapter": chapter,
+            "forms": len(rows),
+            "responses": int(sum(row['n_responses'] for row in rows)),
+            "mean_p_value": round(float(correct.sum() / responses.sum()), 4),
+            "bucket_p_values": bucket_p_values,
+            "bucket_pass_rates": bucket_pass_rates
+        }
+
+    def weak_items(self, chapter: Optional[str] = None, max_p: float = 0.3,
+                   min_discrimination: float = 0.1, min_responses: int = 5, limit: int = 50) -> List[Dict]:
+        """Items that are too hard or discriminate poorly, weakest first"""
+        sql = ('SELECT f.*, (SELECT MIN(diagnostic_id) FROM form_diagnostics d WHERE d.form_key = f.form_key) '
+               'AS diagnostic_id FROM form_stats f WHERE n_responses >= ? AND (min_p <= ? OR min_discrimination <= ?)')
+        params: list = [min_responses, max_p, min_discrimination]
+        if chapter:
+            sql += ' AND chapter = ?'
+            params.append(chapter)
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return []
+
+        # Stack every candidate form's arrays and evaluate all items at once
+        n_items = np.array([row['n_items'] for row in rows])
+        correct = np.concatenate([np.frombuffer(row['correct'], dtype=np.int32) for row in rows])
+        sum_total_correct = np.concatenate([np.frombuffer(row['sum_total_correct'], dtype=np.float64) for row in rows])
+        n = np.repeat([row['n_responses'] for row in rows], n_items).astype(np.float64)
+        s = np.repeat([row['sum_total'] for row in rows], n_items)
+        ss = np.repeat([row['sum_total_sq'] for row in rows], n_items)
+        p, discrimination = _statistics(correct, sum_total_correct, n, s, ss)
+
+        weak = (p <= max_p) | (np.nan_to_num(discrimination, nan=1.0) <= min_discrimination)
+        order = np.argsort(np.where(np.isnan(discrimination), 1.0, discrimination) + p)
+        form_index = np.repeat(np.arange(len(rows)), n_items)
+        item_index = np.arange(len(correct)) - np.repeat(np.cumsum(n_items) - n_items, n_items)
+
+        flagged = []
+        for idx in order:
+            if not weak[idx]:
+                continue
+            row = rows[form_index[idx]]
+            flagged.append({
+                "form_key": row['form_key'],
+                "diagnostic_id": row['diagnostic_id'],
+                "chapter": row['chapter'],
+                "question_id": str(int(item_index[idx])),
+                "bucket": BUCKETS[np.frombuffer(row['buckets'], dtype=np.int8)[item_index[idx]]],
+                "responses": row['n_responses'],
+                "p_value": round(float(p[idx]), 4),
+                "discrimination": None if np.isnan(discrimination[idx]) else round(float(discrimination[idx]), 4)
+            })
+            if len(flagged) >= limit:
+                break
+        return flagged
+
+
+def _arrays(row: sqlite3.Row):
+    return (
+        np.frombuffer(row['correct'], dtype=np.int32),
+        np.frombuffer(row['sum_total_correct'], dtype=np.float64),
+        np.frombuffer(row['buckets'], dtype=np.int8)
+    )
+
+
+def _statistics(correct, sum_total_correct, n, s, ss):
+    """
+    Vectorized p-value and corrected point-biserial (item vs rest score).
+    For item i with score x_i and rest score r = T - x_i:
+      sum r over all       = S - c_i
+      sum r^2 over all     = SS - 2 * sum(T | x_i=1) + c_i
+      sum r over correct   = sum(T | x_i=1) - c_i
+    """
+    correct = np.asarray(correct, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = correct / n
+        rest_sum = s - correct
+        rest_sq = ss - 2 * sum_total_correct + correct
+        rest_mean = rest_sum / n
+        rest_std = np.sqrt(np.maximum(rest_sq / n - rest_mean ** 2, 0))
+        mean_rest_correct = (sum_total_correct - correct) / correct
+        discrimination = (mean_rest_correct - rest_mean) / rest_std * np.sqrt(p / (1 - p))
+    discrimination = np.where((correct > 0) & (correct < n) & (rest_std > 0), discrimination, np.nan)
+    return p, discrimination
+
+
+_analysis: Optional[ItemAnalysis] = None
+_analysis_lock = threading.Lock()
+
+
+def get_item_analysis() -> ItemAnalysis:
+    global _analysis
+    with _analysis_lock:
+        if _analysis is None:
+            _analysis = ItemAnalysis()
+        return _analysis
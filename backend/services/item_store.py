@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import hashlib
+import random
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from services.local_store import DEFAULT_CACHE_DIR, SQLiteFile
+
+
+_QUESTION_START = re.compile(r'^\s*(\d{1,2})\s+(?=\S)(.*)$')
+_PART_START = re.compile(r'^\s*\(\s*([a-z]|i{1,3}|iv|v|vi{1,3}|ix|x)\s*\)\s*(.*)$')
+_OPTION_LINE = re.compile(r'^\s*([A-D])\s+(.+)$')
+_INLINE_ROW = re.compile(r'(?:^|\s)A\s+\S.*\sB\s+\S.*\sC\s+\S.*\sD\s+\S')
+_INLINE_OPTIONS = re.compile(r'(?:^|\s)([A-D])\s+(.+?)(?=\s+[A-D]\s+|$)')
+_MARKS = re.compile(r'\[\s*(\d{1,2})\s*\]')
+_TOTAL_MARKS = re.compile(r'\[\s*Total\s*:\s*(\d{1,3})\s*\]', re.IGNORECASE)
+_NOISE_LINE = re.compile(
+    r'^\s*(©|ucles|\[?turn over|blank page|permission to reproduce|page \d+|\d{4}/\d{2}|\*\s*\d+\s*\*|\d+\s*$)',
+    re.IGNORECASE
+)
+_ROMAN_PARTS = {'i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x'}
+
+_APPLICATION_HINTS = re.compile(r'\b(calculate|mass of|volume of|how many|concentration|moles? of|\d+(\.\d+)?\s*(g|cm3|dm3|mol))\b', re.IGNORECASE)
+_CONCEPTUAL_HINTS = re.compile(r'\b(why|explain|which statement|suggest|because|best describes|what happens)\b', re.IGNORECASE)
+
+
+def _new_item(number: int, text: str) -> Dict:
+    return {
+        "question_id": str(number),
+        "number": number,
+        "stem": text,
+        "parts": [],
+        "options": {},
+        "marks": 0,
+        "answer": None
+    }
+
+
+def _append_text(target: Dict, key: str, text: str):
+    target[key] = f"{target[key]} {text}".strip() if target.get(key) else text
+
+
+def segment_past_paper(past_paper_text: str) -> List[Dict]:
+    """
+    Split past paper text into numbered questions with sub-parts, options and marks.
+    Question numbers must increase by one, which keeps numbers inside stems
+    ("2 g of magnesium...") from starting spurious questions.
+    """
+    items: List[Dict] = []
+    if not past_paper_text:
+        return items
+
+    current: Optional[Dict] = None
+    current_part: Optional[Dict] = None
+    letter_part = None
+
+    for raw_line in past_paper_text.splitlines():
+        line = raw_line.strip()
+        if not line or _NOISE_LINE.match(line):
+            continue
+
+        total = _TOTAL_MARKS.search(line)
+        if total and current:
+            current["total_marks"] = int(total.group(1))
+            line = _TOTAL_MARKS.sub('', line).strip()
+            if not line:
+                continue
+
+        question_match = _QUESTION_START.match(line)
+        expected = current["number"] + 1 if current else None
+        if question_match and (current is None or int(question_match.group(1)) == expected):
+            current = _new_item(int(question_match.group(1)), '')
+            items.append(current)
+            current_part = None
+            letter_part = None
+            line = question_match.group(2)
+            if not line:
+                continue
+
+        if current is None:
+            continue
+
+        part_match = _PART_START.match(line)
+        if part_match:
+            label = part_match.group(1)
+            if label in _ROMAN_PARTS and letter_part and not (label == 'i' and letter_part == 'h'):
+                part_id = f"({letter_part})({label})"
+            else:
+                letter_part = label
+                part_id = f"({label})"
+            current_part = {"part": part_id, "text": "", "marks": 0, "answer": None}
+            current["parts"].append(current_part)
+            line = part_match.group(2)
+            if not line:
+                continue
+
+        marks = sum(int(m) for m in _MARKS.findall(line))
+        line = _MARKS.sub('', line).strip()
+
+        inline_options = current_part is None and not current["options"] and _INLINE_ROW.search(line)
+        option_match = _OPTION_LINE.match(line) if current_part is None else None
+        if inline_options:
+            # Options laid out on one line: "A air B copper C steam D water"
+            head, options_text = line[:inline_options.start()], line[inline_options.start():]
+            if head.strip():
+                _append_text(current, "stem", head.strip())
+            for letter, option_text in _INLINE_OPTIONS.findall(options_text.strip()):
+                current["options"][letter] = option_text.strip()
+        elif option_match:
+            current["options"][option_match.group(1)] = option_match.group(2).strip()
+        elif current_part is not None:
+            _append_text(current_part, "text", line)
+            current_part["marks"] += marks
+        elif line:
+            _append_text(current, "stem", line)
+        current["marks"] += marks
+
+    for item in items:
+        if item["parts"]:
+            item["marks"] = sum(part["marks"] for part in item["parts"]) or item["marks"]
+        elif item["options"] and not item["marks"]:
+            item["marks"] = 1
+        item["marks"] = item.pop("total_marks", item["marks"])
+        item["kind"] = "mcq" if len(item["options"]) == 4 and not item["parts"] else "structured"
+
+    return items
+
+
+def join_answers(items: List[Dict], answer_key_index: Dict[str, str]) -> List[Dict]:
+    """Attach answer-key entries to items and their sub-parts"""
+    if not answer_key_index:
+        return items
+    for item in items:
+        item["answer"] = answer_key_index.get(item["question_id"])
+        for part in item["parts"]:
+            part["answer"] = answer_key_index.get(f"{item['question_id']}{part['part']}")
+    return items
+
+
+def classify_bucket(item: Dict) -> str:
+    """Heuristic Basic/Conceptual/Application bucket for a past-paper item"""
+    text = " ".join([item.get("stem", "")] + list(item.get("options", {}).values()))
+    if _APPLICATION_HINTS.search(text):
+        return "Application"
+    if _CONCEPTUAL_HINTS.search(text):
+        return "Conceptual"
+    return "Basic"
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS items (
+        chapter TEXT NOT NULL,
+        question_id TEXT NOT NULL,
+        number INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        has_answer INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        PRIMARY KEY (chapter, question_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS sources (
+        chapter TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_items_kind ON items(chapter, kind, has_answer)',
+]
+
+
+class ItemStore:
+    """SQLite-backed store of segmented past-paper items, shared by all workers on a host"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('ITEM_STORE_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'item_store.sqlite3')
+        self._db = SQLiteFile(self.path, _SCHEMA, row_factory=sqlite3.Row, transactional=True)
+
+    def _connect(self):
+        return self._db.connect()
+
+    def content_hash(self, chapter: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute('SELECT content_hash FROM sources WHERE chapter = ?', (chapter,)).fetchone()
+            return row['content_hash'] if row else None
+
+    def replace_chapter_items(self, chapter: str, items: List[Dict], content_hash: str):
+        rows = [
+            (chapter, item["question_id"], item["number"], item["kind"], classify_bucket(item),
+             1 if item.get("answer") else 0, json.dumps(item))
+            for item in items
+        ]
+        with self._connect() as conn:
+            conn.execute('DELETE FROM items WHERE chapter = ?', (chapter,))
+            conn.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (chapter, content_hash))
+
+    def get_item(self, chapter: str, question_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT payload, bucket FROM items WHERE chapter = ? AND question_id = ?',
+                (chapter, question_id)
+            ).fetchone()
+        return self._row_to_item(row) if row else None
+
+    def query(self, chapter: str, kind: Optional[str] = None, bucket: Optional[str] = None,
+              answered_only: bool = False, limit: Optional[int] = None) -> List[Dict]:
+        sql = 'SELECT payload, bucket FROM items WHERE chapter = ?'
+        params: list = [chapter]
+        if kind:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        if bucket:
+            sql += ' AND bucket = ?'
+            params.append(bucket)
+        if answered_only:
+            sql += ' AND has_answer = 1'
+        sql += ' ORDER BY number'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._connect() as conn:
+            return [self._row_to_item(row) for row in conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _row_to_item(row: sqlite3.Row) -> Dict:
+        item = json.loads(row['payload'])
+        item["bucket"] = row['bucket']
+        return item
+
+
+_store: Optional[ItemStore] = None
+_store_lock = threading.Lock()
+
+
+def get_item_store() -> ItemStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ItemStore()
+        return _store
+
+
+def ingest_past_paper(chapter: str, past_paper_text: str, answer_key_index: Dict[str, str]) -> int:
+    """Segment and store a chapter's past paper; no-op when the source text is unchanged"""
+    if not past_paper_text:
+        return 0
+    digest = hashlib.sha256(
+        (past_paper_text + json.dumps(answer_key_index or {}, sort_keys=True)).encode('utf-8')
+    ).hexdigest()
+    store = get_item_store()
+    try:
+        if store.content_hash(chapter) == digest:
+            return 0
+        items = join_answers(segment_past_paper(past_paper_text), answer_key_index)
+        store.replace_chapter_items(chapter, items, digest)
+        return len(items)
+    except sqlite3.Error as e:
+        print(f"Error ingesting past paper items for {chapter}: {e}")
+        return 0
+
+
+def draw_mcq_items(chapter: str, count: int, seed: Optional[int] = None) -> List[Dict]:
+    """Pick answered past-paper MCQs for a chapter, spread across buckets"""
+    try:
+        items = get_item_store().query(chapter, kind="mcq", answered_only=True)
+    except sqlite3.Error as e:
+        print(f"Error reading item store for {chapter}: {e}")
+        return []
+    items = [item for item in items if item.get("answer") in item.get("options", {})]
+    if len(items) < count:
+        return []
+
+    rng = random.Random(seed)
+    by_bucket: Dict[str, List[Dict]] = {}
+    for item in items:
+        by_bucket.setdefault(item["bucket"], []).append(item)
+    for bucket_items in by_bucket.values():
+        rng.shuffle(bucket_items)
+
+    # Round-robin across buckets so every bucket is represented when possible
+    picked: List[Dict] = []
+    buckets = [b for b in ("Basic", "Conceptual", "Application") if b in by_bucket]
+    while len(picked) < count:
+        for bucket in buckets:
+            if by_bucket[bucket] and len(picked) < count:
+                picked.append(by_bucket[bucket].pop())
+    picked.sort(key=lambda item: item["number"])
+    return picked
+
+
+def items_to_diagnostic(chapter: str, items: List[Dict]) -> Dict:
+    """Shape past-paper items like a generated diagnostic test"""
+    return {
+        "chapter": chapter,
+        "source": "past_paper",
+        "diagnostic_test": [
+            {
+                "bucket": item["bucket"],
+                "question": item["stem"],
+                "type": "MCQ",
+                "options": [item["options"][letter] for letter in "ABCD"],
+                "answer": item["answer"],
+                "marks": item.get("marks") or 1,
+                "past_paper_question": item["question_id"]
+            }
+            for item in items
+        ]
+    }
+
+
+def items_to_mcqs(items: List[Dict]) -> List[Dict]:
+    """Shape past-paper items like generated tutor MCQs"""
+    return [
+        {
+            "question": item["stem"],
+            "options": {letter: item["options"][letter] for letter in "ABCD"},
+            "correct_answer": item["answer"],
+            "explanation": f"Past paper question {item['question_id']} (answer from the mark scheme)",
+            "past_paper_question": item["question_id"]
+        }
+        for item in items
+    ]
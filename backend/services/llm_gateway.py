@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import hashlib
+import time
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, Optional
+from services.resilience import get_caller, CircuitOpenError, ResilientCaller
+from services.stub_model import FaultInjectingModel
+from services.llm_ledger import get_ledger, current_context, response_usage, BudgetExceeded
+
+DEFAULT_MODEL = 'models/gemini-2.5-flash-lite'
+
+
+@dataclass(frozen=True)
+class TaskRoute:
+    model: str = DEFAULT_MODEL
+    max_output_tokens: int = 2048
+    temperature: float = 0.4
+    timeout: float = 30.0
+    json_output: bool = False
+    extra_config: Dict[str, Any] = field(default_factory=dict)
+
+    def generation_config(self) -> Dict[str, Any]:
+        config = {
+            "max_output_tokens": self.max_output_tokens,
+            "temperature": self.temperature
+        }
+        if self.json_output:
+            config["response_mime_type"] = "application/json"
+        config.update(self.extra_config)
+        return config
+
+
+# Cheap, short tasks get tight output caps and deadlines; long-form teaching
+# gets the largest budget. Override per deployment with LLM_MODEL_<TASK>,
+# LLM_MAX_TOKENS_<TASK> and LLM_TIMEOUT_<TASK>.
+TASK_ROUTES: Dict[str, TaskRoute] = {
+    'default': TaskRoute(),
+    'diagnostic': TaskRoute(max_output_tokens=3072, temperature=0.3, timeout=45.0, json_output=True),
+    'roadmap': TaskRoute(max_output_tokens=2048, temperature=0.3, timeout=30.0, json_output=True),
+    'teach': TaskRoute(max_output_tokens=4096, temperature=0.5, timeout=60.0),
+    'question': TaskRoute(max_output_tokens=1024, temperature=0.2, timeout=20.0),
+    'mcq': TaskRoute(max_output_tokens=3072, temperature=0.5, timeout=45.0, json_output=True),
+}
+
+
+def _route_from_env(task: str, route: TaskRoute) -> TaskRoute:
+    suffix = task.upper()
+    model = os.getenv(f'LLM_MODEL_{suffix}') or os.getenv('LLM_MODEL_DEFAULT') or route.model
+    max_tokens = os.getenv(f'LLM_MAX_TOKENS_{suffix}')
+    timeout = os.getenv(f'LLM_TIMEOUT_{suffix}')
+    return replace(
+        route,
+        model=model,
+        max_output_tokens=int(max_tokens) if max_tokens else route.max_output_tokens,
+        timeout=float(timeout) if timeout else route.timeout
+    )
+
+
+class GeminiBackend:
+    name = 'gemini'
+
+    def __init__(self):
+        import google.generativeai as genai
+
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is required")
+
+        genai.configure(api_key=api_key)
+        self._genai = genai
+
+    def create_model(self, task: str, route: TaskRoute):
+        return self._genai.GenerativeModel(route.model, generation_config=route.generation_config())
+
+
+class StubBackend:
+    """Deterministic offline backend; returns well-formed JSON for JSON tasks, shaped by task"""
+    name = 'stub'
+
+    def __init__(self, **fault_options):
+        self.fault_options = fault_options
+
+    def create_model(self, task: str, route: TaskRoute):
+        return FaultInjectingModel(responder=self._responder(task, route), **self.fault_options)
+
+    def _responder(self, task: str, route: TaskRoute):
+        build = STUB_RESPONSES.get(task)
+
+        def respond(prompt: str) -> str:
+            if not route.json_output:
+                digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+                return f"[stub:{route.model}] Offline response {digest}."
+            return json.dumps(build(prompt) if build else {"response": "stub"})
+        return respond
+
+
+def _stub_diagnostic(prompt: str) -> Dict:
+    match = re.search(r'Chapter: (.+)', prompt)
+    chapter = match.group(1).strip() if match else "Chemistry"
+    topics = ["atoms", "moles", "bonding", "electrolysis", "equilibrium", "salts"]
+    questions = []
+    for idx, bucket in enumerate(["Basic", "Basic", "Conceptual", "Conceptual", "Application", "Application"]):
+        questions.append({
+            "bucket": bucket,
+            "question": f"{chapter} {bucket.lower()} question {idx + 1}: which statement about {topics[idx]} is correct?",
+            "type": "MCQ",
+            "options": [f"Option {letter} for question {idx + 1}" for letter in "ABCD"],
+            "answer": "ABCD"[idx % 4],
+            "marks": 1
+        })
+    return {"chapter": chapter, "diagnostic_test": questions}
+
+
+def _stub_roadmap(prompt: str) -> Dict:
+    # One shape serves full plans (weekly_roadmap) and partial revisions (updated_weeks)
+    weeks = [
+        {"week": week, "topics": [f"Topic {week}"], "priority": "high" if week == 1 else "medium",
+         "reasoning": "Offline stub plan"}
+        for week in range(1, 5)
+    ]
+    return {
+        "weekly_roadmap": weeks,
+        "updated_weeks": weeks[:1],
+        "estimated_completion": "4 weeks",
+        "focus_areas": ["Stub focus area"]
+    }
+
+
+def _stub_mcqs(prompt: str) -> Dict:
+    match = re.search(r'Generate (\d+)', prompt)
+    count = int(match.group(1)) if match else 5
+    return {
+        "mcqs": [
+            {
+                "question": f"Stub MCQ {idx + 1}?",
+                "options": {"A": "Option A", "B": "Option B", "C": "Option C", "D": "Option D"},
+                "correct_answer": "ABCD"[idx % 4],
+                "explanation": "Offline stub explanation"
+            }
+            for idx in range(count)
+        ]
+    }
+
+
+# JSON tasks in TASK_ROUTES -> the response their callers parse
+STUB_RESPONSES: Dict[str, Callable[[str], Dict]] = {
+    'diagnostic': _stub_diagnostic,
+    'roadmap': _stub_roadmap,
+    'mcq': _stub_mcqs,
+}
+
+
+def stub_fault_options() -> Dict[str, Any]:
+    """Latency and error distribution of the stub model, from LLM_STUB_* settings"""
+    return {
+        "latency": float(os.getenv('LLM_STUB_LATENCY', '0')),
+        "latency_jitter": float(os.getenv('LLM_STUB_LATENCY_JITTER', '0')),
+        "latency_sigma": float(os.getenv('LLM_STUB_LATENCY_SIGMA', '0')),
+        "error_rate": float(os.getenv('LLM_STUB_ERROR_RATE', '0')),
+        "error_code": int(os.getenv('LLM_STUB_ERROR_CODE', '503')),
+        "hang_rate": float(os.getenv('LLM_STUB_HANG_RATE', '0')),
+        "seed": int(os.getenv('LLM_STUB_SEED', '0'))
+    }
+
+
+def create_backend(name: Optional[str] = None):
+    name = (name or os.getenv('LLM_BACKEND', 'gemini')).lower()
+    if name == 'stub':
+        return StubBackend(**stub_fault_options())
+    if name == 'gemini':
+        return GeminiBackend()
+    raise ValueError(f"Unknown LLM_BACKEND '{name}'. Must be 'gemini' or 'stub'")
+
+
+class LLMGateway:
+    """Single entry point for model calls, routed per task"""
+
+    def __init__(self, backend=None, routes: Optional[Dict[str, TaskRoute]] = None,
+                 caller_for: Callable[[str], ResilientCaller] = get_caller):
+        self.backend = backend or create_backend()
+        base_routes = routes or TASK_ROUTES
+        self.routes = {task: _route_from_env(task, route) for task, route in base_routes.items()}
+        # One caller per task and model: tasks differ in latency, so hedging
+        # thresholds and breaker trips must not be shared between them
+        self.caller_for = caller_for
+        self.ledger = get_ledger()
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def route(self, task: str) -> TaskRoute:
+        return self.routes.get(task) or self.routes['default']
+
+    def _model_for(self, task: str):
+        with self._lock:
+            if task not in self._models:
+                self._models[task] = self.backend.create_model(task, self.route(task))
+            return self._models[task]
+
+    def generate(self, prompt: str, task: str = 'default') -> str:
+        """
+        Call the task's model. Every attempt the caller makes (retries and
+        hedged duplicates included) and every refusal is a row in the token
+        ledger, since each one is billed or counts against provider limits.
+        """
+        route = self.route(task)
+        context = current_context()
+        backend = getattr(self.backend, 'name', 'gemini')
+        model_name = route.model if backend == 'gemini' else f"{backend}:{route.model}"
+        try:
+            self.ledger.check_budget(context)
+        except BudgetExceeded:
+            self.ledger.record(task, model_name, 0, 0, 0.0, status='budget', context=context)
+            raise
+        model = self._model_for(task)
+        caller = self.caller_for(f"{task}:{model_name}")
+
+        def attempt(prompt: str, **kwargs):
+            # Runs on the caller's worker threads; the request's ledger context is passed in, not thread-local
+            started = time.perf_counter()
+            try:
+                response = model.generate_content(prompt, **kwargs)
+            except Exception:
+                self.ledger.record(task, model_name, 0, 0, (time.perf_counter() - started) * 1000,
+                                   status='error', context=context)
+                raise
+            text = response.text.strip() if response.text else ""
+            prompt_tokens, output_tokens, estimated = response_usage(response, prompt, text)
+            self.ledger.record(task, model_name, prompt_tokens, output_tokens, (time.perf_counter() - started) * 1000,
+                               estimated=estimated, context=context)
+            return response
+
+        # The caller's deadline bounds the whole call; no single attempt may outlast it
+        timeout = min(route.timeout, caller.deadline) if caller.deadline else route.timeout
+        try:
+            response = caller.call(attempt, prompt, timeout=timeout, request_options={"timeout": timeout})
+        except CircuitOpenError:
+            # Refused before reaching the provider: no attempt recorded it
+            self.ledger.record(task, model_name, 0, 0, 0.0, status='error', context=context)
+            raise
+        return response.text.strip() if response.text else ""
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def set_gateway(gateway: Optional[LLMGateway]):
+    """Swap the process-wide gateway (e.g. a StubBackend gateway in tests)"""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
@@ -0,0 +1,253 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from services.local_store import DEFAULT_CACHE_DIR, SQLiteFile
+
+USER_DAILY_TOKENS = int(os.getenv('LLM_BUDGET_USER_DAILY_TOKENS', '0'))  # 0 = no per-user budget
+GLOBAL_DAILY_TOKENS = int(os.getenv('LLM_BUDGET_GLOBAL_DAILY_TOKENS', '0'))  # 0 = no global budget
+# USD per million tokens; the defaults are gemini-2.5-flash-lite list prices
+PRICE_INPUT = float(os.getenv('LLM_PRICE_INPUT_PER_MTOK', '0.10'))
+PRICE_OUTPUT = float(os.getenv('LLM_PRICE_OUTPUT_PER_MTOK', '0.40'))
+
+GROUPINGS = {
+    "day": "day",
+    "route": "route",
+    "chapter": "chapter",
+    "user": "user_id",
+    "task": "task",
+    "model": "model"
+}
+GLOBAL_KEY = '*'
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of calling the model once a token budget for the day is spent"""
+
+    def __init__(self, scope: str, spent: int, limit: int):
+        super().__init__(f"LLM {scope} token budget exhausted ({spent}/{limit} tokens today)")
+        self.scope = scope
+        self.spent = spent
+        self.limit = limit
+
+
+# Who a model call is made for. Requests set it in app.py; background work sets its own.
+_context = threading.local()
+
+
+def current_context() -> Dict[str, Optional[str]]:
+    return dict(getattr(_context, 'fields', None) or {})
+
+
+def set_context(**fields):
+    _context.fields = {key: value for key, value in fields.items() if value}
+
+
+def clear_context():
+    _context.fields = {}
+
+
+@contextmanager
+def llm_context(**fields):
+    """Attribute model calls inside the block; fields not given are inherited"""
+    previous = current_context()
+    set_context(**{**previous, **fields})
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def estimate_tokens(text: str) -> int:
+    """About four characters per token for English; used when the response carries no usage"""
+    return max(1, len(text or '') // 4) if text else 0
+
+
+def response_usage(response, prompt: str, text: str):
+    """(prompt_tokens, output_tokens, estimated) from a model response"""
+    usage = getattr(response, 'usage_metadata', None)
+    prompt_tokens = getattr(usage, 'prompt_token_count', None) if usage is not None else None
+    output_tokens = getattr(usage, 'candidates_token_count', None) if usage is not None else None
+    if prompt_tokens is None or output_tokens is None:
+        return estimate_tokens(prompt), estimate_tokens(text), True
+    return int(prompt_tokens), int(output_tokens), False
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS llm_calls (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts REAL NOT NULL,
+        day TEXT NOT NULL,
+        task TEXT NOT NULL,
+        model TEXT NOT NULL,
+        route TEXT,
+        chapter TEXT,
+        user_id TEXT,
+        prompt_tokens INTEGER NOT NULL,
+        output_tokens INTEGER NOT NULL,
+        estimated INTEGER NOT NULL,
+        latency_ms REAL NOT NULL,
+        status TEXT NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_llm_calls_day ON llm_calls(day)',
+    """CREATE TABLE IF NOT EXISTS llm_daily_spend (
+        day TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        tokens INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    )""",
+]
+
+
+class LlmLedger:
+    """
+    Append-only record of every model call: task, model, route, chapter,
+    user, token counts, latency and outcome. A per-day spend table kept in
+    the same transaction makes budget checks a primary-key lookup. Shared by
+    every worker on the host through SQLite.
+    """
+
+    def __init__(self, path: Optional[str] = None, user_daily_tokens: int = USER_DAILY_TOKENS,
+                 global_daily_tokens: int = GLOBAL_DAILY_TOKENS):
+        self.path = path or os.getenv('LLM_LEDGER_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'llm_ledger.sqlite3')
+        self.user_daily_tokens = user_daily_tokens
+        self.global_daily_tokens = global_daily_tokens
+        self._db = SQLiteFile(self.path, _SCHEMA, row_factory=sqlite3.Row)
+
+    def _connect(self):
+        return self._db.connect()
+
+    def record(self, task: str, model: str, prompt_tokens: int, output_tokens: int, latency_ms: float,
+               status: str = 'ok', estimated: bool = False, context: Optional[Dict] = None):
+        context = current_context() if context is None else context
+        day = _today()
+        tokens = prompt_tokens + output_tokens
+        try:
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute(
+                    'INSERT INTO llm_calls (ts, day, task, model, route, chapter, user_id, prompt_tokens, '
+                    'output_tokens, estimated, latency_ms, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (time.time(), day, task, model, context.get('route'), context.get('chapter'), context.get('user_id'),
+                     prompt_tokens, output_tokens, int(estimated), round(latency_ms, 1), status)
+                )
+                if tokens:
+                    for user_id in filter(None, (GLOBAL_KEY, context.get('user_id'))):
+                        conn.execute(
+                            'INSERT INTO llm_daily_spend (day, user_id, tokens) VALUES (?, ?, ?) '
+                            'ON CONFLICT(day, user_id) DO UPDATE SET tokens = tokens + excluded.tokens',
+                            (day, user_id, tokens)
+                        )
+                conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            print(f"Error recording LLM call: {e}")
+
+    def spent_today(self, user_id: Optional[str] = None) -> int:
+        with self._connect() as conn:
+            row = conn.execute('SELECT tokens FROM llm_daily_spend WHERE day = ? AND user_id = ?',
+                               (_today(), user_id or GLOBAL_KEY)).fetchone()
+        return row['tokens'] if row else 0
+
+    def route_spent_today(self, route: str) -> int:
+        """Tokens spent today by calls attributed to one route, e.g. a background job"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT SUM(prompt_tokens + output_tokens) AS tokens FROM llm_calls WHERE day = ? AND route = ?',
+                               (_today(), route)).fetchone()
+        return row['tokens'] or 0
+
+    def check_budget(self, context: Optional[Dict] = None):
+        """Raise BudgetExceeded when today's global or per-user spend has reached its limit"""
+        if not (self.global_daily_tokens or self.user_daily_tokens):
+            return
+        context = current_context() if context is None else context
+        try:
+            if self.global_daily_tokens:
+                spent = self.spent_today()
+                if spent >= self.global_daily_tokens:
+                    raise BudgetExceeded('global', spent, self.global_daily_tokens)
+            user_id = context.get('user_id')
+            if self.user_daily_tokens and user_id:
+                spent = self.spent_today(user_id)
+                if spent >= self.user_daily_tokens:
+                    raise BudgetExceeded('user', spent, self.user_daily_tokens)
+        except sqlite3.Error as e:
+            # An unreadable ledger must not take the model down with it
+            print(f"Error checking LLM budget: {e}")
+
+    def rollup(self, group_by: str = 'day', since: Optional[str] = None, until: Optional[str] = None,
+               limit: int = 100, **filters) -> List[Dict]:
+        """
+        Calls, tokens, estimated cost and latency per day, route, chapter,
+        user, task or model. since/until are inclusive YYYY-MM-DD days;
+        filters narrow by any grouping column (e.g. chapter='Stoichiometry').
+        """
+        column = GROUPINGS[group_by]
+        where, params = [], []
+        if since:
+            where.append('day >= ?')
+            params.append(since)
+        if until:
+            where.append('day <= ?')
+            params.append(until)
+        for name, value in filters.items():
+            if value is not None and name in GROUPINGS:
+                where.append(f'{GROUPINGS[name]} = ?')
+                params.append(value)
+        query = f"""
+            SELECT {column} AS key,
+                   COUNT(*) AS calls,
+                   SUM(status = 'error') AS errors,
+                   SUM(status = 'budget') AS budget_denied,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(output_tokens) AS output_tokens,
+                   SUM(estimated) AS estimated_calls,
+                   AVG(CASE WHEN status = 'ok' THEN latency_ms END) AS mean_latency_ms,
+                   MAX(latency_ms) AS max_latency_ms
+            FROM llm_calls {'WHERE ' + ' AND '.join(where) if where else ''}
+            GROUP BY {column}
+            ORDER BY {'key DESC' if group_by == 'day' else 'prompt_tokens + output_tokens DESC'}
+            LIMIT ?"""
+        with self._connect() as conn:
+            rows = conn.execute(query, params + [limit]).fetchall()
+        return [{
+            group_by: row['key'],
+            "calls": row['calls'],
+            "errors": row['errors'],
+            "budget_denied": row['budget_denied'],
+            "prompt_tokens": row['prompt_tokens'],
+            "output_tokens": row['output_tokens'],
+            "total_tokens": row['prompt_tokens'] + row['output_tokens'],
+            "estimated_calls": row['estimated_calls'],
+            "cost_usd": round((row['prompt_tokens'] * PRICE_INPUT + row['output_tokens'] * PRICE_OUTPUT) / 1e6, 6),
+            "mean_latency_ms": round(row['mean_latency_ms'], 1) if row['mean_latency_ms'] is not None else None,
+            "max_latency_ms": row['max_latency_ms']
+        } for row in rows]
+
+    def budget_status(self, user_id: Optional[str] = None) -> Dict:
+        status = {
+            "day": _today(),
+            "global": {"spent": self.spent_today(), "limit": self.global_daily_tokens or None}
+        }
+        if user_id:
+            status["user"] = {"user_id": user_id, "spent": self.spent_today(user_id), "limit": self.user_daily_tokens or None}
+        return status
+
+
+_ledger: Optional[LlmLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> LlmLedger:
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = LlmLedger()
+    return _ledger
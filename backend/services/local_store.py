@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+# Host-local state shared by every worker: SQLite stores, indexes, locks, spill files
+DEFAULT_CACHE_DIR = os.getenv('CACHE_DIR') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+
+
+class SQLiteFile:
+    """
+    One SQLite file shared by all workers on a host: WAL mode so readers do not
+    block the writer, a 30s busy timeout, and the schema statements run once
+    per process on first connect.
+
+    Connections are in autocommit mode unless transactional, in which case each
+    `with connect()` block commits on success and rolls back on error.
+    """
+
+    def __init__(self, path: str, schema: List[str], row_factory: Optional[type] = None,
+                 transactional: bool = False):
+        self.path = path
+        self.schema = schema
+        self.row_factory = row_factory
+        self.transactional = transactional
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level='' if self.transactional else None)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        if not self._initialized:
+            with self._init_lock:
+                conn.execute('PRAGMA journal_mode=WAL')
+                for statement in self.schema:
+                    conn.execute(statement)
+                self._initialized = True
+        try:
+            if self.transactional:
+                with conn:
+                    yield conn
+            else:
+                yield conn
+        finally:
+            conn.close()
@@ -0,0 +1,92 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Dict, List, Optional
+
+DEFAULT_EXTRACTOR = 'pdfplumber'
+
+_TRAILING_SPACE = re.compile(r'[ \t]+\n')
+
+
+def _clean(text: str) -> str:
+    """Same line endings and whitespace for every backend, so their output and cache entries compare"""
+    text = (text or '').replace('\r\n', '\n').replace('\r', '\n').replace('\x00', '')
+    return _TRAILING_SPACE.sub('\n', text).strip()
+
+
+class PdfExtractor(ABC):
+    """Turns PDF bytes into one text string per page"""
+
+    name = ''
+
+    @abstractmethod
+    def extract_pages(self, data: bytes) -> List[str]:
+        ...
+
+    def extract_text(self, data: bytes) -> str:
+        return "\n\n".join(page for page in self.extract_pages(data) if page)
+
+
+class PdfplumberExtractor(PdfExtractor):
+    """Layout-aware and slowest; the reference output the answer-key parser was written against"""
+
+    name = 'pdfplumber'
+
+    def extract_pages(self, data: bytes) -> List[str]:
+        import pdfplumber
+        with pdfplumber.open(BytesIO(data)) as pdf:
+            return [_clean(page.extract_text()) for page in pdf.pages]
+
+
+class PdfiumExtractor(PdfExtractor):
+    """PDFium's native text layer through pypdfium2 (already installed with pdfplumber)"""
+
+    name = 'pdfium'
+
+    def extract_pages(self, data: bytes) -> List[str]:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(data)
+        try:
+            pages = []
+            for index in range(len(pdf)):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                try:
+                    pages.append(_clean(textpage.get_text_range()))
+                finally:
+                    textpage.close()
+                    page.close()
+            return pages
+        finally:
+            pdf.close()
+
+
+class PdfminerExtractor(PdfExtractor):
+    """pdfminer.six layout analysis without pdfplumber's character-level post-processing"""
+
+    name = 'pdfminer'
+
+    def extract_pages(self, data: bytes) -> List[str]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LAParams, LTTextContainer
+        pages = []
+        for layout in extract_pages(BytesIO(data), laparams=LAParams()):
+            pages.append(_clean(''.join(
+                element.get_text() for element in layout if isinstance(element, LTTextContainer)
+            )))
+        return pages
+
+
+EXTRACTORS: Dict[str, PdfExtractor] = {
+    extractor.name: extractor
+    for extractor in (PdfplumberExtractor(), PdfiumExtractor(), PdfminerExtractor())
+}
+
+
+def get_extractor(name: Optional[str] = None) -> PdfExtractor:
+    """Backend named by PDF_EXTRACTOR (pdfplumber, pdfium or pdfminer)"""
+    name = (name or os.getenv('PDF_EXTRACTOR') or DEFAULT_EXTRACTOR).lower()
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown PDF_EXTRACTOR '{name}', expected one of: {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[name]
@@ -0,0 +1,241 @@
+"""
+Opt-in sampling profiler for single requests.
+
+A profiled request's thread is sampled every PROFILE_INTERVAL_MS by one
+shared background thread (sys._current_frames), so the request itself runs
+uninstrumented and requests that are not profiled pay only a random draw.
+Each sample is weighted by the wall time and, on Linux, the thread CPU time
+since the previous one. The result is saved as a speedscope file with a
+"wall" and a "cpu" profile: open it at https://www.speedscope.app.
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from services.local_store import DEFAULT_CACHE_DIR
+
+SAMPLE_RATE = int(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # profile 1 in N requests; 0 disables
+HEADER_TOKEN = os.getenv('PROFILE_HEADER_TOKEN', '')  # X-Profile value that forces a profile; empty disables
+INTERVAL = float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000
+MIN_DURATION_MS = float(os.getenv('PROFILE_MIN_DURATION_MS', '0'))  # sampled profiles faster than this are discarded
+PROFILE_DIR = os.getenv('PROFILE_DIR') or os.path.join(DEFAULT_CACHE_DIR, 'profiles')
+MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+MAX_DEPTH = 128
+
+
+def _thread_cpu_clock(thread_id: int) -> Optional[int]:
+    try:
+        return time.pthread_getcpuclockid(thread_id)
+    except (AttributeError, OSError):
+        return None
+
+
+class ProfileSession:
+    """Samples collected for one request thread"""
+
+    def __init__(self, thread_id: int, forced: bool):
+        self.thread_id = thread_id
+        self.forced = forced
+        self.frames: Dict[Tuple[str, str, int], int] = {}
+        self.stacks: List[List[int]] = []
+        self.wall_weights: List[float] = []
+        self.cpu_weights: List[float] = []
+        self._clock = _thread_cpu_clock(thread_id)
+        self.closed = False
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self._last_wall = self.started
+        self._last_cpu = 0.0
+        self._last_cpu = self._cpu_now()
+
+    def _cpu_now(self) -> float:
+        if self._clock is None:
+            return 0.0
+        try:
+            return time.clock_gettime(self._clock)
+        except OSError:
+            return self._last_cpu
+
+    def sample(self, frame):
+        with self.lock:
+            if not self.closed:
+                self._sample(frame)
+
+    def _sample(self, frame):
+        now, cpu = time.perf_counter(), self._cpu_now()
+        wall_ms, cpu_ms = (now - self._last_wall) * 1000, (cpu - self._last_cpu) * 1000
+        self._last_wall, self._last_cpu = now, cpu
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self.frames.get(key)
+            if index is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        self.stacks.append(stack)
+        self.wall_weights.append(round(wall_ms, 3))
+        self.cpu_weights.append(round(cpu_ms, 3))
+
+    def speedscope(self, name: str) -> Dict:
+        frames = [{"name": func, "file": filename, "line": line} for func, filename, line in self.frames]
+        profiles = []
+        for kind, weights in (("wall", self.wall_weights), ("cpu", self.cpu_weights)):
+            if kind == "cpu" and self._clock is None:
+                continue
+            kept = [(stack, weight) for stack, weight in zip(self.stacks, weights) if weight > 0]
+            profiles.append({
+                "type": "sampled",
+                "name": f"{name} ({kind})",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weight for _, weight in kept), 3),
+                "samples": [stack for stack, _ in kept],
+                "weights": [weight for _, weight in kept]
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "request_profiler",
+            "shared": {"frames": frames},
+            "profiles": profiles
+        }
+
+
+class RequestProfiler:
+    def __init__(self, sample_rate: int = SAMPLE_RATE, header_token: str = HEADER_TOKEN,
+                 interval: float = INTERVAL, directory: str = PROFILE_DIR, max_files: int = MAX_FILES,
+                 min_duration_ms: float = MIN_DURATION_MS):
+        self.sample_rate = sample_rate
+        self.header_token = header_token
+        self.interval = interval
+        self.directory = directory
+        self.max_files = max_files
+        self.min_duration_ms = min_duration_ms
+        self._sessions: Dict[int, ProfileSession] = {}
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+        self.stats = {"profiled": 0, "saved": 0, "discarded": 0, "samples": 0, "sampler_seconds": 0.0}
+
+    def wants(self, header_value: Optional[str]) -> Optional[bool]:
+        """None to skip this request, otherwise whether the header forced it"""
+        if header_value and self.header_token and header_value == self.header_token:
+            return True
+        if self.sample_rate > 0 and random.random() * self.sample_rate < 1:
+            return False
+        return None
+
+    def start(self, forced: bool) -> ProfileSession:
+        session = ProfileSession(threading.get_ident(), forced)
+        with self._lock:
+            self._sessions[session.thread_id] = session
+            self.stats["profiled"] += 1
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._sampler.start()
+        return session
+
+    def _run(self):
+        while True:
+            with self._lock:
+                sessions = list(self._sessions.values())
+                if not sessions:
+                    self._sampler = None
+                    return
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            for session in sessions:
+                session.sample(frames.get(session.thread_id))
+            del frames
+            with self._lock:
+                self.stats["samples"] += len(sessions)
+                self.stats["sampler_seconds"] += time.perf_counter() - started
+            time.sleep(self.interval)
+
+    def finish(self, session: ProfileSession, route: str, chapter: Optional[str], status: int) -> Optional[str]:
+        """Stop sampling and save the profile; returns its file name, or None when it was discarded"""
+        with self._lock:
+            self._sessions.pop(session.thread_id, None)
+        with session.lock:
+            session.closed = True
+        duration_ms = (time.perf_counter() - session.started) * 1000
+        if not session.forced and duration_ms < self.min_duration_ms:
+            with self._lock:
+                self.stats["discarded"] += 1
+            return None
+
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        tags = [_slug(route), _slug(chapter or 'none'), f"{duration_ms:.0f}ms"]
+        filename = f"{stamp}_{'_'.join(tags)}.speedscope.json"
+        document = session.speedscope(f"{route} chapter={chapter or '-'} status={status} {duration_ms:.0f}ms")
+        document["metadata"] = {
+            "route": route, "chapter": chapter, "status": status, "duration_ms": round(duration_ms, 1),
+            "forced": session.forced, "interval_ms": self.interval * 1000, "pid": os.getpid()
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, filename), 'w', encoding='utf-8') as f:
+                json.dump(document, f)
+            self._prune()
+        except OSError as e:
+            print(f"Error saving request profile: {e}")
+            return None
+        with self._lock:
+            self.stats["saved"] += 1
+        return filename
+
+    def _prune(self):
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith('.speedscope.json'))
+        for name in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def recent(self, limit: int = 20) -> List[str]:
+        try:
+            files = sorted(name for name in os.listdir(self.directory) if name.endswith('.speedscope.json'))
+        except OSError:
+            return []
+        return files[::-1][:limit]
+
+    def summary(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            active = len(self._sessions)
+        stats["sampler_seconds"] = round(stats["sampler_seconds"], 4)
+        stats["sampler_ms_per_sample"] = round(stats["sampler_seconds"] * 1000 / stats["samples"], 4) if stats["samples"] else 0.0
+        return {
+            "sample_rate": self.sample_rate,
+            "header_enabled": bool(self.header_token),
+            "interval_ms": self.interval * 1000,
+            "directory": self.directory,
+            "active": active,
+            **stats,
+            "recent": self.recent()
+        }
+
+
+def _slug(value: str) -> str:
+    return ''.join(c if c.isalnum() else '-' for c in value.strip('/').lower())[:40] or 'root'
+
+
+_profiler: Optional[RequestProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RequestProfiler:
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = RequestProfiler()
+    return _profiler
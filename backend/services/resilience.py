@@ -0,0 +1,290 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable',
+    'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout',
+    'BadGateway', 'Aborted', 'Unknown'
+}
+
+MIN_ATTEMPT_SECONDS = 1.0  # a retry with less of the call's deadline left than this is not started
+
+# Attempts run on worker threads so a hung provider call cannot block the
+# request past its deadline. The thread is abandoned, not killed.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('LLM_CALL_WORKERS', '16')),
+    thread_name_prefix='llm-call'
+)
+
+
+class CallTimeoutError(Exception):
+    """Raised when an attempt does not finish before its deadline"""
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while the breaker is open"""
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (CallTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, 'code', None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            code = None
+    code = getattr(code, 'value', code)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                # Let exactly one probe through to test the provider
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"LLM circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+
+class ResilientCaller:
+    """
+    Wraps a provider call with a per-attempt timeout, bounded retries with
+    jittered exponential backoff, optional hedging and a circuit breaker.
+    deadline caps the whole call, retries and backoff included, so it can be
+    kept under the web worker's timeout.
+    """
+
+    def __init__(self,
+                 name: str,
+                 timeout: float = 30.0,
+                 deadline: float = 0.0,
+                 max_retries: int = 2,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 hedge_percentile: float = 0.0,
+                 hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._counters = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'attempts': 0,
+            'retries': 0,
+            'timeouts': 0,
+            'deadlines_exceeded': 0,
+            'hedges': 0,
+            'hedge_wins': 0,
+            'short_circuited': 0
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._counters[key] += amount
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform between 0 and the capped exponential step
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _hedge_delay(self, timeout: float) -> Optional[float]:
+        if not self.hedge_percentile or len(self.latency) < self.hedge_min_samples:
+            return None
+        threshold = self.latency.percentile(self.hedge_percentile)
+        if threshold is None or threshold >= timeout:
+            return None
+        return threshold
+
+    def _attempt(self, fn: Callable, timeout: float, args, kwargs) -> Any:
+        self._count('attempts')
+        started = time.monotonic()
+        primary = _executor.submit(fn, *args, **kwargs)
+        pending = {primary}
+
+        hedge_delay = self._hedge_delay(timeout)
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done:
+                self._count('hedges')
+                pending.add(_executor.submit(fn, *args, **kwargs))
+
+        deadline = started + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f.exception() is not None):
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count('hedge_wins')
+                    for other in pending:
+                        other.cancel()
+                    self.latency.record(time.monotonic() - started)
+                    return future.result()
+                if not pending:
+                    raise future.exception()
+
+        for future in pending:
+            future.cancel()
+        self._count('timeouts')
+        raise CallTimeoutError(f"{self.name} call exceeded {timeout:.1f}s deadline")
+
+    def call(self, fn: Callable, *args, timeout: Optional[float] = None,
+             deadline: Optional[float] = None, **kwargs) -> Any:
+        self._count('calls')
+        timeout = timeout or self.timeout
+        deadline = deadline or self.deadline
+        expires = time.monotonic() + deadline if deadline else None
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+            attempt_timeout = timeout
+            if expires is not None:
+                attempt_timeout = min(timeout, expires - time.monotonic())
+            try:
+                result = self._attempt(fn, attempt_timeout, args, kwargs)
+                self.breaker.record_success()
+                self._count('successes')
+                return result
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    # Client-side errors say nothing about provider health
+                    self.breaker.record_success()
+                    break
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    break
+                pause = self._backoff(attempt)
+                if expires is not None and time.monotonic() + pause + MIN_ATTEMPT_SECONDS > expires:
+                    # No time left for another attempt within the call's deadline
+                    self._count('deadlines_exceeded')
+                    break
+                self._count('retries')
+                self._sleep(pause)
+
+        self._count('failures')
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        counters.update({
+            'name': self.name,
+            'breaker_state': self.breaker.state,
+            'latency_p50': self.latency.percentile(50),
+            'latency_p95': self.latency.percentile(95),
+            'latency_samples': len(self.latency)
+        })
+        return counters
+
+
+_callers: Dict[str, ResilientCaller] = {}
+_callers_lock = threading.Lock()
+
+
+def get_caller(name: str) -> ResilientCaller:
+    """Return the process-wide caller registered under name (task:model for the gateway), configured from env"""
+    with _callers_lock:
+        if name not in _callers:
+            _callers[name] = ResilientCaller(
+                name,
+                timeout=float(os.getenv('LLM_TIMEOUT_SECONDS', '30')),
+                deadline=float(os.getenv('LLM_CALL_DEADLINE_SECONDS', '50')),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', '2')),
+                backoff_base=float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '0.5')),
+                hedge_percentile=float(os.getenv('LLM_HEDGE_PERCENTILE', '0')),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+                    reset_timeout=float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+                )
+            )
+        return _callers[name]
+
+
+def get_all_stats() -> Dict[str, Dict[str, Any]]:
+    with _callers_lock:
+        callers = list(_callers.values())
+    return {caller.name: caller.stats() for caller in callers}
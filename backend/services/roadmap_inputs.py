@@ -0,0 +1,87 @@
+import json
+import hashlib
+from typing import Dict, List, Optional
+
+ONBOARDING_FIELDS = ["student_type", "confidence_level", "difficult_areas", "target_grade", "study_hours", "exam_session"]
+
+
+def onboarding_inputs(profile: Dict) -> Dict:
+    """Profile fields the roadmap depends on"""
+    data = {field: profile.get(field) for field in ONBOARDING_FIELDS}
+    data["difficult_areas"] = profile.get("difficult_areas", [])
+    return data
+
+
+def diagnostic_summary(results: List[Dict]) -> List[Dict]:
+    """Result fields the roadmap depends on"""
+    return [
+        {
+            "chapter": result.get("chapter"),
+            "passed": result.get("passed"),
+            "percentage": result.get("percentage"),
+            "bucket_scores": result.get("bucket_scores", {})
+        }
+        for result in results
+    ]
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def roadmap_fingerprint(profile: Dict, results: List[Dict]) -> Dict:
+    """Hash of all roadmap inputs, plus per-part hashes to find what changed"""
+    by_chapter: Dict[str, List[Dict]] = {}
+    for entry in diagnostic_summary(results):
+        by_chapter.setdefault(entry["chapter"] or "", []).append(entry)
+
+    onboarding_hash = _digest(onboarding_inputs(profile))
+    chapter_hashes = {
+        chapter: _digest(sorted(entries, key=lambda e: json.dumps(e, sort_keys=True, default=str)))
+        for chapter, entries in by_chapter.items()
+    }
+    return {
+        "hash": _digest({"onboarding": onboarding_hash, "chapters": chapter_hashes}),
+        "onboarding": onboarding_hash,
+        "chapters": chapter_hashes
+    }
+
+
+def changed_chapters(previous: Optional[Dict], current: Dict) -> Optional[List[str]]:
+    """
+    Chapters whose diagnostic inputs changed since the previous fingerprint.
+    None means an incremental update is not possible (no fingerprint, or
+    onboarding answers changed) and the whole roadmap must be regenerated.
+    """
+    if not previous or previous.get("onboarding") != current["onboarding"]:
+        return None
+    old_chapters = previous.get("chapters", {})
+    new_chapters = current["chapters"]
+    if set(old_chapters) - set(new_chapters):
+        return None
+    return sorted(chapter for chapter, digest in new_chapters.items() if old_chapters.get(chapter) != digest)
+
+
+def affected_weeks(roadmap: Dict, chapters: List[str]) -> List[Dict]:
+    """Weeks whose topics mention any of the given chapters"""
+    needles = [chapter.lower() for chapter in chapters if chapter]
+    weeks = []
+    for week in roadmap.get("weekly_roadmap", []):
+        text = " ".join(str(topic) for topic in week.get("topics", [])).lower()
+        text += " " + str(week.get("reasoning", "")).lower()
+        if any(needle in text for needle in needles):
+            weeks.append(week)
+    return weeks
+
+
+def merge_weeks(roadmap: Dict, revision: Dict) -> Dict:
+    """Replace revised weeks by week number and append any new ones"""
+    weeks = {week.get("week"): week for week in roadmap.get("weekly_roadmap", [])}
+    for week in revision.get("updated_weeks", []):
+        weeks[week.get("week")] = week
+    merged = dict(roadmap)
+    merged["weekly_roadmap"] = [weeks[key] for key in sorted(weeks, key=lambda k: (k is None, k))]
+    for field in ("estimated_completion", "focus_areas"):
+        if revision.get(field):
+            merged[field] = revision[field]
+    return merged
@@ -0,0 +1,182 @@
+import re
+from datetime import date
+from typing import Dict, List, Optional
+
+BUCKETS = ["Basic", "Conceptual", "Application"]
+
+# Percentage a chapter should reach for each target grade
+TARGET_PERCENTAGE = {"A*": 90, "A": 80, "B": 70, "C": 60, "Pass": 50}
+
+# Hours of study a chapter needs, by its state
+HOURS_FAILED = 5
+HOURS_PER_WEAK_BUCKET = 1.5
+HOURS_BELOW_TARGET = 3
+HOURS_REVISION = 1
+HOURS_BY_SELF_RATING = {"not_studied": 6, "weak": 4, "good": 2}
+
+PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+BUCKET_FOCUS = {
+    "Basic": "key definitions and recall",
+    "Conceptual": "concept understanding",
+    "Application": "calculations and exam-style application"
+}
+
+
+def weekly_hours(study_hours: Optional[str]) -> float:
+    """'3–5 hours' -> 4.0; falls back to 3 hours a week and never plans less than 1"""
+    numbers = [float(n) for n in re.findall(r'\d+(?:\.\d+)?', study_hours or '')]
+    if not numbers:
+        return 3.0
+    return max(sum(numbers[:2]) / len(numbers[:2]), 1.0)
+
+
+def weeks_until_exam(exam_session: Optional[str], today: Optional[date] = None) -> Optional[int]:
+    """'May / June 2026' -> weeks until 1 May 2026; bare years assume the May/June series; None once it has passed"""
+    today = today or date.today()
+    match = re.search(r'(\d{4})', exam_session or '')
+    if not match:
+        return None
+    month = 10 if re.search(r'oct|nov', exam_session, re.IGNORECASE) else 5
+    days = (date(int(match.group(1)), month, 1) - today).days
+    if days < 0:
+        return None
+    return max(days // 7, 1)
+
+
+def _chapter_tasks(profile: Dict, results: List[Dict], chapters: List[str]) -> List[Dict]:
+    target = TARGET_PERCENTAGE.get(profile.get("target_grade"), 70)
+    tasks = []
+    seen = set()
+
+    for result in results:
+        chapter = result.get("chapter")
+        if not chapter or chapter in seen:
+            continue
+        seen.add(chapter)
+        percentage = float(result.get("percentage") or 0)
+        scores = result.get("bucket_scores") or {}
+        totals = result.get("bucket_totals") or {}
+        weak_buckets = [
+            bucket for bucket in BUCKETS
+            if totals.get(bucket, 0) and scores.get(bucket, 0) / totals[bucket] < 0.5
+        ]
+        if not totals:
+            weak_buckets = [bucket for bucket in BUCKETS if bucket in scores and not scores[bucket]]
+
+        if not result.get("passed"):
+            priority = "high"
+            hours = HOURS_FAILED + HOURS_PER_WEAK_BUCKET * len(weak_buckets)
+            reason = f"Failed diagnostic ({percentage:.0f}%)"
+        elif percentage < target:
+            priority = "medium"
+            hours = HOURS_BELOW_TARGET + HOURS_PER_WEAK_BUCKET * len(weak_buckets)
+            reason = f"Passed at {percentage:.0f}%, below the {target}% needed for {profile.get('target_grade') or 'your target'}"
+        else:
+            priority = "low"
+            hours = HOURS_REVISION
+            reason = f"Strong result ({percentage:.0f}%), light revision"
+
+        tasks.append({
+            "chapter": chapter,
+            "priority": priority,
+            "hours": hours,
+            "percentage": percentage,
+            "weak_buckets": weak_buckets,
+            "reason": reason
+        })
+
+    self_ratings = profile.get("chapters") or {}
+    for chapter in chapters:
+        if chapter in seen:
+            continue
+        rating = self_ratings.get(chapter, "not_studied")
+        tasks.append({
+            "chapter": chapter,
+            "priority": "medium" if rating != "good" else "low",
+            "hours": HOURS_BY_SELF_RATING.get(rating, 4),
+            "percentage": None,
+            "weak_buckets": [],
+            "reason": "No diagnostic yet; take the diagnostic early in the week"
+        })
+
+    # Most urgent first; within a priority, weakest result first
+    tasks.sort(key=lambda t: (PRIORITY_RANK[t["priority"]], t["percentage"] if t["percentage"] is not None else 50))
+    return tasks
+
+
+def _topic_label(task: Dict) -> str:
+    if task["weak_buckets"]:
+        focus = ", ".join(BUCKET_FOCUS[bucket] for bucket in task["weak_buckets"])
+        return f"{task['chapter']}: {focus}"
+    if task["priority"] == "low":
+        return f"{task['chapter']}: revision and past paper questions"
+    return task["chapter"]
+
+
+def plan_roadmap(profile: Dict, results: List[Dict], chapters: Optional[List[str]] = None,
+                 today: Optional[date] = None) -> Dict:
+    """
+    Rule-based weekly plan in the shape GeminiService.generate_roadmap returns.
+    Chapters are packed greedily into weeks of the student's weekly study hours,
+    most urgent first, leaving a final past-paper week when time allows.
+    """
+    capacity = weekly_hours(profile.get("study_hours"))
+    horizon = weeks_until_exam(profile.get("exam_session"), today)
+    tasks = _chapter_tasks(profile, results, chapters or [])
+
+    weeks: List[Dict] = []
+    current = {"topics": [], "priorities": [], "reasons": [], "hours": 0.0}
+    for task in tasks:
+        remaining = task["hours"]
+        while remaining > 0:
+            if current["hours"] >= capacity:
+                weeks.append(current)
+                current = {"topics": [], "priorities": [], "reasons": [], "hours": 0.0}
+            chunk = min(remaining, capacity - current["hours"])
+            label = _topic_label(task)
+            if label not in current["topics"]:
+                current["topics"].append(label)
+                current["priorities"].append(task["priority"])
+                current["reasons"].append(f"{task['chapter']}: {task['reason']}")
+            current["hours"] += chunk
+            remaining -= chunk
+    if current["topics"]:
+        weeks.append(current)
+
+    truncated = horizon is not None and len(weeks) > horizon
+    if truncated:
+        # Not enough time before the exam: keep the most urgent weeks
+        weeks = weeks[:horizon]
+
+    weekly_roadmap = []
+    for number, week in enumerate(weeks, start=1):
+        weekly_roadmap.append({
+            "week": number,
+            "topics": week["topics"],
+            "priority": min(week["priorities"], key=lambda p: PRIORITY_RANK[p]),
+            "reasoning": "; ".join(week["reasons"])
+        })
+
+    if horizon is None or len(weekly_roadmap) < horizon:
+        weekly_roadmap.append({
+            "week": len(weekly_roadmap) + 1,
+            "topics": ["Timed past papers across all chapters", "Review mistakes from the diagnostics"],
+            "priority": "medium",
+            "reasoning": "Consolidate with exam practice before the exam"
+        })
+
+    focus_areas = [_topic_label(task) for task in tasks if task["priority"] == "high"]
+    if not focus_areas:
+        focus_areas = [_topic_label(task) for task in tasks[:3]]
+    focus_areas += [f"{area} questions" for area in profile.get("difficult_areas") or []]
+
+    return {
+        "weekly_roadmap": weekly_roadmap,
+        "estimated_completion": f"{len(weekly_roadmap)} weeks",
+        "focus_areas": focus_areas,
+        "plan_source": "local",
+        "hours_per_week": capacity,
+        "weeks_until_exam": horizon,
+        "truncated": truncated
+    }
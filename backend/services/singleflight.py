@@ -0,0 +1,87 @@
+import os
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from services.local_store import DEFAULT_CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: in-process locking only
+    fcntl = None
+
+
+class SingleflightTimeout(Exception):
+    """Raised when another request holds the key for longer than the wait budget"""
+
+
+class KeyedLock:
+    """
+    Per-key mutual exclusion across threads and across gunicorn workers on
+    one host, using flock on a lock file per key. flock is released by the
+    kernel if the holder dies, so a crashed worker never leaves a stale lock.
+    """
+
+    def __init__(self, lock_dir: str = None, poll_interval: float = 0.05):
+        self.lock_dir = lock_dir or os.getenv('LOCK_DIR') or os.path.join(DEFAULT_CACHE_DIR, 'locks')
+        self.poll_interval = poll_interval
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._thread_locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _thread_lock(self, name: str) -> threading.Lock:
+        with self._guard:
+            return self._thread_locks.setdefault(name, threading.Lock())
+
+    @contextmanager
+    def hold(self, key: str, timeout: float):
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        deadline = time.monotonic() + timeout
+
+        thread_lock = self._thread_lock(name)
+        if not thread_lock.acquire(timeout=timeout):
+            raise SingleflightTimeout(f"Timed out waiting for '{key}'")
+        try:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(os.path.join(self.lock_dir, f"{name}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            raise SingleflightTimeout(f"Timed out waiting for '{key}'")
+                        time.sleep(self.poll_interval)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        finally:
+            thread_lock.release()
+
+
+_lock = None
+_lock_guard = threading.Lock()
+
+
+def get_keyed_lock() -> KeyedLock:
+    global _lock
+    with _lock_guard:
+        if _lock is None:
+            _lock = KeyedLock()
+        return _lock
+
+
+def diagnostic_generation(user_id: str, chapter: str, timeout: Optional[float] = None):
+    """Serialize diagnostic generation for one (user, chapter) pair"""
+    if timeout is None:
+        # Long enough to see one model call finish (LLM_CALL_DEADLINE_SECONDS), then
+        # generate ourselves, all within gunicorn's worker timeout
+        timeout = float(os.getenv('SINGLEFLIGHT_WAIT_SECONDS', '55'))
+    return get_keyed_lock().hold(f"diagnostic:{user_id}:{chapter}", timeout)
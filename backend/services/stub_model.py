@@ -0,0 +1,72 @@
+import hashlib
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+
+class StubResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class InjectedFault(Exception):
+    """Raised by the stub model to simulate a provider error"""
+
+    def __init__(self, message: str, code: int = 503):
+        super().__init__(message)
+        self.code = code
+
+
+class FaultInjectingModel:
+    """
+    Local stand-in for genai.GenerativeModel.
+    Responses are deterministic for a given prompt; latency and failures are
+    drawn from a seeded RNG so fault scenarios can be replayed.
+    """
+
+    def __init__(self,
+                 responder: Optional[Callable[[str], str]] = None,
+                 latency: float = 0.0,
+                 latency_jitter: float = 0.0,
+                 latency_sigma: float = 0.0,
+                 error_rate: float = 0.0,
+                 error_code: int = 503,
+                 hang_rate: float = 0.0,
+                 hang_seconds: float = 60.0,
+                 seed: int = 0):
+        self.responder = responder or self._default_responder
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @staticmethod
+    def _default_responder(prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        return f"stub-response-{digest}"
+
+    def generate_content(self, prompt: str, **kwargs) -> StubResponse:
+        with self._lock:
+            self.calls += 1
+            roll = self._rng.random()
+            jitter = self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0
+            if self.latency_sigma:
+                # Long-tailed like real model latency: lognormal around a median of `latency`
+                jitter += self.latency * (self._rng.lognormvariate(0, self.latency_sigma) - 1)
+
+        if roll < self.hang_rate:
+            time.sleep(self.hang_seconds)
+        elif self.latency or jitter:
+            time.sleep(self.latency + jitter)
+
+        if self.hang_rate <= roll < self.hang_rate + self.error_rate:
+            raise InjectedFault(f"Injected fault ({self.error_code})", code=self.error_code)
+
+        return StubResponse(self.responder(prompt))
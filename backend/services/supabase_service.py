@@ -1,8 +1,12 @@
 import os
 import requests
 from supabase import create_client, Client
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
+from utils.item_keys import item_key
+
+# Columns the dashboard needs; excludes the per-question results array and raw answers
+RESULT_SUMMARY_COLUMNS = 'id, diagnostic_id, chapter, bucket_scores, bucket_totals, total_correct, total_questions, percentage, passed, submitted_at'
 
 class SupabaseService:
     def __init__(self):
@@ -42,6 +46,20 @@ class SupabaseService:
         except Exception:
             return None
     
+    def get_diagnostic_questions(self, diagnostic_id: str) -> List[Dict]:
+        """The stored questions of one diagnostic"""
+        return self.get_diagnostic_tests([diagnostic_id]).get(diagnostic_id, [])
+    
+    def get_diagnostic_tests(self, diagnostic_ids: List[str]) -> Dict[str, List[Dict]]:
+        """diagnostic id -> its stored questions, read in chunks"""
+        tests = {}
+        ids = list(dict.fromkeys(diagnostic_id for diagnostic_id in diagnostic_ids if diagnostic_id))
+        for offset in range(0, len(ids), 200):
+            response = self.supabase.table('diagnostics').select('id, test_data').in_('id', ids[offset:offset + 200]).execute()
+            for row in response.data or []:
+                tests[row['id']] = (row.get('test_data') or {}).get('diagnostic_test') or []
+        return tests
+    
     def get_existing_diagnostic(self, user_id: str, chapter: str) -> Optional[Dict]:
         """Get existing diagnostic for user and chapter (even if not submitted)"""
         try:
@@ -52,6 +70,16 @@ class SupabaseService:
         except Exception:
             return None
     
+    def get_chapter_diagnostic_ids(self, chapter: str, user_ids: List[str]) -> Dict[str, str]:
+        """user_id -> diagnostic id for the users that already have a diagnostic for this chapter"""
+        found = {}
+        for offset in range(0, len(user_ids), 200):
+            response = self.supabase.table('diagnostics').select('id, user_id')\
+                .eq('chapter', chapter).in_('user_id', user_ids[offset:offset + 200]).execute()
+            for row in response.data or []:
+                found[row['user_id']] = row['id']
+        return found
+    
     def save_diagnostic_result(self, result_data: Dict) -> str:
         """Save diagnostic result"""
         response = self.supabase.table('diagnostic_results').insert(result_data).execute()
@@ -73,6 +101,78 @@ class SupabaseService:
         except Exception:
             return []
     
+    def get_user_result_summaries(self, user_id: str, limit: Optional[int] = None,
+                                  before: Optional[Tuple[str, str]] = None) -> List[Dict]:
+        """
+        Get projected diagnostic results for a user, newest first (ties broken by id),
+        optionally after a (submitted_at, id) cursor
+        """
+        try:
+            query = self.supabase.table('diagnostic_results').select(RESULT_SUMMARY_COLUMNS).eq('user_id', user_id)
+            # postgrest-py 0.13 has no or_() or multi-column order(), so these go in as raw PostgREST params
+            if before:
+                submitted_at, result_id = before
+                query.params = query.params.add(
+                    'or', f'(submitted_at.lt."{submitted_at}",and(submitted_at.eq."{submitted_at}",id.lt."{result_id}"))'
+                )
+            query.params = query.params.add('order', 'submitted_at.desc,id.desc')
+            if limit:
+                query = query.limit(limit)
+            response = query.execute()
+            return response.data if response.data else []
+        except Exception:
+            return []
+    
+    def get_user_chapter_outcomes(self, user_id: str) -> List[Dict]:
+        """Get only chapter and passed for every result of a user"""
+        try:
+            response = self.supabase.table('diagnostic_results').select('chapter, passed').eq('user_id', user_id).execute()
+            return response.data if response.data else []
+        except Exception:
+            return []
+    
+    def get_user_diagnostic_result_by_id(self, user_id: str, result_id: str) -> Optional[Dict]:
+        """Get one full diagnostic result, scoped to its owner"""
+        try:
+            response = self.supabase.table('diagnostic_results').select('*').eq('id', result_id).eq('user_id', user_id).single().execute()
+            return response.data if response.data else None
+        except Exception:
+            return None
+    
+    def get_chapter_graded_sheets(self, chapter: str, page_size: int = 1000) -> List[Dict]:
+        """Every submitted fixed-form sheet for a chapter: its questions, their item keys and buckets, and per-question correctness"""
+        results = []
+        start = 0
+        while True:
+            response = self.supabase.table('diagnostic_results').select('diagnostic_id, results')\
+                .eq('chapter', chapter).order('id').limit(page_size).offset(start).execute()
+            results.extend(response.data or [])
+            if len(response.data or []) < page_size:
+                break
+            start += page_size
+        
+        tests = self.get_diagnostic_tests([row.get('diagnostic_id') for row in results])
+        
+        sheets = []
+        for row in results:
+            questions = tests.get(row.get('diagnostic_id')) or []
+            graded = row.get('results') or []
+            # Adaptive results are not aligned with the stored form; skip any sheet that does not match it.
+            # Fixed-form results carry no question text, only the form's answer key.
+            if len(graded) != len(questions) or any(
+                r.get('question', q.get('question')) != q.get('question') or
+                r.get('correct_answer') != str(q.get('answer') or '').strip().upper()
+                for r, q in zip(graded, questions)
+            ):
+                continue
+            sheets.append({
+                "questions": questions,
+                "keys": [item_key(question) for question in questions],
+                "buckets": [question.get('bucket', 'Basic') for question in questions],
+                "correctness": [bool(r.get('is_correct')) for r in graded]
+            })
+        return sheets
+    
     def save_roadmap(self, user_id: str, roadmap: Dict) -> str:
         """Save roadmap to database"""
         data = {
@@ -94,6 +194,16 @@ class SupabaseService:
         except Exception:
             return None
     
+    def get_roadmap_record(self, user_id: str) -> Optional[Dict]:
+        """Get latest roadmap row (id, roadmap_data, created_at) for user"""
+        try:
+            response = self.supabase.table('roadmaps').select('id, roadmap_data, created_at').eq('user_id', user_id).order('created_at', desc=True).limit(1).execute()
+            if response.data and len(response.data) > 0:
+                return response.data[0]
+            return None
+        except Exception:
+            return None
+    
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Get user profile by username"""
         try:
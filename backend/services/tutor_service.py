@@ -1,21 +1,26 @@
 import os
 import json
 import re
-import google.generativeai as genai
-from typing import Dict, Optional, List, Tuple
+import random
+from typing import Dict, Optional, List
 from services.chapter_loader import build_ai_context
 from services.gemini_service import GeminiService
+from services.llm_gateway import get_gateway
+from services.llm_ledger import BudgetExceeded
+from services.answer_key_index import lookup_answer
+from services.item_store import draw_mcq_items, items_to_mcqs
+from services.cache import get_cache
+from services.vector_index import relevant_chunks
+from services.chapter_router import route_question
+from services.tutor_sessions import get_session_store, new_session, add_turn, render_history
+
+MCQ_POOL_SIZE = int(os.getenv('MCQ_POOL_SIZE', '20'))
 
 class TutorService:
     def __init__(self):
-        api_key = os.getenv('GEMINI_API_KEY')
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-        
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('models/gemini-2.5-flash-lite')
+        self.gateway = get_gateway()
     
-    def _safe_generate_content(self, prompt: str, fallback_prompt: str = None) -> str:
+    def _safe_generate_content(self, prompt: str, fallback_prompt: str = None, task: str = 'default') -> str:
         """Safely generate content with fallback if prompt is empty"""
         if not prompt or prompt.strip() == "":
             if fallback_prompt:
@@ -24,8 +29,9 @@ class TutorService:
                 prompt = "Explain the basics of chemistry in simple terms."
         
         try:
-            response = self.model.generate_content(prompt)
-            return response.text.strip() if response.text else ""
+            return self.gateway.generate(prompt, task)
+        except BudgetExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Error generating content: {str(e)}")
     
@@ -94,32 +100,16 @@ Provide your answer:"""
         
         return prompt
     
-    def _generate_response(self, prompt: str) -> str:
+    def _generate_response(self, prompt: str, task: str = 'default') -> str:
         fallback_prompt = "Explain the basics of chemistry in simple terms."
         try:
-            response_text = self._safe_generate_content(prompt, fallback_prompt)
+            response_text = self._safe_generate_content(prompt, fallback_prompt, task)
             return response_text
+        except BudgetExceeded:
+            raise
         except Exception as e:
             return f"Error generating response: {str(e)}"
     
-    def _check_answer_in_sources(self, question: str, chapter_data: Dict) -> bool:
-        combined_text = (
-            chapter_data.get('syllabus', '') + ' ' +
-            chapter_data.get('past_paper_text', '') + ' ' +
-            chapter_data.get('answer_key_text', '')
-        ).lower()
-        
-        question_keywords = question.lower().split()
-        relevant_keywords = [kw for kw in question_keywords if len(kw) > 3]
-        
-        if not relevant_keywords:
-            return False
-        
-        matches = sum(1 for keyword in relevant_keywords if keyword in combined_text)
-        relevance_score = matches / len(relevant_keywords) if relevant_keywords else 0
-        
-        return relevance_score >= 0.3
-    
     def tutor_response(self, chapter_name: str, student_question: Optional[str] = None) -> Dict:
         chapter_data = build_ai_context(chapter_name)
         
@@ -131,7 +121,15 @@ Provide your answer:"""
             }
         
         if student_question:
-            if not self._check_answer_in_sources(student_question, chapter_data):
+            keyed_answer = lookup_answer(chapter_data.get('answer_key_index', {}), student_question)
+            if keyed_answer:
+                return {
+                    "chapter": chapter_name,
+                    "mode": "question",
+                    "response": _format_keyed_answer(*keyed_answer)
+                }
+            
+            if not relevant_chunks(student_question, chapter_data):
                 return {
                     "chapter": chapter_name,
                     "mode": "question",
@@ -139,7 +137,15 @@ Provide your answer:"""
                 }
             
             prompt = self._build_question_prompt(chapter_data, student_question)
-            response_text = self._generate_response(prompt)
+            try:
+                response_text = self._generate_response(prompt, task='question')
+            except BudgetExceeded:
+                return {
+                    "chapter": chapter_name,
+                    "mode": "question",
+                    "response": extract_answer(student_question, chapter_data) or "This is outside the syllabus.",
+                    "degraded": "budget"
+                }
             
             if "outside the syllabus" in response_text.lower() or "not found" in response_text.lower():
                 return {
@@ -154,102 +160,124 @@ Provide your answer:"""
                 "response": response_text
             }
         else:
-            prompt = self._build_teaching_prompt(chapter_data)
-            response_text = self._generate_response(prompt)
-            
             return {
                 "chapter": chapter_name,
                 "mode": "teaching",
-                "response": response_text
+                "response": self.teach_explanation(chapter_data)
             }
+    
+    def _build_followup_prompt(self, chapter_data: Dict, session: Dict, student_question: str, excerpts: List[str]) -> str:
+        chapter_name = chapter_data.get('chapter', '')
+        excerpt_text = "\n\n".join(excerpts) if excerpts else "(none)"
+        
+        prompt = f"""You are an O-Level Chemistry tutor continuing a conversation about {chapter_name}.
 
-def tutor_response(chapter_name: str, student_question: Optional[str] = None) -> Dict:
-    service = TutorService()
-    return service.tutor_response(chapter_name, student_question)
+{render_history(session)}
 
-def _extract_keywords(question: str) -> List[str]:
-    question_lower = question.lower()
-    stop_words = {'what', 'is', 'are', 'the', 'a', 'an', 'how', 'why', 'when', 'where', 'which', 'who', 'does', 'do', 'can', 'could', 'will', 'would', 'should', 'this', 'that', 'these', 'those', 'to', 'from', 'in', 'on', 'at', 'by', 'for', 'with', 'about', 'into', 'onto', 'of', 'and', 'or', 'but', 'if', 'then', 'than', 'as', 'be', 'been', 'being', 'have', 'has', 'had', 'was', 'were', 'been', 'being', 'question', 'questions'}
-    words = re.findall(r'\b\w+\b', question_lower)
-    keywords = [w for w in words if len(w) > 2 and w not in stop_words]
-    return keywords
+RELEVANT SOURCE EXCERPTS:
+{excerpt_text}
 
-def _find_relevant_sections(text: str, keywords: List[str]) -> List[Tuple[str, int]]:
-    if not text or not keywords:
-        return []
-    
-    text_lower = text.lower()
-    sentences = re.split(r'[.!?]\s+', text)
-    relevant_sections = []
+STUDENT'S FOLLOW-UP QUESTION:
+{student_question}
+
+RULES:
+1. Answer ONLY using the excerpts above and what was already covered in this session
+2. If the question cannot be answered from these, respond with: "This is outside the syllabus."
+3. Be clear, step-by-step, and exam-focused
+4. Keep it consistent with your earlier answers
+
+Provide your answer:"""
+        
+        return prompt
     
-    for sentence in sentences:
-        if not sentence.strip():
-            continue
+    def session_response(self, chapter_name: str, student_question: str, user_id: str,
+                         session_id: Optional[str] = None) -> Dict:
+        """
+        Answer within a tutor session owned by user_id. The first turn sends the
+        full chapter sources; follow-ups send only the bounded history and the
+        best-matching source chunks.
+        """
+        store = get_session_store()
+        session = store.get(session_id, user_id) if session_id else None
+        
+        chapter_data = build_ai_context(chapter_name)
+        if "error" in chapter_data:
+            return {
+                "chapter": chapter_name,
+                "mode": "error",
+                "response": chapter_data["error"]
+            }
         
-        sentence_lower = sentence.lower()
-        keyword_matches = sum(1 for keyword in keywords if keyword in sentence_lower)
-        relevance_score = keyword_matches / len(keywords) if keywords else 0
+        if session is None or session["chapter"] != chapter_name:
+            session = new_session(chapter_name, chapter_data["content_hash"], user_id)
         
-        if relevance_score > 0:
-            relevant_sections.append((sentence.strip(), relevance_score))
-    
-    relevant_sections.sort(key=lambda x: x[1], reverse=True)
-    return relevant_sections[:5]
-
-def _extract_answer_from_content(question: str, chapter_data: Dict) -> Optional[str]:
-    syllabus = chapter_data.get('syllabus', '')
-    past_paper_text = chapter_data.get('past_paper_text', '')
-    answer_key_text = chapter_data.get('answer_key_text', '')
-    
-    all_content = {
-        'syllabus': syllabus,
-        'past_papers': past_paper_text,
-        'answer_key': answer_key_text
-    }
-    
-    keywords = _extract_keywords(question)
-    if not keywords:
-        return None
-    
-    combined_sections = []
-    for source_name, source_text in all_content.items():
-        if not source_text:
-            continue
+        degraded = None
+        keyed_answer = lookup_answer(chapter_data.get('answer_key_index', {}), student_question)
+        if keyed_answer:
+            response_text = _format_keyed_answer(*keyed_answer)
+        else:
+            # Follow-ups like "why?" lean on the previous question for relevance
+            previous = session["turns"][-1]["question"] if session["turns"] else ""
+            chunks = relevant_chunks(f"{student_question} {previous}".strip(), chapter_data)
+            if not chunks:
+                response_text = "This is outside the syllabus."
+            else:
+                if session["turn_count"] == 0:
+                    prompt = self._build_question_prompt(chapter_data, student_question)
+                else:
+                    prompt = self._build_followup_prompt(chapter_data, session, student_question, [chunk["text"] for _, chunk in chunks])
+                try:
+                    response_text = self._generate_response(prompt, task='question')
+                except BudgetExceeded:
+                    degraded = "budget"
+                    response_text = extract_answer(student_question, chapter_data) or "This is outside the syllabus."
+                if "outside the syllabus" in response_text.lower():
+                    response_text = "This is outside the syllabus."
+        
+        add_turn(session, student_question, response_text)
+        store.save(session)
         
-        sections = _find_relevant_sections(source_text, keywords)
-        for section, score in sections:
-            combined_sections.append((section, score, source_name))
-    
-    if not combined_sections:
-        return None
-    
-    combined_sections.sort(key=lambda x: x[1], reverse=True)
-    top_sections = [section for section, _, _ in combined_sections[:3]]
-    
-    if top_sections:
-        answer = ' '.join(top_sections)
-        answer = re.sub(r'\s+', ' ', answer).strip()
-        if len(answer) > 50:
-            return answer
-        elif len(answer) > 20:
-            return answer
-    
-    question_lower = question.lower()
-    for source_name, source_text in all_content.items():
-        if not source_text:
-            continue
+        result = {
+            "chapter": chapter_name,
+            "mode": "question",
+            "response": response_text,
+            "session_id": session["session_id"],
+            "turn": session["turn_count"]
+        }
+        if degraded:
+            result["degraded"] = degraded
+        return result
+    
+    def teach_explanation(self, chapter_data: Dict) -> str:
+        """Chapter explanation, generated once per version of the chapter content"""
+        cache = get_cache('teach')
+        cached = cache.get(chapter_data['content_hash'])
+        if cached:
+            return cached
         
-        source_lower = source_text.lower()
-        for keyword in keywords:
-            if keyword in source_lower:
-                keyword_index = source_lower.find(keyword)
-                start = max(0, keyword_index - 100)
-                end = min(len(source_text), keyword_index + len(keyword) + 200)
-                excerpt = source_text[start:end].strip()
-                if len(excerpt) > 30:
-                    return excerpt
-    
-    return None
+        prompt = self._build_teaching_prompt(chapter_data)
+        try:
+            response_text = self._generate_response(prompt, task='teach')
+        except BudgetExceeded:
+            # Not cached: the full explanation is generated once the budget allows
+            syllabus = (chapter_data.get('syllabus') or '').strip()
+            return f"Chapter syllabus for {chapter_data.get('chapter', '')}:\n\n{syllabus}" if syllabus \
+                else "Explanations are temporarily unavailable. Please try again later."
+        if not response_text.startswith("Error generating response"):
+            cache.set(chapter_data['content_hash'], response_text)
+        return response_text
+
+def _format_keyed_answer(question_id: str, answer: str) -> str:
+    return f"Answer to past paper question {question_id} (from the answer key): {answer}"
+
+def tutor_response(chapter_name: str, student_question: Optional[str] = None) -> Dict:
+    service = TutorService()
+    return service.tutor_response(chapter_name, student_question)
+
+def extract_answer(question: str, chapter_data: Dict) -> str:
+    """Top chunks from the chapter's TF-IDF index; empty when none is above the threshold (out of syllabus)"""
+    chunks = relevant_chunks(question, chapter_data, top_k=2)
+    return re.sub(r'\s+', ' ', ' '.join(chunk["text"] for _, chunk in chunks))
 
 def answer_question(chapter_name: str, question: str) -> Dict:
     chapter_data = build_ai_context(chapter_name)
@@ -268,7 +296,15 @@ def answer_question(chapter_name: str, question: str) -> Dict:
             "answer": "This question is outside the syllabus."
         }
     
-    answer = _extract_answer_from_content(question, chapter_data)
+    keyed_answer = lookup_answer(chapter_data.get('answer_key_index', {}), question)
+    if keyed_answer:
+        return {
+            "chapter": chapter_name,
+            "question": question,
+            "answer": _format_keyed_answer(*keyed_answer)
+        }
+    
+    answer = extract_answer(question, chapter_data)
     
     if not answer:
         return {
@@ -349,7 +385,23 @@ Generate {count} {difficulty} difficulty MCQs. Return JSON only, no other text."
 
     return prompt
 
-def generate_mcqs(chapter_name: str, difficulty: str = "medium", count: int = 5) -> Dict:
+def _budget_mcqs(chapter_name: str, difficulty: str, count: int, pool: List[Dict], reason: str) -> Dict:
+    """Over the token budget: whatever the pool holds, else real past-paper items"""
+    source = "generated"
+    if pool:
+        mcqs = random.sample(pool, min(count, len(pool)))
+    else:
+        mcqs, source = items_to_mcqs(draw_mcq_items(chapter_name, count)), "past_paper"
+    result = {"chapter": chapter_name, "difficulty": difficulty, "source": source, "mcqs": mcqs, "degraded": "budget"}
+    if not mcqs:
+        result["error"] = reason
+    return result
+
+def mcq_pool_key(chapter_data: Dict, difficulty: str) -> str:
+    return f"{chapter_data['content_hash']}:{difficulty.lower()}"
+
+def generate_mcqs(chapter_name: str, difficulty: str = "medium", count: int = 5, source: str = "generated",
+                  use_pool: bool = True) -> Dict:
     valid_difficulties = ['easy', 'medium', 'hard']
     if difficulty.lower() not in valid_difficulties:
         difficulty = 'medium'
@@ -379,10 +431,35 @@ def generate_mcqs(chapter_name: str, difficulty: str = "medium", count: int = 5)
             "error": "No chapter content available"
         }
     
+    if source == "past_paper":
+        items = draw_mcq_items(chapter_name, count)
+        if items:
+            return {
+                "chapter": chapter_name,
+                "difficulty": difficulty,
+                "source": "past_paper",
+                "mcqs": items_to_mcqs(items)
+            }
+    
+    # Once a chapter's pool is full, serve a sample of it instead of calling the model
+    cache = get_cache('mcq_pool')
+    pool_key = mcq_pool_key(chapter_data, difficulty)
+    if use_pool and MCQ_POOL_SIZE:
+        pool = cache.get(pool_key) or []
+        if len(pool) >= MCQ_POOL_SIZE and count <= len(pool):
+            return {
+                "chapter": chapter_name,
+                "difficulty": difficulty,
+                "mcqs": random.sample(pool, count)
+            }
+    
     try:
         service = TutorService()
         prompt = _build_mcq_prompt(chapter_data, difficulty, count)
-        response = service._generate_response(prompt)
+        try:
+            response = service._generate_response(prompt, task='mcq')
+        except BudgetExceeded as e:
+            return _budget_mcqs(chapter_name, difficulty, count, cache.get(pool_key) or [], str(e))
         
         response_text = response.strip()
         
@@ -414,6 +491,9 @@ def generate_mcqs(chapter_name: str, difficulty: str = "medium", count: int = 5)
             if "explanation" not in mcq:
                 mcq["explanation"] = "Explanation not provided"
         
+        if mcqs and MCQ_POOL_SIZE:
+            cache.extend(pool_key, mcqs, max_length=MCQ_POOL_SIZE)
+        
         return {
             "chapter": chapter_name,
             "difficulty": difficulty,
@@ -447,101 +527,154 @@ def ai_tutor_controller(input_data: Dict) -> Dict:
     
     chapter = input_data.get("chapter", "").strip()
     mode = input_data.get("mode", "").strip().lower()
+    routes = []
     
     if not chapter:
+        # Route free-form questions (or a topic for teach/mcq) to the best-matching chapter
+        text = (input_data.get("question") or input_data.get("topic") or "").strip()
+        if not text:
+            return {
+                "status": "error",
+                "mode": mode,
+                "chapter": "",
+                "data": {},
+                "error": "Chapter name is required"
+            }
+        routes = route_question(text)
+        if not routes:
+            return {
+                "status": "error",
+                "mode": mode,
+                "chapter": "",
+                "data": {},
+                "error": "Could not match the question to a chapter"
+            }
+        chapter = routes[0]["chapter"]
+    
+    if mode not in ["teach", "question", "mcq"]:
         return {
             "status": "error",
             "mode": mode,
-            "chapter": "",
+            "chapter": chapter,
             "data": {},
-            "error": "Chapter name is required"
+            "error": f"Invalid mode: '{mode}'. Must be 'teach', 'question', or 'mcq'"
         }
     
-    if mode not in ["teach", "question", "mcq"]:
+    try:
+        response = _run_mode(mode, chapter, input_data)
+        if routes:
+            response["routed_chapters"] = routes
+        return response
+    except Exception as e:
         return {
             "status": "error",
             "mode": mode,
             "chapter": chapter,
             "data": {},
-            "error": f"Invalid mode: '{mode}'. Must be 'teach', 'question', or 'mcq'"
+            "error": f"Error processing request: {str(e)}"
+        }
+
+def _run_mode(mode: str, chapter: str, input_data: Dict) -> Dict:
+    if mode == "teach":
+        result = tutor_response(chapter)
+        return {
+            "status": "success",
+            "mode": "teach",
+            "chapter": chapter,
+            "data": {
+                "response": result.get("response", ""),
+                "mode": result.get("mode", "teaching")
+            }
         }
     
-    try:
-        if mode == "teach":
-            result = tutor_response(chapter)
+    elif mode == "question":
+        question = input_data.get("question", "").strip()
+        if not question:
             return {
-                "status": "success",
-                "mode": "teach",
+                "status": "error",
+                "mode": "question",
                 "chapter": chapter,
-                "data": {
-                    "response": result.get("response", ""),
-                    "mode": result.get("mode", "teaching")
-                }
+                "data": {},
+                "error": "Question is required for question mode"
             }
         
-        elif mode == "question":
-            question = input_data.get("question", "").strip()
-            if not question:
+        if input_data.get("session_id") or input_data.get("session"):
+            if not input_data.get("user_id"):
                 return {
                     "status": "error",
                     "mode": "question",
                     "chapter": chapter,
                     "data": {},
-                    "error": "Question is required for question mode"
+                    "error": "user_id is required for tutor sessions"
+                }
+            result = TutorService().session_response(chapter, question, input_data["user_id"], input_data.get("session_id"))
+            if result.get("mode") == "error":
+                return {
+                    "status": "error",
+                    "mode": "question",
+                    "chapter": chapter,
+                    "data": {},
+                    "error": result.get("response", "")
                 }
-            
-            result = answer_question(chapter, question)
             return {
                 "status": "success",
                 "mode": "question",
                 "chapter": chapter,
                 "data": {
-                    "question": result.get("question", ""),
-                    "answer": result.get("answer", "")
+                    "question": question,
+                    "answer": result.get("response", ""),
+                    "session_id": result["session_id"],
+                    "turn": result["turn"],
+                    **({"degraded": result["degraded"]} if result.get("degraded") else {})
                 }
             }
         
-        elif mode == "mcq":
-            difficulty = input_data.get("difficulty", "medium").strip().lower()
-            if difficulty not in ["easy", "medium", "hard"]:
-                difficulty = "medium"
-            
-            mcq_count = input_data.get("mcq_count", 5)
-            try:
-                mcq_count = int(mcq_count)
-                if mcq_count < 1 or mcq_count > 20:
-                    mcq_count = 5
-            except (ValueError, TypeError):
+        result = answer_question(chapter, question)
+        return {
+            "status": "success",
+            "mode": "question",
+            "chapter": chapter,
+            "data": {
+                "question": result.get("question", ""),
+                "answer": result.get("answer", "")
+            }
+        }
+    
+    elif mode == "mcq":
+        difficulty = input_data.get("difficulty", "medium").strip().lower()
+        if difficulty not in ["easy", "medium", "hard"]:
+            difficulty = "medium"
+        
+        mcq_count = input_data.get("mcq_count", 5)
+        try:
+            mcq_count = int(mcq_count)
+            if mcq_count < 1 or mcq_count > 20:
                 mcq_count = 5
-            
-            result = generate_mcqs(chapter, difficulty, mcq_count)
-            
-            if "error" in result:
-                return {
-                    "status": "error",
-                    "mode": "mcq",
-                    "chapter": chapter,
-                    "data": {},
-                    "error": result.get("error", "Unknown error generating MCQs")
-                }
-            
+        except (ValueError, TypeError):
+            mcq_count = 5
+        
+        source = input_data.get("source", "generated").strip().lower()
+        result = generate_mcqs(chapter, difficulty, mcq_count, source)
+        
+        if "error" in result:
             return {
-                "status": "success",
+                "status": "error",
                 "mode": "mcq",
                 "chapter": chapter,
-                "data": {
-                    "difficulty": result.get("difficulty", difficulty),
-                    "mcqs": result.get("mcqs", [])
-                }
+                "data": {},
+                "error": result.get("error", "Unknown error generating MCQs")
             }
-    
-    except Exception as e:
+        
         return {
-            "status": "error",
-            "mode": mode,
+            "status": "success",
+            "mode": "mcq",
             "chapter": chapter,
-            "data": {},
-            "error": f"Error processing request: {str(e)}"
+            "data": {
+                "difficulty": result.get("difficulty", difficulty),
+                "source": result.get("source", "generated"),
+                "mcqs": result.get("mcqs", []),
+                **({"degraded": result["degraded"]} if result.get("degraded") else {})
+            }
         }
 
 if __name__ == "__main__":
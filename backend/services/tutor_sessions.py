@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from services.local_store import DEFAULT_CACHE_DIR, SQLiteFile
+
+SESSION_TTL_SECONDS = float(os.getenv('TUTOR_SESSION_TTL_SECONDS', '1800'))
+SESSION_HISTORY_TOKENS = int(os.getenv('TUTOR_SESSION_HISTORY_TOKENS', '1200'))
+SESSION_SUMMARY_TOKENS = int(os.getenv('TUTOR_SESSION_SUMMARY_TOKENS', '400'))
+SESSION_STORE_MAX_BYTES = int(os.getenv('TUTOR_SESSION_STORE_MAX_BYTES', str(50 * 1024 * 1024)))
+
+_FIRST_SENTENCE = re.compile(r'^(.+?[.!?])(?:\s|$)', re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting"""
+    return max(1, len(text or '') // 4)
+
+
+def new_session(chapter: str, content_hash: str, user_id: str) -> Dict:
+    now = time.time()
+    return {
+        "session_id": uuid.uuid4().hex,
+        "user_id": user_id,
+        "chapter": chapter,
+        "content_hash": content_hash,
+        "summary": [],
+        "turns": [],
+        "turn_count": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def _summarize_turn(turn: Dict) -> str:
+    """One line per folded turn: the question and the gist of the answer"""
+    question = re.sub(r'\s+', ' ', turn["question"]).strip()[:160]
+    answer = re.sub(r'\s+', ' ', turn["answer"]).strip()
+    match = _FIRST_SENTENCE.match(answer)
+    gist = (match.group(1) if match else answer)[:220]
+    return f"Student asked: {question} | Tutor explained: {gist}"
+
+
+def history_tokens(session: Dict) -> int:
+    return sum(estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"]) for turn in session["turns"])
+
+
+def add_turn(session: Dict, question: str, answer: str):
+    """
+    Append an exchange, then fold the oldest turns into the summary until the
+    verbatim history fits its token budget. The summary is bounded too: its
+    oldest lines are dropped first.
+    """
+    session["turns"].append({"question": question, "answer": answer})
+    session["turn_count"] += 1
+    session["updated_at"] = time.time()
+
+    while len(session["turns"]) > 1 and history_tokens(session) > SESSION_HISTORY_TOKENS:
+        session["summary"].append(_summarize_turn(session["turns"].pop(0)))
+    while session["summary"] and sum(estimate_tokens(line) for line in session["summary"]) > SESSION_SUMMARY_TOKENS:
+        session["summary"].pop(0)
+
+
+def render_history(session: Dict) -> str:
+    parts = []
+    if session["summary"]:
+        parts.append("EARLIER IN THIS SESSION (summary):\n" + "\n".join(f"- {line}" for line in session["summary"]))
+    if session["turns"]:
+        parts.append("RECENT EXCHANGES:\n" + "\n\n".join(
+            f"Student: {turn['question']}\nTutor: {turn['answer']}" for turn in session["turns"]
+        ))
+    return "\n\n".join(parts)
+
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        bytes INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)',
+]
+
+
+class SessionStore:
+    """
+    Tutor sessions shared by all workers on a host. Sessions expire after
+    SESSION_TTL_SECONDS of inactivity; when the store outgrows its byte
+    budget the least recently used sessions are evicted.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = SESSION_STORE_MAX_BYTES,
+                 ttl: float = SESSION_TTL_SECONDS):
+        self.path = path or os.getenv('TUTOR_SESSION_PATH') or os.path.join(DEFAULT_CACHE_DIR, 'tutor_sessions.sqlite3')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._db = SQLiteFile(self.path, _SCHEMA)
+
+    def _connect(self):
+        return self._db.connect()
+
+    def get(self, session_id: str, user_id: str) -> Optional[Dict]:
+        """The live session, or None if it expired or belongs to another student"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT payload FROM sessions WHERE session_id = ? AND expires_at > ?',
+                (session_id, time.time())
+            ).fetchone()
+        session = json.loads(row[0]) if row else None
+        return session if session and session.get("user_id") == user_id else None
+
+    def save(self, session: Dict):
+        payload = json.dumps(session)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)',
+                    (session["session_id"], payload, len(payload), now + self.ttl, now)
+                )
+                conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,))
+                total = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM sessions').fetchone()[0]
+                if total > self.max_bytes:
+                    self.evictions += self._evict(conn, total - self.max_bytes)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _evict(conn: sqlite3.Connection, excess: int) -> int:
+        victims: List[str] = []
+        freed = 0
+        for session_id, size in conn.execute('SELECT session_id, bytes FROM sessions ORDER BY updated_at'):
+            if freed >= excess:
+                break
+            victims.append(session_id)
+            freed += size
+        conn.executemany('DELETE FROM sessions WHERE session_id = ?', [(v,) for v in victims])
+        return len(victims)
+
+    def delete(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def stats(self) -> Dict:
+        with self._connect() as conn:
+            count, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions WHERE expires_at > ?', (time.time(),)
+            ).fetchone()
+        return {"sessions": count, "bytes": size, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+        return _store
@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy import sparse
+from services.local_store import DEFAULT_CACHE_DIR
+from services.cache import content_key
+
+HASH_DIMS = int(os.getenv('VECTOR_INDEX_DIMS', str(2 ** 18)))
+CHUNK_WORDS = int(os.getenv('VECTOR_INDEX_CHUNK_WORDS', '60'))
+MIN_RELEVANCE = float(os.getenv('RELEVANCE_MIN_SCORE', '0.08'))
+SOURCES = [('syllabus', 'syllabus'), ('past_paper_text', 'past_papers'), ('answer_key_text', 'answer_key')]
+
+STOP_WORDS = {
+    'what', 'is', 'are', 'the', 'a', 'an', 'how', 'why', 'when', 'where', 'which', 'who', 'does', 'do', 'can',
+    'could', 'will', 'would', 'should', 'this', 'that', 'these', 'those', 'to', 'from', 'in', 'on', 'at', 'by',
+    'for', 'with', 'about', 'into', 'onto', 'of', 'and', 'or', 'but', 'if', 'then', 'than', 'as', 'be', 'been',
+    'being', 'have', 'has', 'had', 'was', 'were', 'it', 'its', 'me', 'my', 'i', 'you', 'your', 'we', 'our',
+    'explain', 'tell', 'please', 'question', 'questions', 'mean', 'means', 'give'
+}
+
+_TOKEN = re.compile(r'[a-z0-9]+(?:[+-][a-z0-9]*)?')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOP_WORDS and len(token) > 1]
+
+
+def _features(tokens: List[str]) -> List[int]:
+    """Hashed unigrams and bigrams; bigrams keep 'limiting reagent' apart from 'reagent' alone"""
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return [zlib.crc32(gram.encode('utf-8')) % HASH_DIMS for gram in grams]
+
+
+def chunk_text(text: str, max_words: int = CHUNK_WORDS) -> List[str]:
+    """Pack sentences into chunks of up to max_words; over-long sentences are split by words"""
+    chunks, current = [], []
+    for sentence in _SENTENCE_BREAK.split(text or ''):
+        words = sentence.split()
+        while len(words) > max_words:
+            if current:
+                chunks.append(' '.join(current))
+                current = []
+            chunks.append(' '.join(words[:max_words]))
+            words = words[max_words:]
+        if current and len(current) + len(words) > max_words:
+            chunks.append(' '.join(current))
+            current = []
+        current.extend(words)
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+class ChunkIndex:
+    """
+    Hashed TF-IDF over fixed-size chunks of a chapter's sources. Rows are
+    L2-normalised sparse vectors, so one sparse matrix-vector product gives
+    the cosine similarity of a question against every chunk.
+    """
+
+    def __init__(self, chunks: List[Dict], matrix: sparse.csr_matrix, idf: np.ndarray):
+        self.chunks = chunks
+        self.matrix = matrix
+        self.idf = idf
+
+    @classmethod
+    def build(cls, chapter_data: Dict) -> 'ChunkIndex':
+        chunks = [
+            {"source": source, "text": chunk}
+            for field, source in SOURCES
+            for chunk in chunk_text(chapter_data.get(field, ''))
+        ]
+        rows, cols, counts = [], [], []
+        for row, chunk in enumerate(chunks):
+            features, freq = np.unique(_features(tokenize(chunk["text"])), return_counts=True)
+            rows.extend([row] * len(features))
+            cols.extend(features.tolist())
+            counts.extend(freq.tolist())
+
+        tf = sparse.csr_matrix(
+            (1 + np.log(np.asarray(counts, dtype=np.float64)), (rows, cols)),
+            shape=(len(chunks), HASH_DIMS)
+        )
+        df = np.bincount(np.asarray(cols, dtype=np.int64), minlength=HASH_DIMS)
+        idf = (np.log((1 + len(chunks)) / (1 + df)) + 1).astype(np.float32)
+        matrix = tf.multiply(idf).tocsr()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        return cls(chunks, matrix.astype(np.float32).tocsr(), idf)
+
+    def _query_vector(self, question: str) -> Optional[sparse.csr_matrix]:
+        features, freq = np.unique(_features(tokenize(question)), return_counts=True)
+        if not len(features):
+            return None
+        weights = (1 + np.log(freq)) * self.idf[features]
+        weights /= np.linalg.norm(weights) or 1
+        return sparse.csr_matrix((weights, (np.zeros(len(features), dtype=np.int64), features)), shape=(1, HASH_DIMS))
+
+    def search(self, question: str, top_k: int = 5, min_score: float = 0.0) -> List[Tuple[float, Dict]]:
+        """Best-matching chunks for a question, highest cosine similarity first"""
+        query = self._query_vector(question)
+        if query is None or not self.chunks:
+            return []
+        scores = (self.matrix @ query.T).toarray().ravel()
+        top = np.argsort(-scores)[:top_k]
+        return [(float(scores[idx]), self.chunks[idx]) for idx in top if scores[idx] > min_score]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+            shape=np.asarray(self.matrix.shape), idf=self.idf, chunks=np.asarray(json.dumps(self.chunks))
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ChunkIndex':
+        with np.load(path) as saved:
+            matrix = sparse.csr_matrix((saved['data'], saved['indices'], saved['indptr']), shape=tuple(saved['shape']))
+            return cls(json.loads(str(saved['chunks'])), matrix, saved['idf'])
+
+
+def _index_dir() -> str:
+    return os.getenv('VECTOR_INDEX_DIR') or os.path.join(DEFAULT_CACHE_DIR, 'indexes')
+
+
+def _prune_stale_indexes(directory: str, chapter_prefix: str, current: str):
+    """
+    Delete this chapter's index files for older content, and files from before
+    names carried the chapter. Other processes' in-progress .tmp files are left alone.
+    """
+    stale = re.compile(rf'^(?:{chapter_prefix}-)?[0-9a-f]+\.npz$')
+    for name in os.listdir(directory):
+        if name != current and stale.match(name):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+_indexes: 'OrderedDict[str, ChunkIndex]' = OrderedDict()
+_indexes_lock = threading.Lock()
+_MAX_INDEXES = 32
+
+
+def get_chapter_index(chapter_data: Dict) -> ChunkIndex:
+    """Index for this version of the chapter content: memory, then disk, then built"""
+    key = chapter_data['content_hash']
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+
+    # Named by chapter too, so a new version of the content can replace the old file
+    chapter_prefix = content_key(chapter_data.get('chapter', ''))[:12]
+    directory = _index_dir()
+    filename = f"{chapter_prefix}-{key}.npz"
+    path = os.path.join(directory, filename)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = ChunkIndex.load(path)
+        except Exception as e:
+            print(f"Error loading vector index {path}: {e}")
+    if index is None:
+        index = ChunkIndex.build(chapter_data)
+        index.save(path)
+        _prune_stale_indexes(directory, chapter_prefix, filename)
+
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > _MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def relevant_chunks(question: str, chapter_data: Dict, top_k: int = 3) -> List[Tuple[float, Dict]]:
+    """Chunks relevant enough to answer from; empty means the question is outside the sources"""
+    return get_chapter_index(chapter_data).search(question, top_k=top_k, min_score=MIN_RELEVANCE)
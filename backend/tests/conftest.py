@@ -0,0 +1,15 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def seed_failing_first_call():
+    """Finds a seed whose first roll injects a fault at error_rate and whose second does not"""
+    def find(error_rate: float) -> int:
+        for seed in range(1000):
+            rng = random.Random(seed)
+            if rng.random() < error_rate <= rng.random():
+                return seed
+        raise AssertionError("no seed found")
+    return find
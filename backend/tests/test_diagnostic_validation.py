@@ -0,0 +1,48 @@
+import pytest
+
+from services.diagnostic_validation import check_item, repair_diagnostic
+
+
+def make_items(answer):
+    topics = ["atoms", "moles", "bonding", "electrolysis", "equilibrium", "salts"]
+    items = []
+    for idx, bucket in enumerate(["Basic", "Basic", "Conceptual", "Conceptual", "Application", "Application"]):
+        items.append({
+            "bucket": bucket,
+            "question": f"Which statement about {topics[idx]} is correct for question {idx + 1}?",
+            "type": "MCQ",
+            "options": [f"{topics[idx]} option {letter}" for letter in "ABCD"],
+            "answer": "ABCD"[idx % 4],
+            "marks": 1
+        })
+    items[0]["answer"] = answer
+    return items
+
+
+def no_replacements(buckets, existing):
+    return []
+
+
+@pytest.mark.parametrize("answer", ["", None, "BC", "b", "ABCD", 1])
+def test_check_item_rejects_answers_that_are_not_one_letter(answer):
+    item = make_items(answer)[0]
+    assert "answer is not one of A-D" in check_item(item, [])
+
+
+@pytest.mark.parametrize("answer", ["", None, "BC"])
+def test_repair_drops_items_with_invalid_answers(answer):
+    items, summary = repair_diagnostic(make_items(answer), no_replacements)
+
+    assert summary["failed_checks"] == 1
+    assert summary["items_dropped"] == 1
+    assert summary["valid"] is False
+    assert all(item["answer"] in ("A", "B", "C", "D") for item in items)
+
+
+def test_repair_fixes_lowercase_answer_locally():
+    items, summary = repair_diagnostic(make_items("b"), no_replacements)
+
+    assert items[0]["answer"] == "B"
+    assert summary["repaired_locally"] == 1
+    assert summary["llm_calls"] == 0
+    assert summary["valid"] is True
@@ -0,0 +1,60 @@
+import pytest
+
+from services.item_analysis import ItemAnalysis
+
+KEYS = ["k1", "k2", "k3", "k4"]
+BUCKETS = ["Basic", "Basic", "Conceptual", "Application"]
+SHEETS = [
+    [True, True, True, False],
+    [True, True, False, False],
+    [True, False, False, False],
+    [False, False, False, True],
+    [True, True, True, True],
+    [False, True, False, False],
+]
+
+
+@pytest.fixture
+def analysis(tmp_path):
+    return ItemAnalysis(path=str(tmp_path / 'item_analysis.sqlite3'))
+
+
+def record(analysis, diagnostic_id, correctness, keys=KEYS):
+    analysis.record_submission(diagnostic_id, "Moles", keys, correctness, BUCKETS, {"Basic": True})
+
+
+def test_rows_serving_the_same_form_pool_their_responses(analysis):
+    for idx, sheet in enumerate(SHEETS):
+        record(analysis, f"diagnostic-{idx}", sheet)
+
+    stats = analysis.item_statistics("diagnostic-0")
+    assert stats["responses"] == len(SHEETS)
+    assert stats == {**analysis.item_statistics("diagnostic-5"), "diagnostic_id": "diagnostic-0"}
+    assert any(item["discrimination"] is not None for item in stats["items"])
+    assert analysis.chapter_statistics("Moles")["forms"] == 1
+
+
+def test_weak_items_found_across_student_rows(analysis):
+    for idx, sheet in enumerate(SHEETS):
+        record(analysis, f"diagnostic-{idx}", sheet)
+
+    weak = analysis.weak_items(chapter="Moles", max_p=0.4, min_responses=5)
+    assert weak
+    assert {item["question_id"] for item in weak} >= {"3"}
+    assert all(item["responses"] == len(SHEETS) for item in weak)
+
+
+def test_different_forms_stay_apart(analysis):
+    record(analysis, "a", SHEETS[0])
+    record(analysis, "b", SHEETS[1], keys=["k1", "k2", "k3", "k5"])
+
+    assert analysis.item_statistics("a")["responses"] == 1
+    assert analysis.chapter_statistics("Moles")["forms"] == 2
+
+
+def test_mismatched_sheet_is_rejected(analysis):
+    record(analysis, "a", SHEETS[0])
+
+    with pytest.raises(ValueError):
+        record(analysis, "b", SHEETS[0][:3])
+    assert analysis.item_statistics("a")["responses"] == 1
@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+from services.llm_gateway import LLMGateway, StubBackend
+from services.llm_ledger import LlmLedger, llm_context
+from services.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+from services.stub_model import InjectedFault
+
+
+def make_gateway(tmp_path, caller_options=None, **fault_options) -> LLMGateway:
+    """A stub-backed gateway whose callers (one per task and model) are kept in gateway.callers"""
+    options = {'timeout': 1.0, 'sleep': lambda seconds: None, **(caller_options or {})}
+    callers = {}
+
+    def caller_for(name: str) -> ResilientCaller:
+        return callers.setdefault(name, ResilientCaller(name, **options))
+
+    gateway = LLMGateway(backend=StubBackend(**fault_options), caller_for=caller_for)
+    gateway.ledger = LlmLedger(path=str(tmp_path / 'ledger.sqlite3'), user_daily_tokens=0, global_daily_tokens=0)
+    gateway.callers = callers
+    return gateway
+
+
+def ledger_rows(gateway: LLMGateway):
+    with gateway.ledger._connect() as conn:
+        return [dict(row) for row in conn.execute('SELECT * FROM llm_calls ORDER BY id')]
+
+
+def test_each_retry_is_a_ledger_row(tmp_path, seed_failing_first_call):
+    gateway = make_gateway(tmp_path, error_rate=0.5, seed=seed_failing_first_call(0.5))
+
+    with llm_context(route='test', user_id='student-1'):
+        text = gateway.generate("Explain moles", task='question')
+
+    assert text
+    rows = ledger_rows(gateway)
+    assert [row['status'] for row in rows] == ['error', 'ok']
+    assert rows[1]['output_tokens'] > 0
+    assert all(row['user_id'] == 'student-1' and row['route'] == 'test' for row in rows)
+
+
+def test_hedged_duplicate_is_a_ledger_row(tmp_path):
+    gateway = make_gateway(tmp_path, caller_options={'hedge_percentile': 50, 'hedge_min_samples': 1},
+                           latency=0.3)
+    caller = gateway.caller_for('question:stub:' + gateway.route('question').model)
+    caller.latency.record(0.05)
+    recorded = threading.Semaphore(0)
+    record = gateway.ledger.record
+
+    def record_and_signal(*args, **kwargs):
+        record(*args, **kwargs)
+        recorded.release()
+
+    gateway.ledger.record = record_and_signal
+    gateway.generate("Explain moles", task='question')
+    # The losing attempt is recorded when it finishes, after generate returns
+    assert all(recorded.acquire(timeout=5) for _ in range(2))
+
+    rows = ledger_rows(gateway)
+    assert caller.stats()['hedges'] == 1
+    assert [row['status'] for row in rows] == ['ok', 'ok']
+
+
+def test_short_circuited_call_is_a_ledger_row(tmp_path):
+    gateway = make_gateway(tmp_path, caller_options={'max_retries': 0,
+                                                     'breaker': CircuitBreaker(failure_threshold=1, reset_timeout=60)},
+                           error_rate=1.0)
+
+    with pytest.raises(InjectedFault):
+        gateway.generate("Explain moles", task='question')
+    with pytest.raises(CircuitOpenError):
+        gateway.generate("Explain moles", task='question')
+
+    assert [row['status'] for row in ledger_rows(gateway)] == ['error', 'error']
+
+
+def test_open_breaker_is_scoped_to_its_task(tmp_path):
+    gateway = make_gateway(tmp_path, caller_options={'max_retries': 0}, error_rate=1.0)
+    gateway.caller_for = lambda name: gateway.callers.setdefault(name, ResilientCaller(
+        name, timeout=1.0, max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60)))
+
+    with pytest.raises(InjectedFault):
+        gateway.generate("Explain moles", task='question')
+    with pytest.raises(CircuitOpenError):
+        gateway.generate("Explain moles", task='question')
+    # Another task still reaches the model
+    with pytest.raises(InjectedFault):
+        gateway.generate("Explain moles", task='teach')
+
+
+def test_stub_answers_by_task_not_prompt_wording(tmp_path):
+    gateway = make_gateway(tmp_path)
+
+    revision = json.loads(gateway.generate("Revise weeks 2-3 of the plan", task='roadmap'))
+
+    assert revision["updated_weeks"] and revision["weekly_roadmap"]
+    assert json.loads(gateway.generate("Write a test", task='diagnostic'))["diagnostic_test"]
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from services.resilience import CallTimeoutError, CircuitBreaker, CircuitOpenError, ResilientCaller
+from services.stub_model import FaultInjectingModel, InjectedFault
+
+
+def make_caller(**options) -> ResilientCaller:
+    options.setdefault('timeout', 1.0)
+    options.setdefault('sleep', lambda seconds: None)
+    return ResilientCaller('test', **options)
+
+
+def test_hung_call_times_out():
+    model = FaultInjectingModel(hang_rate=1.0, hang_seconds=2.0)
+    caller = make_caller(timeout=0.2, max_retries=0)
+
+    started = time.monotonic()
+    with pytest.raises(CallTimeoutError):
+        caller.call(model.generate_content, "prompt")
+
+    assert time.monotonic() - started < 1.0
+    assert caller.stats()['timeouts'] == 1
+
+
+def test_deadline_bounds_retries_of_hung_calls():
+    model = FaultInjectingModel(hang_rate=1.0, hang_seconds=5.0)
+    caller = make_caller(timeout=0.5, deadline=1.2, max_retries=5)
+
+    started = time.monotonic()
+    with pytest.raises(CallTimeoutError):
+        caller.call(model.generate_content, "prompt")
+
+    assert time.monotonic() - started < 1.5
+    assert model.calls == 1
+    assert caller.stats()['deadlines_exceeded'] == 1
+
+
+def test_error_then_success_is_retried(seed_failing_first_call):
+    model = FaultInjectingModel(error_rate=0.5, seed=seed_failing_first_call(0.5))
+    caller = make_caller(max_retries=2)
+
+    response = caller.call(model.generate_content, "prompt")
+
+    assert response.text == FaultInjectingModel().generate_content("prompt").text
+    assert model.calls == 2
+    stats = caller.stats()
+    assert stats['retries'] == 1
+    assert stats['successes'] == 1
+    assert stats['breaker_state'] == CircuitBreaker.CLOSED
+
+
+def test_non_retryable_error_is_not_retried():
+    model = FaultInjectingModel(error_rate=1.0, error_code=400)
+    caller = make_caller(max_retries=2)
+
+    with pytest.raises(InjectedFault):
+        caller.call(model.generate_content, "prompt")
+
+    assert model.calls == 1
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_and_short_circuits():
+    model = FaultInjectingModel(error_rate=1.0)
+    caller = make_caller(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+    for _ in range(2):
+        with pytest.raises(InjectedFault):
+            caller.call(model.generate_content, "prompt")
+    with pytest.raises(CircuitOpenError):
+        caller.call(model.generate_content, "prompt")
+
+    assert model.calls == 2
+    stats = caller.stats()
+    assert stats['breaker_state'] == CircuitBreaker.OPEN
+    assert stats['short_circuited'] == 1
+
+
+def test_breaker_closes_after_successful_probe():
+    model = FaultInjectingModel(error_rate=1.0)
+    caller = make_caller(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+
+    with pytest.raises(InjectedFault):
+        caller.call(model.generate_content, "prompt")
+    assert caller.breaker.state == CircuitBreaker.OPEN
+
+    model.error_rate = 0.0
+    time.sleep(0.1)
+    caller.call(model.generate_content, "prompt")
+
+    assert caller.breaker.state == CircuitBreaker.CLOSED
+    assert model.calls == 2
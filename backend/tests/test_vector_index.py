@@ -0,0 +1,23 @@
+import os
+
+from services import vector_index
+from services.vector_index import get_chapter_index
+
+
+def chapter(name, content_hash, syllabus):
+    return {"chapter": name, "content_hash": content_hash, "syllabus": syllabus}
+
+
+def test_new_content_replaces_the_chapters_old_index_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('VECTOR_INDEX_DIR', str(tmp_path))
+    monkeypatch.setattr(vector_index, '_indexes', vector_index.OrderedDict())
+    (tmp_path / 'abc123.npz').write_bytes(b'')  # written before names carried the chapter
+
+    get_chapter_index(chapter("Moles", "aaaa", "A mole contains Avogadro's number of particles."))
+    get_chapter_index(chapter("Salts", "bbbb", "Soluble salts are made by titration."))
+    get_chapter_index(chapter("Moles", "cccc", "Molar mass is the mass of one mole."))
+
+    names = sorted(os.listdir(tmp_path))
+    assert len(names) == 2
+    assert any(name.endswith('-bbbb.npz') for name in names)
+    assert any(name.endswith('-cccc.npz') for name in names)
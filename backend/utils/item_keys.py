@@ -0,0 +1,14 @@
+import hashlib
+from typing import Dict, List
+
+
+def item_key(item: Dict) -> str:
+    """Identity of a question across forms: its normalised stem and options"""
+    text = ' '.join(str(item.get('question', '')).lower().split())
+    options = '|'.join(' '.join(str(option).lower().split()) for option in item.get('options') or [])
+    return hashlib.sha1(f"{text}\n{options}".encode('utf-8')).hexdigest()[:16]
+
+
+def form_key(keys: List[str]) -> str:
+    """Identity of a form: its item keys in order, so every row serving the same test pools together"""
+    return hashlib.sha1('\n'.join(keys).encode('utf-8')).hexdigest()[:16]
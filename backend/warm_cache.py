@@ -0,0 +1,278 @@
+"""
+Precompute per-chapter artifacts so the first students after a deploy or a
+content update do not pay for them.
+
+    python warm_cache.py                      # every chapter, every stage
+    python warm_cache.py --chapters Stoichiometry --stages extract,teach
+    python warm_cache.py --refresh            # re-extract PDFs after a content update
+
+The run ends by rewriting the memory-mapped chapter corpus that workers serve from
+and recalibrating the adaptive diagnostic item bank from submitted results.
+
+CPU work (PDF download, text extraction, answer-key, item and TF-IDF indexing) runs
+in a process pool. Model calls run in a separate, rate-limited thread lane.
+Every artifact is checked before it is built, so an interrupted run resumes
+where it stopped.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+# Always read fresh chapter content here; the corpus is rewritten at the end of the run
+os.environ['CHAPTER_CORPUS'] = 'off'
+
+from services.supabase_service import SupabaseService
+from services.chapter_loader import ChapterLoader, forget_pdf_text, build_ai_context, clear_corpus_checks
+from services.chapter_corpus import ChapterCorpus, write_corpus, corpus_path
+from services.cache import get_cache
+from services.vector_index import get_chapter_index
+from services.gemini_service import GeminiService, DIAGNOSTIC_BANK_SIZE
+from services.diagnostic_validation import validation_stats
+from services.llm_ledger import llm_context
+from services.item_analysis import get_item_analysis
+from services.tutor_service import TutorService, generate_mcqs, mcq_pool_key, MCQ_POOL_SIZE
+
+STAGES = ["extract", "corpus", "calibrate", "teach", "mcq", "diagnostic"]
+DIFFICULTIES = ["easy", "medium", "hard"]
+MCQ_BATCH = 10
+
+
+class RateLimiter:
+    """Token bucket shared by the LLM lane threads"""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Report:
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.done = 0
+        self.stages: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def add_total(self, count: int):
+        with self._lock:
+            self.total += count
+
+    def record(self, stage: str, label: str, status: str, seconds: float, detail: str = ""):
+        with self._lock:
+            self.done += 1
+            entry = self.stages.setdefault(stage, {"ok": 0, "skipped": 0, "failed": 0, "seconds": 0.0, "slowest": 0.0})
+            entry[status] += 1
+            entry["seconds"] += seconds
+            entry["slowest"] = max(entry["slowest"], seconds)
+            print(f"[{self.done:>4}/{self.total}] {stage:<10} {label:<40} {status:<7} {seconds:6.2f}s {detail}", flush=True)
+
+    def print_summary(self, wall_seconds: float):
+        print("\nStage       ok  skipped  failed   total(s)   mean(s)  slowest(s)")
+        for stage in STAGES:
+            entry = self.stages.get(stage)
+            if not entry:
+                continue
+            runs = entry["ok"] + entry["failed"]
+            mean = entry["seconds"] / runs if runs else 0.0
+            print(f"{stage:<10} {entry['ok']:>3} {entry['skipped']:>8} {entry['failed']:>7} "
+                  f"{entry['seconds']:>10.2f} {mean:>9.2f} {entry['slowest']:>11.2f}")
+        print(f"\nWall time: {wall_seconds:.2f}s")
+
+
+def prepare_chapter(chapter: str, refresh: bool) -> Dict:
+    """Process-pool task: download and extract PDFs, build the answer-key, item and retrieval indexes"""
+    started = time.perf_counter()
+    try:
+        if refresh:
+            forget_pdf_text(chapter)
+        context = ChapterLoader().build_ai_context(chapter)
+        if "error" in context:
+            return {"chapter": chapter, "error": context["error"], "seconds": time.perf_counter() - started}
+        index = get_chapter_index(context)
+        return {
+            "chapter": chapter,
+            "content_hash": context["content_hash"],
+            "has_content": bool(context.get("syllabus") or context.get("past_paper_text") or context.get("answer_key_text")),
+            "detail": f"{len(context.get('past_paper_text', ''))} paper chars, {len(context.get('answer_key_index', {}))} keyed answers, {len(index.chunks)} indexed chunks",
+            "seconds": time.perf_counter() - started
+        }
+    except Exception as e:
+        return {"chapter": chapter, "error": str(e), "seconds": time.perf_counter() - started}
+
+
+def rebuild_corpus(chapters: List[str], report: Report):
+    """Write the shared chapter corpus: this run's chapters plus any others already in it"""
+    started = time.perf_counter()
+    try:
+        contexts = {}
+        path = corpus_path()
+        if os.path.exists(path):
+            existing = ChapterCorpus(path)
+            contexts = {chapter: existing.context(chapter) for chapter in existing.chapters()}
+        for chapter in chapters:
+            context = build_ai_context(chapter)
+            if "error" not in context:
+                contexts[chapter] = context
+        written = write_corpus(contexts.values(), path)
+        for chapter in chapters:
+            if chapter in contexts:
+                clear_corpus_checks(chapter, contexts[chapter]["content_hash"])
+        report.record("corpus", path, "ok", time.perf_counter() - started,
+                      f"{written['chapters']} chapters, {written['bytes']} bytes")
+    except Exception as e:
+        report.record("corpus", "chapter corpus", "failed", time.perf_counter() - started, str(e))
+
+
+def recalibrate_items(chapter: str, report: Report):
+    """Rebuild a chapter's adaptive item calibration from every submitted fixed-form sheet"""
+    started = time.perf_counter()
+    try:
+        sheets = SupabaseService().get_chapter_graded_sheets(chapter)
+        analysis = get_item_analysis()
+        analysis.reset_item_calibration(chapter)
+        for sheet in sheets:
+            analysis.record_item_responses(chapter, sheet["keys"], sheet["buckets"], sheet["correctness"],
+                                           lambda sheet=sheet: sheet["questions"])
+        report.record("calibrate", chapter, "ok", time.perf_counter() - started,
+                      f"{len(sheets)} sheets, {len(analysis.item_calibration(chapter))} items")
+    except Exception as e:
+        report.record("calibrate", chapter, "failed", time.perf_counter() - started, str(e))
+
+
+def plan_llm_tasks(chapter: str, content_hash: str, stages: List[str]):
+    """Model calls still missing for a chapter, and the artifacts already cached"""
+    context = {"content_hash": content_hash}
+    tasks, skipped = [], []
+
+    if "teach" in stages:
+        if get_cache('teach').get(content_hash):
+            skipped.append(("teach", chapter))
+        else:
+            tasks.append(("teach", chapter, None))
+
+    if "mcq" in stages:
+        for difficulty in DIFFICULTIES:
+            missing = MCQ_POOL_SIZE - len(get_cache('mcq_pool').get(mcq_pool_key(context, difficulty)) or [])
+            if missing <= 0:
+                skipped.append(("mcq", f"{chapter} ({difficulty})"))
+            tasks.extend(("mcq", chapter, difficulty) for _ in range(-(-max(missing, 0) // MCQ_BATCH)))
+
+    if "diagnostic" in stages:
+        missing = DIAGNOSTIC_BANK_SIZE - len(get_cache('diagnostic_bank').get(content_hash) or [])
+        if missing <= 0:
+            skipped.append(("diagnostic", chapter))
+        tasks.extend(("diagnostic", chapter, None) for _ in range(max(missing, 0)))
+
+    return tasks, skipped
+
+
+def run_llm_task(kind: str, chapter: str, difficulty: Optional[str], limiter: RateLimiter, report: Report):
+    limiter.acquire()
+    started = time.perf_counter()
+    label = f"{chapter} ({difficulty})" if difficulty else chapter
+    try:
+        with llm_context(route=f"warm_cache:{kind}", chapter=chapter):
+            error = _run_llm_task(kind, chapter, difficulty)
+        report.record(kind, label, "failed" if error else "ok", time.perf_counter() - started, error or "")
+    except Exception as e:
+        report.record(kind, label, "failed", time.perf_counter() - started, str(e))
+
+
+def _run_llm_task(kind: str, chapter: str, difficulty: Optional[str]) -> Optional[str]:
+    """One model task; returns its error, if any"""
+    if kind == "teach":
+        result = TutorService().tutor_response(chapter)
+        return result["response"] if result.get("mode") == "error" or result["response"].startswith("Error generating response") else None
+    if kind == "mcq":
+        result = generate_mcqs(chapter, difficulty, count=MCQ_BATCH, use_pool=False)
+    else:
+        result = GeminiService().generate_diagnostic(chapter, use_bank=False)
+    return result.get("error")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Warm per-chapter caches")
+    parser.add_argument("--chapters", help="Comma-separated chapter names (default: all chemistry_chapters)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Processes for PDF extraction and indexing")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Concurrent model calls")
+    parser.add_argument("--llm-rate", type=float, default=30, help="Maximum model calls per minute")
+    parser.add_argument("--refresh", action="store_true", help="Re-download and re-extract PDFs")
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    chapters = [c.strip() for c in args.chapters.split(",")] if args.chapters else SupabaseService().get_available_chapters()
+    if not chapters:
+        print("No chapters found")
+        return 1
+
+    started = time.perf_counter()
+    report = Report(total=len(chapters))
+    limiter = RateLimiter(args.llm_rate)
+    llm_stages = [stage for stage in stages if stage not in ("extract", "corpus", "calibrate")]
+    extracted = []
+
+    # Extraction always runs (cached text makes it cheap) because later stages need the content hash
+    with ProcessPoolExecutor(max_workers=args.workers) as processes, \
+            ThreadPoolExecutor(max_workers=args.llm_concurrency) as llm_lane:
+        prepared = [processes.submit(prepare_chapter, chapter, args.refresh) for chapter in chapters]
+        llm_futures = []
+        for future in as_completed(prepared):
+            outcome = future.result()
+            if outcome.get("error"):
+                report.record("extract", outcome["chapter"], "failed", outcome["seconds"], outcome["error"])
+                continue
+            report.record("extract", outcome["chapter"], "ok", outcome["seconds"], outcome["detail"])
+            extracted.append(outcome["chapter"])
+            if not outcome["has_content"]:
+                continue
+
+            # Start this chapter's model calls while other chapters are still extracting
+            tasks, skipped = plan_llm_tasks(outcome["chapter"], outcome["content_hash"], llm_stages)
+            report.add_total(len(tasks) + len(skipped))
+            for stage, label in skipped:
+                report.record(stage, label, "skipped", 0.0)
+            llm_futures += [llm_lane.submit(run_llm_task, *task, limiter, report) for task in tasks]
+
+        if "corpus" in stages:
+            report.add_total(1)
+            rebuild_corpus(extracted, report)
+
+        if "calibrate" in stages:
+            report.add_total(len(extracted))
+            for chapter in extracted:
+                recalibrate_items(chapter, report)
+
+        for future in llm_futures:
+            future.result()
+
+    report.print_summary(time.perf_counter() - started)
+    checks = validation_stats()
+    if checks["diagnostics"]:
+        print(f"Diagnostic validation: {checks['repaired']}/{checks['diagnostics']} tests repaired, "
+              f"{checks['llm_calls']} repair calls vs ~{checks['full_retry_calls_estimate']} for full retries "
+              f"({checks['llm_calls_saved']} saved)")
+    failed = sum(entry["failed"] for entry in report.stages.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,6 +14,8 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(true)
   const [generatingRoadmap, setGeneratingRoadmap] = useState(false)
   const [dashboardData, setDashboardData] = useState(null)
+  const [resultDetails, setResultDetails] = useState({})
+  const [loadingMore, setLoadingMore] = useState(false)
   const [error, setError] = useState('')
   
   // Prevent automatic refetch on window focus/reconnect
@@ -63,6 +65,49 @@ const Dashboard = () => {
     loadDashboard()
   }, [user?.id]) // Use user?.id instead of user to prevent re-runs on object reference changes
 
+  // Dashboard results are compact summaries; per-question details load when the tab opens
+  useEffect(() => {
+    if (activeTab !== 'test-details' || !user || !dashboardData?.results) return
+
+    const missing = dashboardData.results.filter(
+      (result) => !result.results && !(result.id in resultDetails)
+    )
+    if (missing.length === 0) return
+
+    setResultDetails((prev) => {
+      const next = { ...prev }
+      missing.forEach((result) => { next[result.id] = null })
+      return next
+    })
+
+    missing.forEach(async (result) => {
+      try {
+        const detail = await api.getDiagnosticResult(user.id, result.id)
+        setResultDetails((prev) => ({ ...prev, [result.id]: detail.results || [] }))
+      } catch (err) {
+        setResultDetails((prev) => ({ ...prev, [result.id]: [] }))
+      }
+    })
+  }, [activeTab, dashboardData?.results, user?.id])
+
+  const handleLoadMoreResults = async () => {
+    if (!user || !dashboardData?.next_cursor) return
+
+    setLoadingMore(true)
+    try {
+      const data = await api.getDashboard(user.id, dashboardData.next_cursor)
+      setDashboardData((prev) => ({
+        ...prev,
+        results: [...(prev.results || []), ...(data.results || [])],
+        next_cursor: data.next_cursor,
+      }))
+    } catch (err) {
+      setError(err.message || 'Failed to load more results')
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   // Disable automatic refetch on window focus/visibility change/network reconnect
   // Protection is handled via refs in the loadDashboard useEffect above
   // No event listeners needed - refs prevent refetch on re-renders
@@ -297,7 +342,10 @@ const Dashboard = () => {
             {/* Question Results */}
             <div className="space-y-4">
               <h4 className="font-semibold text-gray-900">Question Details:</h4>
-              {(result.results || []).map((qResult, idx) => (
+              {resultDetails[result.id] === null && (
+                <p className="text-sm text-gray-500">Loading question details...</p>
+              )}
+              {(result.results || resultDetails[result.id] || []).map((qResult, idx) => (
                 <div
                   key={idx}
                   className={`border-2 rounded-lg p-4 ${
@@ -350,6 +398,13 @@ const Dashboard = () => {
           </div>
         ))
       )}
+      {dashboardData?.next_cursor && (
+        <div className="text-center">
+          <Button onClick={handleLoadMoreResults} disabled={loadingMore} variant="outline">
+            {loadingMore ? 'Loading...' : 'Load older results'}
+          </Button>
+        </div>
+      )}
     </div>
   )
 
@@ -54,8 +54,15 @@ class ApiService {
     })
   }
 
-  async getDashboard(userId) {
-    return this.request(`/dashboard?user_id=${userId}`, {
+  async getDashboard(userId, cursor = null) {
+    const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''
+    return this.request(`/dashboard?user_id=${userId}${cursorParam}`, {
+      method: 'GET',
+    })
+  }
+
+  async getDiagnosticResult(userId, resultId) {
+    return this.request(`/diagnostic-result?user_id=${userId}&result_id=${resultId}`, {
       method: 'GET',
     })
   }
@@ -0,0 +1,44 @@
+-- ============================================
+-- Enforce one diagnostic per user and chapter
+-- Backs the per-(user_id, chapter) generation lock in the backend:
+-- concurrent /generate-diagnostic requests on different hosts cannot
+-- both insert, and the loser reuses the stored row
+-- ============================================
+
+-- Remove duplicate diagnostics, keeping the one with submitted results
+-- (or the most recent one when none were submitted).
+-- diagnostic_results.diagnostic_id cascades on delete, so results on a
+-- duplicate are first moved to the surviving row; each result stores its
+-- own answers and per-question outcomes, so nothing is lost.
+BEGIN;
+
+CREATE TEMP TABLE diagnostic_duplicates ON COMMIT DROP AS
+SELECT id, keep_id
+FROM (
+  SELECT id,
+         FIRST_VALUE(id) OVER w AS keep_id,
+         ROW_NUMBER() OVER w AS rn
+  FROM public.diagnostics
+  WINDOW w AS (
+    PARTITION BY user_id, chapter
+    ORDER BY EXISTS (
+      SELECT 1 FROM public.diagnostic_results r WHERE r.diagnostic_id = diagnostics.id
+    ) DESC, created_at DESC
+  )
+) ranked
+WHERE rn > 1;
+
+UPDATE public.diagnostic_results r
+SET diagnostic_id = dup.keep_id
+FROM diagnostic_duplicates dup
+WHERE r.diagnostic_id = dup.id;
+
+DELETE FROM public.diagnostics d
+USING diagnostic_duplicates dup
+WHERE d.id = dup.id;
+
+COMMIT;
+
+-- Unique index on (user_id, chapter)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_diagnostics_user_chapter_unique
+  ON public.diagnostics(user_id, chapter);